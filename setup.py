@@ -6,7 +6,10 @@ setup(
     package_dir={"": "src"},
     packages=find_packages(where="src"),
     install_requires=[
-        "langgraph",
+        # durability=, delete_thread y put_writes(task_path) son de langgraph 1.x
+        "langgraph>=1.0.0",
+        "langgraph-checkpoint>=3.0.0",
+        "langgraph-checkpoint-sqlite>=3.0.0",
         "langchain-openai",
         "langchain-core",
         "httpx",
@@ -14,5 +17,6 @@ setup(
         "fastapi",
         "uvicorn",
         "pydantic",
+        "numpy",
     ],
 )
@@ -0,0 +1,220 @@
+# audit_queue.py
+
+import asyncio
+import json
+import os
+import random
+from pathlib import Path
+from typing import List, Optional
+
+from ai_engine.http_client import data_layer_client, record_error
+
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "50"))
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", "1.0"))
+AUDIT_MAX_RETRIES = int(os.getenv("AUDIT_MAX_RETRIES", "3"))
+AUDIT_QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", "10000"))
+AUDIT_JOURNAL_PATH = os.getenv("AUDIT_JOURNAL_PATH", "audit_journal.ndjson")
+# Registros que Django rechaza (207/400): reintentarlos no sirve, pero tampoco se descartan
+AUDIT_DEAD_LETTER_PATH = os.getenv("AUDIT_DEAD_LETTER_PATH", "audit_rejected.ndjson")
+
+
+class AuditWriter:
+    """
+    Escritor de auditoría en segundo plano.
+    Los nodos encolan registros sin esperar a Django; una tarea los envía por lotes
+    (por tamaño o por tiempo), reintenta con backoff y, si Django no responde,
+    los vuelca a un diario NDJSON local que se reenvía cuando el servicio vuelve.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = AUDIT_BATCH_SIZE,
+        flush_interval: float = AUDIT_FLUSH_INTERVAL,
+        max_retries: int = AUDIT_MAX_RETRIES,
+        queue_size: int = AUDIT_QUEUE_SIZE,
+        journal_path: str = AUDIT_JOURNAL_PATH,
+        dead_letter_path: str = AUDIT_DEAD_LETTER_PATH,
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.queue_size = queue_size
+        self.journal_path = Path(journal_path)
+        self.dead_letter_path = Path(dead_letter_path)
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"enqueued": 0, "sent": 0, "batches": 0, "retries": 0, "spilled": 0, "replayed": 0,
+                      "rejected": 0}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    # --- API PARA LOS NODOS ---
+
+    async def record(self, item: dict, config: Optional[dict] = None):
+        """Registra una auditoría. Con el escritor activo no bloquea nunca."""
+        if not self.running:
+            # Fuera de FastAPI (p.ej. Streamlit) no hay tarea de fondo: envío directo.
+            # shield: si se cancela la consulta, el registro ya emitido termina de enviarse
+            await asyncio.shield(self._deliver([item], config))
+            return
+        try:
+            self._queue.put_nowait(item)
+            self.stats["enqueued"] += 1
+        except asyncio.QueueFull:
+            await self._spill([item])
+
+    # --- CICLO DE VIDA (lifespan de main.py) ---
+
+    async def start(self):
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._task = asyncio.create_task(self._run(), name="audit-writer")
+
+    async def stop(self):
+        """Vacía la cola pendiente antes de apagar el servicio."""
+        if not self.running:
+            return
+        await self._queue.put(None)  # Centinela de fin
+        await self._task
+        self._task = None
+
+    # --- INTERNOS ---
+
+    async def _run(self):
+        await self._replay_journal()
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            # Acumulamos hasta llenar el lote o agotar la ventana de tiempo
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            if await self._deliver(batch):
+                await self._replay_journal()
+
+    async def _send_batch(self, client, batch: List[dict]):
+        # Un único POST por lote: Django lo inserta con bulk_create en una transacción
+        response = await client.post("/audit-logs/bulk/", json=batch)
+        if response.status_code in (207, 400):
+            # Registros inválidos: reintentarlos no sirve, van al fichero de rechazados
+            await self._dead_letter(self._rejected(batch, response))
+            return
+        response.raise_for_status()
+
+    @staticmethod
+    def _rejected(batch: List[dict], response) -> List[dict]:
+        """
+        Registros rechazados con su error. El cuerpo se analiza una vez; si no es un dict con
+        'results' por elemento (p.ej. una lista de errores de DRF o un cuerpo no JSON), se
+        rechaza el lote entero con el cuerpo tal cual.
+        """
+        try:
+            body = response.json()
+        except ValueError:
+            body = response.text
+        results = body.get("results") if isinstance(body, dict) else None
+        if not isinstance(results, list):
+            return [{"record": item, "errors": body, "status": response.status_code} for item in batch]
+        return [{"record": batch[r["index"]], "errors": r["errors"]}
+                for r in results if isinstance(r, dict) and "errors" in r]
+
+    async def _deliver(self, batch: List[dict], config: Optional[dict] = None) -> bool:
+        """Envía el lote con reintentos; si fallan todos, lo guarda en el diario."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with data_layer_client(config) as client:
+                    await self._send_batch(client, batch)
+                self.stats["sent"] += len(batch)
+                self.stats["batches"] += 1
+                return True
+            except Exception as e:
+                record_error()
+                if attempt == self.max_retries:
+                    print(f"❌ Error al guardar auditoría ({len(batch)} registros): {e}")
+                    break
+                self.stats["retries"] += 1
+                # Backoff exponencial con jitter para no sincronizar reintentos
+                await asyncio.sleep(min(0.1 * 2 ** attempt, 5.0) * (0.5 + random.random()))
+        await self._spill(batch)
+        return False
+
+    async def _spill(self, batch: List[dict]):
+        if not batch:
+            return
+        await asyncio.to_thread(self._append, self.journal_path, self._ndjson(batch))
+        self.stats["spilled"] += len(batch)
+
+    async def _dead_letter(self, rejected: List[dict]):
+        if not rejected:
+            return
+        await asyncio.to_thread(self._append, self.dead_letter_path, self._ndjson(rejected))
+        self.stats["rejected"] += len(rejected)
+        print(f"⚠️ Auditoría: {len(rejected)} registros rechazados por Django (en {self.dead_letter_path})")
+
+    @staticmethod
+    def _ndjson(items: List[dict]) -> str:
+        return "".join(json.dumps(item, ensure_ascii=False) + "\n" for item in items)
+
+    @staticmethod
+    def _append(path: Path, lines: str):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("a", encoding="utf-8") as f:
+            f.write(lines)
+
+    @property
+    def _replay_path(self) -> Path:
+        return self.journal_path.with_suffix(self.journal_path.suffix + ".replay")
+
+    def _take_journal(self) -> List[dict]:
+        """
+        Pasa el diario al fichero .replay y devuelve su contenido. Si quedó un .replay de
+        una caída anterior, el diario se le añade en lugar de sobrescribirlo.
+        """
+        pending = self._replay_path
+        if self.journal_path.exists():
+            if pending.exists():
+                self._append(pending, self.journal_path.read_text(encoding="utf-8"))
+                self.journal_path.unlink()
+            else:
+                self.journal_path.replace(pending)
+        if not pending.exists():
+            return []
+        text = pending.read_text(encoding="utf-8")
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+    async def _replay_journal(self):
+        """
+        Reenvía lo acumulado en el diario; lo que vuelva a fallar regresa al diario. El
+        .replay solo se borra cuando todo está entregado o de nuevo en el diario: una caída
+        a mitad reenvía el fichero completo en el siguiente arranque (al menos una vez).
+        """
+        if not self.journal_path.exists() and not self._replay_path.exists():
+            return
+        items = await asyncio.to_thread(self._take_journal)
+        for i in range(0, len(items), self.batch_size):
+            batch = items[i:i + self.batch_size]
+            if not await self._deliver(batch):
+                # Django sigue caído: _deliver ya devolvió el lote al diario; el resto también
+                await self._spill(items[i + self.batch_size:])
+                break
+            self.stats["replayed"] += len(batch)
+        await asyncio.to_thread(self._replay_path.unlink, missing_ok=True)
+
+audit_writer = AuditWriter()
@@ -0,0 +1,115 @@
+# checkpoint_bench.py
+"""
+Coste de los checkpoints por paso del grafo, sin red (LLM simulado y capa de datos
+falsa servida en proceso):
+
+  - none:           grafo sin checkpointer (referencia)
+  - memory:         MemorySaver
+  - sqlite-<modo>:  PrunedSqliteSaver (WAL) con durability exit / async / sync
+  - sqlite-raw:     igual que sqlite-sync pero sin compresión zlib
+
+    python -m ai_engine.benchmarks.checkpoint_bench --runs 200 --history-kb 8
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+
+import httpx
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer  # noqa: E402
+
+from ai_engine import graph_engine  # noqa: E402
+from ai_engine.benchmarks import fake_data_layer  # noqa: E402
+from ai_engine.cache import patient_cache  # noqa: E402
+from ai_engine.checkpoint import PrunedSqliteSaver  # noqa: E402
+from ai_engine.fake_llm import FakeStreamingChatModel  # noqa: E402
+from langchain_core.messages import HumanMessage  # noqa: E402
+
+
+def build_variants(tmpdir: str) -> dict:
+    from langgraph.checkpoint.memory import MemorySaver
+
+    def sqlite(name, **kwargs):
+        return PrunedSqliteSaver.from_path(os.path.join(tmpdir, f"{name}.sqlite"), prune_every=0, **kwargs)
+
+    return {
+        "none": (None, None),
+        "memory": (MemorySaver(), "sync"),
+        "sqlite-exit": (sqlite("exit"), "exit"),
+        "sqlite-async": (sqlite("async"), "async"),
+        "sqlite-sync": (sqlite("sync"), "sync"),
+        "sqlite-raw": (sqlite("raw", serde=JsonPlusSerializer()), "sync"),
+    }
+
+
+async def run_variant(name, saver, durability, runs: int, client: httpx.AsyncClient) -> dict:
+    graph = graph_engine.build_graph(checkpointer=saver)
+    puts_before = saver.stats["puts"] if isinstance(saver, PrunedSqliteSaver) else 0
+    timings = []
+    for n in range(runs):
+        state = {
+            "messages": [HumanMessage(content=f"El paciente presenta: cefalea {n}")],
+            "patient_data": {"patient_id": f"PAC-{n % 20}", "urgency_level": 1},
+            "resource_focus": "Consulta General",
+            "safety_check_passed": False,
+        }
+        config = {"configurable": {"thread_id": f"{name}-{n % 50}", "http_client": client}}
+        kwargs = {"durability": durability} if saver is not None else {}
+        start = time.perf_counter()
+        await graph.ainvoke(state, config=config, **kwargs)
+        timings.append(time.perf_counter() - start)
+
+    result = {
+        "variant": name,
+        "run_ms_p50": round(statistics.median(timings) * 1000, 3),
+        "run_ms_mean": round(statistics.fmean(timings) * 1000, 3),
+    }
+    if isinstance(saver, PrunedSqliteSaver):
+        size = saver.size()
+        result["puts_per_run"] = round((saver.stats["puts"] - puts_before) / runs, 2)
+        result["bytes_per_checkpoint"] = round(size["checkpoint_bytes"] / max(size["checkpoints"], 1))
+    return result
+
+
+async def main_async(runs: int, history_kb: int) -> list:
+    # Historial largo para que el tamaño del estado sea realista
+    history = ("Hipertensión controlada con enalapril. Revisión anual sin incidencias. " * 64)[: history_kb * 1024]
+    original = fake_data_layer._patient
+    fake_data_layer._patient = lambda pid: {**original(pid), "clinical_history": history}
+    graph_engine.llm = FakeStreamingChatModel(ttft=0, token_delay=0, output_tokens=120)
+
+    transport = httpx.ASGITransport(app=fake_data_layer.app)
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        async with httpx.AsyncClient(transport=transport, base_url="http://fake/api") as client:
+            for name, (saver, durability) in build_variants(tmpdir).items():
+                patient_cache.clear()
+                await run_variant(name, saver, durability, 10, client)  # calentamiento
+                patient_cache.clear()
+                results.append(await run_variant(name, saver, durability, runs, client))
+
+    base = results[0]["run_ms_mean"]
+    for r in results[1:]:
+        r["overhead_ms_per_run"] = round(r["run_ms_mean"] - base, 3)
+        if r.get("puts_per_run"):
+            r["overhead_ms_per_checkpoint"] = round(r["overhead_ms_per_run"] / r["puts_per_run"], 3)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--history-kb", type=int, default=4, help="tamaño del historial clínico simulado")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(main_async(args.runs, args.history_kb)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# fake_data_layer.py
+"""
+Stub de la capa de datos Django para benchmarks offline.
+Sirve los endpoints que usa el motor de IA con latencia configurable:
+
+    python -m ai_engine.benchmarks.fake_data_layer --port 8001 --latency-ms 5
+"""
+
+import argparse
+import asyncio
+import os
+
+import uvicorn
+from fastapi import FastAPI, Request
+
+LATENCY = float(os.getenv("FAKE_DATA_LAYER_LATENCY_MS", "5")) / 1000
+
+app = FastAPI(title="OmniCare Fake Data Layer")
+stats = {"patients": 0, "audit_records": 0}
+
+
+def _patient(patient_id: str) -> dict:
+    return {
+        "patient_id": patient_id,
+        "name": f"Paciente {patient_id}",
+        "clinical_history": "Hipertensión controlada. Alergia a penicilina. Sin cirugías previas.",
+    }
+
+
+@app.get("/api/patients/{patient_id}/")
+async def get_patient(patient_id: str):
+    await asyncio.sleep(LATENCY)
+    stats["patients"] += 1
+    return _patient(patient_id)
+
+
+@app.get("/api/patient-context/{patient_id}/")
+async def get_patient_context(patient_id: str, consultas: int = 5):
+    await asyncio.sleep(LATENCY)
+    stats["patients"] += 1
+    recientes = [
+        {"mensaje_usuario": "Dolor de cabeza leve", "respuesta_ia": "Reposo e hidratación",
+         "dolor": 3, "urgencia": 2, "riesgo": 1, "fecha": "2025-01-0%d 10:00" % (9 - i)}
+        for i in range(min(consultas, 3))
+    ]
+    return {
+        **_patient(patient_id),
+        "consultas": recientes,
+        "metricas": {"total": 3, "dolor_medio": 3.0, "urgencia_media": 2.0, "urgencia_max": 2,
+                     "riesgo_medio": 1.0, "ultima_consulta": "2025-01-09 10:00"},
+    }
+
+
+@app.post("/api/audit-logs/bulk/", status_code=201)
+async def bulk_audit(request: Request):
+    await asyncio.sleep(LATENCY)
+    items = await request.json()
+    stats["audit_records"] += len(items)
+    return {
+        "created": len(items),
+        "errors": 0,
+        "results": [{"index": i, "id": stats["audit_records"] - len(items) + i + 1} for i in range(len(items))],
+    }
+
+
+@app.get("/stats")
+async def get_stats():
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency-ms", type=float, default=LATENCY * 1000)
+    args = parser.parse_args()
+    LATENCY = args.latency_ms / 1000
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
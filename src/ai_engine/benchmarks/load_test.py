@@ -0,0 +1,124 @@
+# load_test.py
+"""
+Generador de carga en lazo abierto para /analyze y /analyze-stream.
+Lanza peticiones a un ritmo fijo (RPS objetivo) e informa de throughput,
+latencias p50/p95/p99 y tiempo hasta el primer token (TTFT) del stream.
+
+Línea base reproducible sin red (tres terminales):
+
+    python -m ai_engine.benchmarks.fake_data_layer --port 8001
+    LLM_PROVIDER=fake uvicorn ai_engine.main:app --port 8000
+    python -m ai_engine.benchmarks.load_test --rps 20 --duration 30 --endpoint both
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import time
+from typing import List, Optional
+
+import httpx
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Percentil por interpolación lineal (q en [0, 100])."""
+    if not values:
+        return None
+    data = sorted(values)
+    pos = (len(data) - 1) * q / 100
+    lo = int(pos)
+    hi = min(lo + 1, len(data) - 1)
+    return data[lo] + (data[hi] - data[lo]) * (pos - lo)
+
+
+class Results:
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies: List[float] = []
+        self.ttfts: List[float] = []
+        self.errors = 0
+
+    def summary(self, duration: float) -> dict:
+        def ms(v):
+            return None if v is None else round(v * 1000, 1)
+
+        return {
+            "endpoint": self.name,
+            "ok": len(self.latencies),
+            "errors": self.errors,
+            "throughput_rps": round(len(self.latencies) / duration, 2),
+            "latency_ms": {f"p{q}": ms(percentile(self.latencies, q)) for q in (50, 95, 99)},
+            "ttft_ms": {f"p{q}": ms(percentile(self.ttfts, q)) for q in (50, 95, 99)} if self.ttfts else None,
+        }
+
+
+def build_payload(n: int, unique: bool) -> dict:
+    # Síntomas únicos por defecto: evita que la caché o la coalescencia falseen la medida
+    symptoms = f"Dolor de cabeza y fiebre desde hace {n} horas" if unique else "Dolor de cabeza y fiebre"
+    return {"patientId": f"PAC-{n % 100}", "symptoms": symptoms, "urgencyLevel": n % 10, "consentProvided": True}
+
+
+async def call_analyze(client: httpx.AsyncClient, payload: dict, results: Results):
+    start = time.perf_counter()
+    try:
+        r = await client.post("/analyze", json=payload)
+        r.raise_for_status()
+        results.latencies.append(time.perf_counter() - start)
+    except Exception:
+        results.errors += 1
+
+
+async def call_stream(client: httpx.AsyncClient, payload: dict, results: Results):
+    start = time.perf_counter()
+    first_token = None
+    try:
+        async with client.stream("POST", "/analyze-stream", json=payload) as r:
+            r.raise_for_status()
+            async for line in r.aiter_lines():
+                if first_token is None and line.startswith("data:") and "token" in json.loads(line[5:]):
+                    first_token = time.perf_counter() - start
+        results.latencies.append(time.perf_counter() - start)
+        if first_token is not None:
+            results.ttfts.append(first_token)
+    except Exception:
+        results.errors += 1
+
+
+async def run(url: str, endpoints: List[str], rps: float, duration: float, unique: bool) -> List[dict]:
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=200)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=120.0) as client:
+        results = {e: Results(e) for e in endpoints}
+        calls = {"analyze": call_analyze, "analyze-stream": call_stream}
+        tasks = []
+        counter = itertools.count()
+        start = time.perf_counter()
+        # Lazo abierto: el ritmo de envío no depende de lo que tarden las respuestas
+        for n in counter:
+            target = start + n / rps
+            if target - start >= duration:
+                break
+            await asyncio.sleep(max(0.0, target - time.perf_counter()))
+            endpoint = endpoints[n % len(endpoints)]
+            tasks.append(asyncio.create_task(calls[endpoint](client, build_payload(n, unique), results[endpoint])))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+    return [r.summary(elapsed) for r in results.values()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--endpoint", choices=["analyze", "analyze-stream", "both"], default="both")
+    parser.add_argument("--rps", type=float, default=10.0)
+    parser.add_argument("--duration", type=float, default=30.0, help="segundos de envío")
+    parser.add_argument("--repeat-symptoms", action="store_true", help="misma consulta en cada petición")
+    args = parser.parse_args()
+
+    endpoints = ["analyze", "analyze-stream"] if args.endpoint == "both" else [args.endpoint]
+    report = asyncio.run(run(args.url, endpoints, args.rps, args.duration, not args.repeat_symptoms))
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# startup_time.py
+"""
+Mide el arranque en frío del motor de IA, cada muestra en un proceso nuevo:
+
+  - import:  tiempo de `import ai_engine.main`
+  - graph:   compilación perezosa del grafo (get_graph) tras el import
+  - ready:   (--serve) desde el lanzamiento de uvicorn hasta que /ready responde 200
+
+    python -m ai_engine.benchmarks.startup_time --runs 5 --serve
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+_PROBE = """
+import json, time
+t0 = time.perf_counter()
+import ai_engine.main
+t1 = time.perf_counter()
+from ai_engine.graph_engine import get_graph, get_llm
+get_graph(); get_llm()
+t2 = time.perf_counter()
+print(json.dumps({"import": t1 - t0, "graph": t2 - t1}))
+"""
+
+
+def _env() -> dict:
+    env = dict(os.environ)
+    env.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    return env
+
+
+def measure_import() -> dict:
+    out = subprocess.run([sys.executable, "-c", _PROBE], capture_output=True, text=True, env=_env(), check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def measure_ready(port: int, timeout: float = 60.0) -> float:
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "ai_engine.main:app", "--port", str(port), "--log-level", "warning"],
+        env=_env(),
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                if httpx.get(f"http://127.0.0.1:{port}/ready", timeout=0.5).status_code == 200:
+                    return time.perf_counter() - start
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.02)
+        raise TimeoutError("El servicio no llegó a estar listo")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--serve", action="store_true", help="mide también el tiempo hasta /ready")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    samples = {"import": [], "graph": [], "ready": []}
+    for _ in range(args.runs):
+        sample = measure_import()
+        samples["import"].append(sample["import"])
+        samples["graph"].append(sample["graph"])
+        if args.serve:
+            samples["ready"].append(measure_ready(args.port))
+
+    report = {
+        name: {"min_ms": round(min(v) * 1000, 1), "avg_ms": round(sum(v) / len(v) * 1000, 1)}
+        for name, v in samples.items() if v
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
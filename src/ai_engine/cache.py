@@ -0,0 +1,173 @@
+# cache.py
+
+import asyncio
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Caché LRU en memoria con caducidad por entrada y contadores de aciertos/fallos."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING:
+            self.misses += 1
+            return default
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            # Entrada caducada: la tratamos como un fallo
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float = None):
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> bool:
+        return self._data.pop(key, _MISSING) is not _MISSING
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+# Contexto clínico por patient_id (lo invalida Django al guardar un Patient)
+patient_cache = TTLCache(
+    maxsize=int(os.getenv("PATIENT_CACHE_SIZE", "2048")),
+    ttl=float(os.getenv("PATIENT_CACHE_TTL", "300")),
+)
+
+
+class SQLiteTTLStore:
+    """Nivel persistente (opcional) de la caché: sobrevive a reinicios del proceso."""
+
+    def __init__(self, path: str, maxsize: int = 10000, ttl: float = 3600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # Se usa desde el pool de hilos de asyncio: serializamos el acceso
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires_at)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM cache WHERE key = ? AND expires_at >= ?", (key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: str):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, time.time() + self.ttl),
+            )
+            # Purga: primero lo caducado, luego lo más antiguo por encima del límite
+            self._conn.execute("DELETE FROM cache WHERE expires_at < ?", (time.time(),))
+            self._conn.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+                (self.maxsize,),
+            )
+
+    def close(self):
+        self._conn.close()
+
+
+class ResponseCache:
+    """Caché de respuestas del analista: LRU en memoria delante de un SQLite opcional."""
+
+    def __init__(self, memory: TTLCache, store: Optional[SQLiteTTLStore] = None):
+        self.memory = memory
+        self.store = store
+        self.store_hits = 0
+
+    async def get(self, key: str) -> Optional[str]:
+        value = self.memory.get(key)
+        if value is None and self.store is not None:
+            value = await asyncio.to_thread(self.store.get, key)
+            if value is not None:
+                self.store_hits += 1
+                self.memory.set(key, value)
+        return value
+
+    async def set(self, key: str, value: str):
+        self.memory.set(key, value)
+        if self.store is not None:
+            await asyncio.to_thread(self.store.set, key, value)
+
+    def stats(self) -> dict:
+        return {**self.memory.stats(), "persistent": self.store is not None, "persistent_hits": self.store_hits}
+
+
+def normalize_text(text: str) -> str:
+    """Minúsculas, sin tildes ni signos de puntuación y con espacios colapsados."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(re.findall(r"\w+", text))
+
+
+def content_version(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+def analysis_cache_key(symptoms: str, resource_focus: str, history_version: str) -> str:
+    raw = "\x1f".join([normalize_text(symptoms), resource_focus or "", history_version or ""])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _build_analysis_cache() -> Optional[ResponseCache]:
+    # Opt-in: desactivada salvo que se indique ANALYSIS_CACHE_ENABLED=1
+    if os.getenv("ANALYSIS_CACHE_ENABLED", "0").lower() not in ("1", "true", "yes"):
+        return None
+    ttl = float(os.getenv("ANALYSIS_CACHE_TTL", "600"))
+    memory = TTLCache(maxsize=int(os.getenv("ANALYSIS_CACHE_SIZE", "512")), ttl=ttl)
+    db_path = os.getenv("ANALYSIS_CACHE_DB")
+    store = SQLiteTTLStore(db_path, int(os.getenv("ANALYSIS_CACHE_DB_MAX_ROWS", "10000")), ttl) if db_path else None
+    return ResponseCache(memory, store)
+
+
+# Respuestas del analista (None = caché desactivada)
+analysis_cache = _build_analysis_cache()
@@ -0,0 +1,211 @@
+# checkpoint.py
+
+import asyncio
+import os
+import sqlite3
+import time
+import uuid
+import zlib
+from typing import Any, AsyncIterator, Optional, Sequence
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.serde.base import SerializerProtocol
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+# sqlite (por defecto) | memory | none
+CHECKPOINTER = os.getenv("CHECKPOINTER", "sqlite").lower()
+# Directorio de datos explícito (en Docker, un volumen): nunca relativo al directorio de trabajo
+AI_ENGINE_DATA_DIR = os.getenv("AI_ENGINE_DATA_DIR", os.path.join(os.path.expanduser("~"), ".omnicare"))
+CHECKPOINT_DB = os.getenv("CHECKPOINT_DB", os.path.join(AI_ENGINE_DATA_DIR, "checkpoints.sqlite"))
+# exit: un único guardado al terminar o al pararse en interrupt_before (mínimo coste por paso)
+# async/sync: guardado tras cada paso (recuperable a mitad de ejecución)
+CHECKPOINT_DURABILITY = os.getenv("CHECKPOINT_DURABILITY", "exit")
+CHECKPOINT_KEEP_PER_THREAD = int(os.getenv("CHECKPOINT_KEEP_PER_THREAD", "2"))
+CHECKPOINT_MAX_AGE = float(os.getenv("CHECKPOINT_MAX_AGE", str(7 * 24 * 3600)))
+CHECKPOINT_MAX_THREADS = int(os.getenv("CHECKPOINT_MAX_THREADS", "10000"))
+CHECKPOINT_PRUNE_EVERY = int(os.getenv("CHECKPOINT_PRUNE_EVERY", "200"))
+CHECKPOINT_COMPRESS_MIN_BYTES = int(os.getenv("CHECKPOINT_COMPRESS_MIN_BYTES", "512"))
+
+
+class CompressedSerializer(SerializerProtocol):
+    """JsonPlus (msgpack) + zlib para los valores grandes; marca el tipo con '+zlib'."""
+
+    def __init__(self, serde: SerializerProtocol = None, min_bytes: int = CHECKPOINT_COMPRESS_MIN_BYTES, level: int = 1):
+        self.serde = serde or JsonPlusSerializer()
+        self.min_bytes = min_bytes
+        self.level = level
+
+    def dumps_typed(self, obj: Any) -> tuple:
+        typ, data = self.serde.dumps_typed(obj)
+        if len(data) >= self.min_bytes:
+            return f"{typ}+zlib", zlib.compress(data, self.level)
+        return typ, data
+
+    def loads_typed(self, data: tuple) -> Any:
+        typ, payload = data
+        if typ.endswith("+zlib"):
+            return self.serde.loads_typed((typ[:-len("+zlib")], zlib.decompress(payload)))
+        return self.serde.loads_typed(data)
+
+
+class PrunedSqliteSaver(SqliteSaver):
+    """
+    Checkpointer SQLite (WAL) con poda por antigüedad y tamaño.
+    Los métodos async delegan en un hilo: no depende del event loop en el que se cree,
+    así que sirve igual para FastAPI que para Streamlit (que crea un loop por ejecución).
+    """
+
+    def __init__(
+        self,
+        conn: sqlite3.Connection,
+        *,
+        serde: SerializerProtocol = None,
+        keep_per_thread: int = CHECKPOINT_KEEP_PER_THREAD,
+        max_age: float = CHECKPOINT_MAX_AGE,
+        max_threads: int = CHECKPOINT_MAX_THREADS,
+        prune_every: int = CHECKPOINT_PRUNE_EVERY,
+    ):
+        super().__init__(conn, serde=serde or CompressedSerializer())
+        self.keep_per_thread = max(keep_per_thread, 1)
+        self.max_age = max_age
+        self.max_threads = max_threads
+        self.prune_every = prune_every
+        self._puts = 0
+        self.stats = {"puts": 0, "writes": 0, "pruned_checkpoints": 0, "pruned_threads": 0}
+
+    @classmethod
+    def from_path(cls, path: str, **kwargs) -> "PrunedSqliteSaver":
+        conn = sqlite3.connect(path, check_same_thread=False)
+        # WAL (lo activa setup) + synchronous=NORMAL: sin fsync en cada commit
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return cls(conn, **kwargs)
+
+    def setup(self) -> None:
+        if self.is_setup:
+            return
+        super().setup()
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS thread_activity (thread_id TEXT PRIMARY KEY, updated_at REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS thread_activity_updated ON thread_activity (updated_at)")
+        self.conn.commit()
+
+    # --- ESCRITURA ---
+
+    def put(self, config, checkpoint, metadata, new_versions) -> RunnableConfig:
+        result = super().put(config, checkpoint, metadata, new_versions)
+        with self.cursor() as cur:
+            cur.execute(
+                "INSERT INTO thread_activity (thread_id, updated_at) VALUES (?, ?) "
+                "ON CONFLICT(thread_id) DO UPDATE SET updated_at = excluded.updated_at",
+                (str(config["configurable"]["thread_id"]), time.time()),
+            )
+        self.stats["puts"] += 1
+        self._puts += 1
+        if self.prune_every and self._puts >= self.prune_every:
+            self._puts = 0
+            self.prune_old()
+        return result
+
+    def put_writes(self, config, writes: Sequence[tuple], task_id: str, task_path: str = "") -> None:
+        super().put_writes(config, writes, task_id, task_path)
+        self.stats["writes"] += 1
+
+    def delete_thread(self, thread_id: str) -> None:
+        super().delete_thread(thread_id)
+        with self.cursor() as cur:
+            cur.execute("DELETE FROM thread_activity WHERE thread_id = ?", (str(thread_id),))
+
+    # --- PODA ---
+
+    def prune_old(self, now: Optional[float] = None) -> dict:
+        """
+        Borra los hilos inactivos más allá de max_age, los menos recientes por encima de
+        max_threads y, en cada hilo, los checkpoints anteriores a los keep_per_thread últimos.
+        """
+        now = time.time() if now is None else now
+        with self.cursor() as cur:
+            cur.execute("SELECT thread_id FROM thread_activity WHERE updated_at < ?", (now - self.max_age,))
+            stale = [r[0] for r in cur.fetchall()]
+            cur.execute(
+                "SELECT thread_id FROM thread_activity ORDER BY updated_at DESC LIMIT -1 OFFSET ?",
+                (self.max_threads,),
+            )
+            stale += [r[0] for r in cur.fetchall()]
+            stale = list(dict.fromkeys(stale))
+            for table in ("checkpoints", "writes", "thread_activity"):
+                cur.executemany(f"DELETE FROM {table} WHERE thread_id = ?", [(t,) for t in stale])
+
+            # Los checkpoint_id (uuid6) ordenan cronológicamente
+            cur.execute(
+                """
+                DELETE FROM checkpoints WHERE rowid IN (
+                    SELECT rowid FROM (
+                        SELECT rowid, ROW_NUMBER() OVER (
+                            PARTITION BY thread_id, checkpoint_ns ORDER BY checkpoint_id DESC
+                        ) AS rn FROM checkpoints
+                    ) WHERE rn > ?
+                )
+                """,
+                (self.keep_per_thread,),
+            )
+            checkpoints = cur.rowcount
+            cur.execute(
+                """
+                DELETE FROM writes WHERE NOT EXISTS (
+                    SELECT 1 FROM checkpoints c WHERE c.thread_id = writes.thread_id
+                    AND c.checkpoint_ns = writes.checkpoint_ns AND c.checkpoint_id = writes.checkpoint_id
+                )
+                """
+            )
+        self.stats["pruned_threads"] += len(stale)
+        self.stats["pruned_checkpoints"] += max(checkpoints, 0)
+        return {"threads": len(stale), "checkpoints": max(checkpoints, 0)}
+
+    def size(self) -> dict:
+        with self.cursor(transaction=False) as cur:
+            cur.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(checkpoint) + LENGTH(metadata)), 0) FROM checkpoints")
+            checkpoints, checkpoint_bytes = cur.fetchone()
+            cur.execute("SELECT COUNT(*) FROM thread_activity")
+            threads = cur.fetchone()[0]
+        return {"threads": threads, "checkpoints": checkpoints, "checkpoint_bytes": checkpoint_bytes}
+
+    # --- API ASYNC (en un hilo) ---
+
+    async def aget_tuple(self, config: RunnableConfig):
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None) -> AsyncIterator:
+        items = await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for item in items:
+            yield item
+
+    async def aput(self, config, checkpoint, metadata, new_versions) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id: str, task_path: str = "") -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+
+def build_checkpointer(kind: str = CHECKPOINTER, path: str = CHECKPOINT_DB):
+    if kind == "none":
+        return None
+    if kind == "memory":
+        from langgraph.checkpoint.memory import MemorySaver
+        return MemorySaver()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    return PrunedSqliteSaver.from_path(path)
+
+
+def new_thread_id() -> str:
+    # Consultas sin hilo explícito: hilo propio (se reanuda con su id o caduca por poda)
+    return f"anon-{uuid.uuid4().hex}"
+
+
+def run_kwargs(graph) -> dict:
+    """Argumentos de ejecución dependientes del checkpointer (durabilidad)."""
+    return {"durability": CHECKPOINT_DURABILITY} if getattr(graph, "checkpointer", None) else {}
@@ -0,0 +1,140 @@
+# coalescing.py
+
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable, Dict, Hashable, List
+
+
+class _StreamFlight:
+    """Ejecución en curso de un stream: guarda los frames para reenviarlos a cada suscriptor."""
+
+    def __init__(self):
+        self.frames: List[str] = []
+        self.done = False
+        self.error: BaseException = None
+        self.cancelled = False
+        self.changed = asyncio.Condition()
+        self.task: asyncio.Task = None
+        self.subscribers = 0
+
+    async def publish(self, frame: str):
+        async with self.changed:
+            self.frames.append(frame)
+            self.changed.notify_all()
+
+    async def finish(self, error: BaseException = None, cancelled: bool = False):
+        async with self.changed:
+            self.done = True
+            self.error = error
+            self.cancelled = cancelled
+            self.changed.notify_all()
+
+    def subscribe(self) -> "Subscription":
+        self.subscribers += 1
+        return Subscription(self)
+
+    def leave(self):
+        """Un suscriptor se va; si era el último, se cancela la ejecución (grafo + LLM)."""
+        self.subscribers -= 1
+        if self.subscribers <= 0 and not self.done and self.task is not None:
+            self.task.cancel()
+
+
+class Subscription:
+    """
+    Lectura de un stream compartido. close() la da de baja aunque esté esperando
+    un frame (p.ej. al detectar que el cliente se ha desconectado).
+    """
+
+    def __init__(self, flight: _StreamFlight):
+        self.flight = flight
+        self.closed = False
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.flight.leave()
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self._frames()
+
+    async def _frames(self) -> AsyncIterator[str]:
+        flight, i = self.flight, 0
+        try:
+            while not self.closed:
+                async with flight.changed:
+                    await flight.changed.wait_for(lambda: i < len(flight.frames) or flight.done)
+                    pending = flight.frames[i:]
+                    done, error = flight.done, flight.error
+                for frame in pending:
+                    yield frame
+                i += len(pending)
+                if done and i >= len(flight.frames):
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            self.close()
+
+
+class SingleFlight:
+    """
+    Coalescencia de peticiones idénticas concurrentes: la primera ejecuta el grafo
+    y las demás comparten su resultado (o su stream) en lugar de lanzar otro.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self._streams: Dict[Hashable, _StreamFlight] = {}
+        self.coalesced = 0
+        self.executions = 0
+        self.cancelled = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable]):
+        task = self._calls.get(key)
+        if task is None:
+            self.executions += 1
+            task = asyncio.create_task(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            self.coalesced += 1
+        # shield: si un cliente se va, el resto sigue esperando el mismo resultado
+        return await asyncio.shield(task)
+
+    def stream(self, key: Hashable, factory: Callable[[], AsyncIterator[str]]) -> Subscription:
+        flight = self._streams.get(key)
+        if flight is None:
+            self.executions += 1
+            flight = _StreamFlight()
+            self._streams[key] = flight
+            flight.task = asyncio.create_task(self._pump(key, flight, factory))
+        else:
+            self.coalesced += 1
+        return flight.subscribe()
+
+    async def _pump(self, key: Hashable, flight: _StreamFlight, factory):
+        try:
+            async for frame in factory():
+                await flight.publish(frame)
+        except asyncio.CancelledError:
+            # Todos los clientes se fueron: se despierta a quien aún espere y se propaga
+            self.cancelled += 1
+            await flight.finish(cancelled=True)
+            raise
+        except Exception as e:
+            await flight.finish(e)
+        else:
+            await flight.finish()
+        finally:
+            self._streams.pop(key, None)
+
+    def stats(self) -> dict:
+        return {
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "cancelled": self.cancelled,
+            "in_flight": len(self._calls) + len(self._streams),
+        }
+
+
+single_flight = SingleFlight()
@@ -0,0 +1,91 @@
+# compaction.py
+
+import os
+from typing import List, Tuple
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+from ai_engine.metrics import PROMPT_TOKENS, PROMPT_TOKENS_SAVED
+from ai_engine.retrieval import estimate_tokens
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "3000"))
+PROMPT_SUMMARY_TOKENS = int(os.getenv("PROMPT_SUMMARY_TOKENS", "300"))
+
+# Caracteres de cada turno antiguo que se conservan en el resumen
+_SUMMARY_SNIPPET = 160
+
+
+def message_tokens(message: BaseMessage) -> int:
+    return estimate_tokens(message.content if isinstance(message.content, str) else str(message.content)) + 4
+
+
+def _last_index(messages: List[BaseMessage], kind) -> int:
+    return next((i for i in range(len(messages) - 1, -1, -1) if isinstance(messages[i], kind)), -1)
+
+
+def summarize_turns(messages: List[BaseMessage], max_tokens: int = PROMPT_SUMMARY_TOKENS) -> str:
+    """Resumen extractivo (sin llamar al LLM): inicio de cada turno, del más reciente hacia atrás."""
+    lines, used = [], 0
+    for m in reversed(messages):
+        role = "Paciente" if isinstance(m, HumanMessage) else "Analista"
+        text = " ".join(str(m.content).split())
+        line = f"- {role}: {text[:_SUMMARY_SNIPPET]}{'...' if len(text) > _SUMMARY_SNIPPET else ''}"
+        cost = estimate_tokens(line)
+        if used + cost > max_tokens:
+            break
+        lines.append(line)
+        used += cost
+    lines.reverse()
+    return "Resumen de consultas anteriores:\n" + "\n".join(lines) if lines else ""
+
+
+def compact_messages(messages: List[BaseMessage], budget: int = PROMPT_TOKEN_BUDGET) -> Tuple[List[BaseMessage], int]:
+    """
+    Ajusta la conversación al presupuesto de tokens del prompt del analista.
+    Siempre se conservan el contexto del paciente (último SystemMessage) y los síntomas
+    actuales (último HumanMessage); los contextos antiguos se descartan porque el último
+    los sustituye, y los turnos antiguos que no caben se condensan en un resumen.
+    Devuelve (mensajes, tokens ahorrados).
+    """
+    original = sum(message_tokens(m) for m in messages)
+    # Contextos sustituidos: fuera siempre, aunque el prompt quepa en el presupuesto
+    context = _last_index(messages, SystemMessage)
+    messages = [m for i, m in enumerate(messages) if i == context or not isinstance(m, SystemMessage)]
+    current = sum(message_tokens(m) for m in messages)
+    if current <= budget:
+        return messages, original - current
+
+    pinned = {_last_index(messages, SystemMessage), _last_index(messages, HumanMessage)} - {-1}
+    used = sum(message_tokens(messages[i]) for i in pinned)
+    history = [i for i, m in enumerate(messages) if i not in pinned and isinstance(m, (HumanMessage, AIMessage))]
+
+    # Turnos recientes completos mientras quepan (reservando sitio para el resumen)
+    keep = set(pinned)
+    available = budget - used - PROMPT_SUMMARY_TOKENS
+    cut = len(history)
+    for pos in range(len(history) - 1, -1, -1):
+        cost = message_tokens(messages[history[pos]])
+        if cost > available:
+            break
+        keep.add(history[pos])
+        available -= cost
+        cut = pos
+
+    compacted = []
+    summary = summarize_turns([messages[i] for i in history[:cut]])
+    if summary:
+        compacted.append(SystemMessage(content=summary))
+    compacted += [m for i, m in enumerate(messages) if i in keep]
+
+    saved = max(original - sum(message_tokens(m) for m in compacted), 0)
+    return compacted, saved
+
+
+def build_prompt(system: SystemMessage, messages: List[BaseMessage], budget: int = PROMPT_TOKEN_BUDGET) -> List[BaseMessage]:
+    """Prompt del analista dentro del presupuesto; registra tokens enviados y ahorrados."""
+    compacted, saved = compact_messages(messages, budget - message_tokens(system))
+    prompt = [system] + compacted
+    PROMPT_TOKENS.observe(sum(message_tokens(m) for m in prompt))
+    if saved:
+        PROMPT_TOKENS_SAVED.inc(amount=saved)
+    return prompt
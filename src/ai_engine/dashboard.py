@@ -4,9 +4,12 @@ import streamlit as st
 import httpx
 import matplotlib.pyplot as plt
 import asyncio
+import time
 import pandas as pd
 from langchain_core.messages import HumanMessage
-from ai_engine.graph_engine import medical_graph
+from ai_engine.graph_engine import get_graph, CACHED_CHUNK_EVENT, FAST_PATH_CHUNK_EVENT
+from ai_engine.triage import triage_metrics
+from ai_engine.checkpoint import new_thread_id, run_kwargs
 
 # --- CONFIGURACIÓN ---
 DJANGO_URL = "http://localhost:8001/api"
@@ -14,11 +17,7 @@ st.set_page_config(page_title="OmniCare Pro", layout="wide", page_icon="🏥")
 
 # --- FUNCIONES DE APOYO ---
 def extraer_metricas(texto):
-    texto = texto.lower()
-    dolor = 8 if any(w in texto for w in ["fuerte", "intenso", "agudo", "10/10"]) else 4
-    urgencia = 9 if any(w in texto for w in ["urgente", "emergencia", "inmediata"]) else 3
-    riesgo = 7 if any(w in texto for w in ["grave", "crítico", "complicado"]) else 2
-    return [dolor, urgencia, riesgo]
+    return triage_metrics(texto)
 
 def solicitar_baja(tipo, id_entidad, nombre):
     headers = {"Authorization": f"Bearer {st.session_state.token}"}
@@ -246,10 +245,27 @@ else:
 
     elif menu == "📋 Mis Pacientes":
         st.subheader("Mis Pacientes Asignados")
-        resp = httpx.get(f"{DJANGO_URL}/manage-patients/", headers=headers)
+        # Búsqueda y paginación en el servidor; el listado no incluye el historial clínico
+        busqueda = st.text_input("🔎 Buscar por nombre o DNI").strip()
+        if st.session_state.get("pacientes_busqueda") != busqueda:
+            st.session_state.pacientes_busqueda = busqueda
+            st.session_state.pacientes_pagina = 1
+        params = {"page": st.session_state.get("pacientes_pagina", 1), "fields": "patient_id,name"}
+        if busqueda:
+            params["q"] = busqueda
+        resp = httpx.get(f"{DJANGO_URL}/manage-patients/", params=params, headers=headers)
         
         if resp.status_code == 200:
-            for p in resp.json():
+            pagina = resp.json()
+            n1, n2, n3 = st.columns([1, 2, 1])
+            n2.caption(f"{pagina['count']} pacientes · página {params['page']}")
+            if pagina.get("previous") and n1.button("⬅️ Anterior"):
+                st.session_state.pacientes_pagina = params["page"] - 1
+                st.rerun()
+            if pagina.get("next") and n3.button("Siguiente ➡️"):
+                st.session_state.pacientes_pagina = params["page"] + 1
+                st.rerun()
+            for p in pagina["results"]:
                 with st.expander(f"👤 {p['name']} (ID: {p['patient_id']})"):
                     col_btn1, col_btn2 = st.columns(2)
                     
@@ -266,7 +282,14 @@ else:
                         if st.button(f"📥 Descargar PDF", key=f"pdf_{p['patient_id']}", use_container_width=True):
                             with st.spinner("Analizando historial y generando reporte..."):
                                 try:
-                                    pdf_r = httpx.get(f"{DJANGO_URL}/export-pdf/{p['patient_id']}/", headers=headers, timeout=15.0)
+                                    pdf_url = f"{DJANGO_URL}/export-pdf/{p['patient_id']}/"
+                                    pdf_r = httpx.get(pdf_url, headers=headers, timeout=15.0)
+                                    # Historiales grandes: se genera en segundo plano y se sondea la misma URL
+                                    for _ in range(60):
+                                        if pdf_r.status_code != 202:
+                                            break
+                                        time.sleep(int(pdf_r.headers.get("Retry-After", 2)))
+                                        pdf_r = httpx.get(pdf_url, headers=headers, timeout=15.0)
                                     
                                     if pdf_r.status_code == 200:
                                         st.download_button(
@@ -279,6 +302,8 @@ else:
                                     elif pdf_r.status_code == 404:
                                         # Caso específico: El paciente existe pero no hay logs ni historial para el PDF
                                         st.warning("⚠️ No se puede generar el PDF: El paciente aún no tiene consultas ni historial registrado.")
+                                    elif pdf_r.status_code == 202:
+                                        st.info("⏳ El informe sigue generándose. Vuelve a pulsar en unos segundos.")
                                     elif pdf_r.status_code == 204:
                                         st.info("ℹ️ El historial clínico está vacío.")
                                     else:
@@ -343,11 +368,33 @@ else:
 
     elif menu == "📊 Auditoría":
         st.subheader("🛡️ Auditoría Avanzada de Consultas IA")
+        # Filtros en el servidor y paginación por cursor (la API ya no devuelve la tabla entera)
+        f1, f2, f3 = st.columns(3)
+        filtros = {"page_size": 200,
+                   "riesgo_min": f2.slider("Riesgo mínimo", 0, 10, 0),
+                   "urgencia_min": f3.slider("Urgencia mínima", 0, 10, 0)}
+        filtro_paciente = f1.text_input("Paciente (DNI)").strip()
+        if filtro_paciente:
+            filtros["paciente"] = filtro_paciente
+        if st.session_state.get("audit_filtros") != filtros:
+            st.session_state.audit_filtros = filtros
+            st.session_state.audit_url = None  # Nuevos filtros: volvemos a la primera página
         try:
-            r_audit = httpx.get(f"{DJANGO_URL}/audit-logs/", headers=headers)
+            if st.session_state.audit_url:
+                r_audit = httpx.get(st.session_state.audit_url, headers=headers)
+            else:
+                r_audit = httpx.get(f"{DJANGO_URL}/audit-logs/", params=filtros, headers=headers)
             
             if r_audit.status_code == 200:
-                audit_data = r_audit.json()
+                pagina = r_audit.json()
+                audit_data = pagina["results"]
+                n1, n2 = st.columns(2)
+                if pagina.get("previous") and n1.button("⬅️ Más recientes"):
+                    st.session_state.audit_url = pagina["previous"]
+                    st.rerun()
+                if pagina.get("next") and n2.button("Más antiguas ➡️"):
+                    st.session_state.audit_url = pagina["next"]
+                    st.rerun()
                 
                 if audit_data:
                     df_audit = pd.DataFrame(audit_data)
@@ -374,7 +421,7 @@ else:
 
                     # --- PANEL DE CONTROL ---
                     c1, c2, c3 = st.columns(3)
-                    c1.metric("Volumen de Consultas", len(df_audit))
+                    c1.metric("Consultas en la página", len(df_audit))
                     
                     # Contamos los "Altos" usando la nueva etiqueta
                     alertas_altas = len(df_audit[df_audit['riesgo'] >= 8])
@@ -450,12 +497,21 @@ else:
                             "patient_data": {"patient_id": st.session_state.dni}, # Usamos 'dni' aquí también
                             "resource_focus": "Consulta"
                         }
-                        async for ev in medical_graph.astream_events(state, version="v2"):
+                        # Un hilo del checkpointer por sesión: la conversación continúa entre mensajes
+                        if "thread_id" not in st.session_state:
+                            st.session_state.thread_id = new_thread_id()
+                        graph = get_graph()
+                        config = {"configurable": {"thread_id": st.session_state.thread_id}}
+                        async for ev in graph.astream_events(state, config=config, version="v2", **run_kwargs(graph)):
                             if ev["event"] == "on_chat_model_stream":
                                 chunk = ev["data"]["chunk"].content
-                                if chunk: 
-                                    res_container["text"] += chunk
-                                    ph.markdown(res_container["text"] + "▌")
+                            elif ev["event"] == "on_custom_event" and ev["name"] in (CACHED_CHUNK_EVENT, FAST_PATH_CHUNK_EVENT):
+                                chunk = ev["data"]["token"]  # Respuesta servida desde caché o plantilla
+                            else:
+                                continue
+                            if chunk: 
+                                res_container["text"] += chunk
+                                ph.markdown(res_container["text"] + "▌")
                         return res_container["text"]
 
                     final = asyncio.run(run_chat())
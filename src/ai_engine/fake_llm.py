@@ -0,0 +1,130 @@
+# fake_llm.py
+
+import asyncio
+import os
+import time
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+# Texto base del que se extraen los tokens (determinista: siempre el mismo orden)
+_CANNED_WORDS = (
+    "Según los síntomas descritos y el historial clínico disponible, el cuadro es compatible con "
+    "un proceso leve. Se recomienda reposo, hidratación abundante y control de la temperatura. "
+    "Si aparecen signos de alarma como dificultad respiratoria, dolor torácico o fiebre persistente "
+    "durante más de tres días, acuda a urgencias o contacte con su médico de cabecera."
+).split()
+
+
+class FakeLLMError(Exception):
+    """Fallo simulado del proveedor (antes del primer token)."""
+
+
+class FakeStreamingChatModel(BaseChatModel):
+    """
+    Sustituto offline y determinista de ChatOpenAI para benchmarks y tests.
+    Simula el tiempo hasta el primer token, la latencia por token y la longitud de la salida.
+    Con slow_every / fail_every, una de cada N llamadas (empezando por la primera) es lenta
+    (slow_ttft) o falla: cola de latencia reproducible para probar reintentos y hedging.
+    """
+
+    ttft: float = 0.2
+    token_delay: float = 0.02
+    output_tokens: int = 60
+    slow_every: int = 0
+    slow_ttft: float = 5.0
+    fail_every: int = 0
+
+    _calls: int = PrivateAttr(default=0)
+
+    @classmethod
+    def from_env(cls) -> "FakeStreamingChatModel":
+        return cls(
+            ttft=float(os.getenv("FAKE_LLM_TTFT_MS", "200")) / 1000,
+            token_delay=float(os.getenv("FAKE_LLM_TOKEN_DELAY_MS", "20")) / 1000,
+            output_tokens=int(os.getenv("FAKE_LLM_OUTPUT_TOKENS", "60")),
+            slow_every=int(os.getenv("FAKE_LLM_SLOW_EVERY", "0")),
+            slow_ttft=float(os.getenv("FAKE_LLM_SLOW_TTFT_MS", "5000")) / 1000,
+            fail_every=int(os.getenv("FAKE_LLM_FAIL_EVERY", "0")),
+        )
+
+    def _next_call(self) -> tuple:
+        """(tiempo hasta el primer token, ¿falla?) de la siguiente llamada."""
+        self._calls += 1
+        n = self._calls - 1
+        slow = self.slow_every and n % self.slow_every == 0
+        fails = bool(self.fail_every and n % self.fail_every == 0)
+        return (self.slow_ttft if slow else self.ttft), fails
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-streaming-chat"
+
+    def _tokens(self) -> List[str]:
+        return [
+            _CANNED_WORDS[i % len(_CANNED_WORDS)] + ("" if i == self.output_tokens - 1 else " ")
+            for i in range(self.output_tokens)
+        ]
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        ttft, fails = self._next_call()
+        time.sleep(ttft)
+        if fails:
+            raise FakeLLMError("Fallo simulado del LLM")
+        time.sleep(self.token_delay * max(self.output_tokens - 1, 0))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(self._tokens())))])
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        ttft, fails = self._next_call()
+        for i, token in enumerate(self._tokens()):
+            time.sleep(ttft if i == 0 else self.token_delay)
+            if fails:
+                raise FakeLLMError("Fallo simulado del LLM")
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        ttft, fails = self._next_call()
+        for i, token in enumerate(self._tokens()):
+            await asyncio.sleep(ttft if i == 0 else self.token_delay)
+            if fails:
+                raise FakeLLMError("Fallo simulado del LLM")
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        chunks = [c async for c in self._astream(messages, stop, run_manager, **kwargs)]
+        content = "".join(c.message.content for c in chunks)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
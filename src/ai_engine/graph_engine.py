@@ -1,80 +1,203 @@
 # graph_engine.py
 
 import os
+import threading
 from dotenv import load_dotenv
 from typing import Annotated, List
-from langgraph.graph import StateGraph, END
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
-import httpx
-from langgraph.checkpoint.memory import MemorySaver
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage, AIMessage
+from langchain_core.runnables import RunnableConfig
+from langchain_core.callbacks.manager import adispatch_custom_event
+
+# Antes de importar los módulos propios: leen su configuración del entorno
+load_dotenv()
 
 # IMPORT ABSOLUTO - funciona después de pip install -e .
 from ai_engine.state import AgentState
+from ai_engine.http_client import data_layer_client, record_error
+from ai_engine.cache import patient_cache, analysis_cache, analysis_cache_key, content_version
+from ai_engine.audit_queue import audit_writer
+from ai_engine.scheduler import llm_scheduler
+from ai_engine.resilience import llm_caller
+from ai_engine.metrics import instrument_node, llm_metrics_callback, FAST_PATH_ANSWERS
+from ai_engine.retrieval import relevant_history
+from ai_engine.compaction import build_prompt
+from ai_engine.triage import FAST_PATH_ENABLED, fast_path_answer
 
 
+# 1. Inicializar el LLM (GPT-4o-mini: Máximo ahorro)
+#    LLM_PROVIDER=fake usa un modelo simulado offline (benchmarks sin OpenAI)
+#    Se construye en el primer uso: importar langchain_openai es lo más caro del arranque
+def build_llm():
+    if os.getenv("LLM_PROVIDER", "openai").lower() == "fake":
+        from ai_engine.fake_llm import FakeStreamingChatModel
+        model = FakeStreamingChatModel.from_env()
+    else:
+        from langchain_openai import ChatOpenAI
+        model = ChatOpenAI(
+            model="gpt-4o-mini", 
+            temperature=0, 
+            max_tokens=500
+        )
+    # Duración, TTFT y tokens de cada llamada (ver /metrics)
+    return model.with_config(callbacks=[llm_metrics_callback])
 
-load_dotenv()
+# El warm-up construye desde un hilo mientras pueden llegar peticiones
+_build_lock = threading.RLock()
 
-# 1. Inicializar el LLM (GPT-4o-mini: Máximo ahorro)
-llm = ChatOpenAI(
-    model="gpt-4o-mini", 
-    temperature=0, 
-    max_tokens=500
-)
+def get_llm():
+    """LLM del analista (se construye una vez y se reutiliza)."""
+    global llm
+    if "llm" not in globals():
+        with _build_lock:
+            if "llm" not in globals():
+                llm = build_llm()
+    return llm
 
-# 2. Inicializa la memoria
-memory = MemorySaver()
 
 # 3. NODO: Recuperador de Django
-async def retrieval_node(state: AgentState):
+# Consultas recientes que se piden junto a la ficha (un único viaje a la capa de datos)
+CONTEXT_CONSULTAS = int(os.getenv("PATIENT_CONTEXT_CONSULTAS", "5"))
+
+async def fetch_patient_info(patient_id, config: RunnableConfig = None):
+    """
+    Contexto del paciente desde Django (ficha + últimas consultas + métricas de triaje),
+    servido desde la caché local si está vigente.
+    """
+    patient_info = patient_cache.get(patient_id)
+    if patient_info is not None:
+        return patient_info
+
+    # Cliente del pool compartido (inyectado desde el lifespan de main.py)
+    async with data_layer_client(config) as client:
+        response = await client.get(f"/patient-context/{patient_id}/", params={"consultas": CONTEXT_CONSULTAS})
+    if response.status_code != 200:
+        return {}
+    patient_info = response.json()
+    patient_cache.set(patient_id, patient_info)
+    return patient_info
+
+def format_patient_context(patient_info: dict, symptoms: str = "") -> str:
+    history = patient_info.get('clinical_history') or 'Sin historial previo.'
+    # Historiales largos: solo los fragmentos relevantes para los síntomas (presupuesto de tokens)
+    history = relevant_history(patient_info.get('patient_id', ''), history, symptoms)
+    name = patient_info.get('name', 'Paciente desconocido')
+    lines = [f"Datos del Paciente ({name}): {history}"]
+
+    metricas = patient_info.get('metricas') or {}
+    if metricas.get('total'):
+        lines.append(
+            f"Triaje previo: {metricas['total']} consultas, dolor medio {metricas.get('dolor_medio')}, "
+            f"urgencia media {metricas.get('urgencia_media')} (máx. {metricas.get('urgencia_max')}), "
+            f"riesgo medio {metricas.get('riesgo_medio')}, última el {metricas.get('ultima_consulta')}."
+        )
+    for c in patient_info.get('consultas') or []:
+        lines.append(
+            f"- {c['fecha']} | dolor {c['dolor']}, urgencia {c['urgencia']}, riesgo {c['riesgo']}: {c['mensaje_usuario']}"
+        )
+    return "\n".join(lines)
+
+def latest_symptoms(messages) -> str:
+    """Síntomas del turno actual: el último mensaje del usuario (los hilos se reutilizan)."""
+    return next((m.content for m in reversed(messages) if isinstance(m, HumanMessage)), "")
+
+def is_follow_up(messages) -> bool:
+    """Hay una respuesta previa en el hilo: la consulta depende de la conversación."""
+    return any(isinstance(m, AIMessage) for m in messages)
+
+async def retrieval_node(state: AgentState, config: RunnableConfig = None):
     patient_id = state['patient_data'].get('patient_id')
-    async with httpx.AsyncClient() as client:
-        try:
-            # Conexión con tu capa de datos Django
-            response = await client.get(f"http://localhost:8001/api/patients/{patient_id}/")
-            patient_info = response.json() if response.status_code == 200 else {}
-            history = patient_info.get('clinical_history', 'Sin historial previo.')
-            name = patient_info.get('name', 'Paciente desconocido')
-        except Exception:
-            history = "Error de conexión con la base de datos de Django."
-            name = "Error"
+    symptoms = latest_symptoms(state.get('messages', []))
+    try:
+        # Conexión con tu capa de datos Django
+        content = format_patient_context(await fetch_patient_info(patient_id, config), symptoms)
+    except Exception:
+        record_error()
+        content = "Datos del Paciente (Error): Error de conexión con la base de datos de Django."
     
     # Actualizamos el historial en el sistema
-    content = f"Datos del Paciente ({name}): {history}"
-    return {"messages": [SystemMessage(content=content)]}
+    # La versión del historial forma parte de la clave de la caché del analista
+    patient_data = {**state['patient_data'], "history_version": content_version(content)}
+    return {"messages": [SystemMessage(content=content)], "patient_data": patient_data}
 
 # 4. NODO: Analista Médico
-async def analysis_node(state: AgentState):
-    # El analista toma todos los mensajes (historial + síntomas del usuario)
-    prompt = [
+CACHED_CHUNK_EVENT = "analysis_cache_chunk"
+FAST_PATH_CHUNK_EVENT = "fast_path_chunk"
+
+async def replay_cached_response(text: str, config: RunnableConfig = None, chunk_size: int = 32,
+                                 event: str = CACHED_CHUNK_EVENT):
+    """Reproduce una respuesta cacheada como eventos para que /analyze-stream la emita por trozos."""
+    for i in range(0, len(text), chunk_size):
+        await adispatch_custom_event(event, {"token": text[i:i + chunk_size]}, config=config)
+
+async def analysis_node(state: AgentState, config: RunnableConfig = None):
+    # El analista toma los mensajes (historial + síntomas del usuario) dentro del presupuesto de tokens:
+    # en hilos reutilizados los turnos antiguos se resumen en lugar de reenviarse enteros
+    prompt = build_prompt(
         SystemMessage(content=f"Eres un experto analista médico. Tu enfoque actual es: {state['resource_focus']}."),
-    ] + state['messages']
-    
-    response = await llm.ainvoke(prompt)
+        state['messages'],
+    )
+
+    # Caché de respuestas (opt-in); MedicalQuery.bypass_cache la salta. Las consultas de
+    # seguimiento no se cachean: la respuesta depende de la conversación, no solo de la clave
+    cache_key = None
+    bypass = (config or {}).get("configurable", {}).get("bypass_cache", False)
+    if analysis_cache is not None and not bypass and not is_follow_up(state['messages']):
+        symptoms = latest_symptoms(state['messages'])
+        cache_key = analysis_cache_key(
+            symptoms, state['resource_focus'], state['patient_data'].get("history_version", "")
+        )
+        cached = await analysis_cache.get(cache_key)
+        if cached is not None:
+            await replay_cached_response(cached, config)
+            return {"messages": [AIMessage(content=cached, response_metadata={"cache_hit": True})]}
+
+    # Admisión por urgencia: limita las llamadas simultáneas al LLM
+    # Plazo, reintentos con jitter y hedging opcional (ver resilience.py)
+    async with llm_scheduler.slot(state['patient_data'].get("urgency_level", 0)):
+        response = await llm_caller.ainvoke(get_llm(), prompt)
+    if cache_key is not None and response.content:
+        await analysis_cache.set(cache_key, response.content)
     return {"messages": [response]}
 
+# 4b. NODO: Triaje por reglas (opcional, FAST_PATH_ENABLED=1)
+async def triage_node(state: AgentState, config: RunnableConfig = None):
+    """
+    Consultas leves y frecuentes: respuesta desde plantillas revisadas sin llamar al LLM.
+    Solo en la primera consulta del hilo (las de seguimiento necesitan la conversación).
+    """
+    messages = state['messages']
+    symptoms = latest_symptoms(messages)
+    result = None if is_follow_up(messages) else fast_path_answer(symptoms, state['patient_data'].get("urgency_level", 0))
+    if result is None:
+        return {"triage": {"fast_path": False}}
+
+    FAST_PATH_ANSWERS.inc(result["category"])
+    await replay_cached_response(result["answer"], config, event=FAST_PATH_CHUNK_EVENT)
+    return {
+        "messages": [AIMessage(content=result["answer"], response_metadata={"fast_path": result["category"]})],
+        "triage": {"fast_path": True, "category": result["category"], "confidence": result["confidence"]},
+    }
+
+def route_after_triage(state: AgentState) -> str:
+    # La respuesta por plantilla también pasa por el revisor de ética (auditoría incluida)
+    return "ethics_reviewer" if state.get("triage", {}).get("fast_path") else "analyst"
+
 # 5. NODO: Revisor de Ética (Usa tus banderas de seguridad)
-async def ethics_node(state: AgentState):
+async def ethics_node(state: AgentState, config: RunnableConfig = None):
     # Obtener el contenido de la respuesta final
     final_response = state['messages'][-1].content
     patient_id = state['patient_data'].get('patient_id')
-    symptoms = state['messages'][0].content # El primer mensaje enviado
+    # Síntomas del turno que se responde, no los del primer turno del hilo
+    symptoms = latest_symptoms(state['messages'])
 
     # --- Lógica de Auditoría ---
-    async with httpx.AsyncClient() as client:
-        try:
-            audit_data = {
-                "patient_id": patient_id,
-                "agent_name": "Ethics_Reviewer_Agent",
-                "input_symptoms": symptoms,
-                "ai_analysis": final_response
-            }
-            # Enviamos el log al nuevo endpoint que configuramos en Django
-            await client.post("http://localhost:8001/api/audit-logs/", json=audit_data)
-            print(f"✅ Auditoría guardada para el paciente {patient_id}")
-        except Exception as e:
-            print(f"❌ Error al guardar auditoría: {e}")
+    audit_data = {
+        "patient_id": patient_id,
+        "mensaje_usuario": symptoms,
+        "respuesta_ia": final_response
+    }
+    # Se encola para el escritor por lotes: la respuesta no espera a Django
+    await audit_writer.record(audit_data, config)
 
     return {
         "messages": [state['messages'][-1]],
@@ -83,22 +206,54 @@ async def ethics_node(state: AgentState):
     
     
 # 6. Construcción del Grafo de Agentes Autónomos
-workflow = StateGraph(AgentState)
-
-# Añadimos los nodos
-workflow.add_node("retriever", retrieval_node)
-workflow.add_node("analyst", analysis_node)
-workflow.add_node("ethics_reviewer", ethics_node)
-
-# Definimos el flujo (Edges)
-workflow.set_entry_point("retriever")
-workflow.add_edge("retriever", "analyst")
-workflow.add_edge("analyst", "ethics_reviewer")
-workflow.add_edge("ethics_reviewer", END)
-
-# Compilamos
-medical_graph = workflow.compile( 
-    interrupt_before=["ethics_reviewer"]
-)
-# Alias para LangGraph Studio
-graph = medical_graph
+_DEFAULT_CHECKPOINTER = object()
+
+def build_graph(checkpointer=_DEFAULT_CHECKPOINTER, fast_path: bool = FAST_PATH_ENABLED):
+    from langgraph.graph import StateGraph, END
+    from ai_engine.checkpoint import build_checkpointer
+
+    # 2. Inicializa la memoria: SQLite en disco (WAL) con poda; CHECKPOINTER=memory|none para otros usos
+    if checkpointer is _DEFAULT_CHECKPOINTER:
+        checkpointer = build_checkpointer()
+
+    workflow = StateGraph(AgentState)
+
+    # Añadimos los nodos
+    workflow.add_node("retriever", instrument_node("retriever", retrieval_node))
+    workflow.add_node("analyst", instrument_node("analyst", analysis_node))
+    workflow.add_node("ethics_reviewer", instrument_node("ethics_reviewer", ethics_node))
+
+    # Definimos el flujo (Edges)
+    workflow.set_entry_point("retriever")
+    if fast_path:
+        # Triaje por reglas antes del analista: las consultas leves conocidas no llegan al LLM
+        workflow.add_node("triage", instrument_node("triage", triage_node))
+        workflow.add_edge("retriever", "triage")
+        workflow.add_conditional_edges("triage", route_after_triage, ["analyst", "ethics_reviewer"])
+    else:
+        workflow.add_edge("retriever", "analyst")
+    workflow.add_edge("analyst", "ethics_reviewer")
+    workflow.add_edge("ethics_reviewer", END)
+
+    # Compilamos: con checkpointer, la pausa antes de ethics_reviewer se reanuda por thread_id
+    return workflow.compile( 
+        checkpointer=checkpointer,
+        interrupt_before=["ethics_reviewer"]
+    )
+
+def get_graph():
+    """Grafo compilado, construido en el primer uso (o en el warm-up de main.py) y cacheado."""
+    global medical_graph
+    if "medical_graph" not in globals():
+        with _build_lock:
+            if "medical_graph" not in globals():
+                medical_graph = build_graph()
+    return medical_graph
+
+def __getattr__(name):
+    # Acceso perezoso a medical_graph / graph (alias para LangGraph Studio) y llm
+    if name in ("medical_graph", "graph"):
+        return get_graph()
+    if name == "llm":
+        return get_llm()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,126 @@
+# http_client.py
+
+import os
+import re
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import httpx
+
+from ai_engine.metrics import DATA_LAYER_SECONDS
+
+# --- CONFIGURACIÓN DEL POOL (sobrescribible por variables de entorno) ---
+DJANGO_API_URL = os.getenv("DJANGO_API_URL", "http://localhost:8001/api")
+DJANGO_API_TOKEN = os.getenv("DJANGO_API_TOKEN")  # Token de servicio opcional (JWT de una cuenta is_staff)
+
+POOL_MAX_CONNECTIONS = int(os.getenv("HTTP_POOL_MAX_CONNECTIONS", "100"))
+POOL_MAX_KEEPALIVE = int(os.getenv("HTTP_POOL_MAX_KEEPALIVE", "20"))
+POOL_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_POOL_KEEPALIVE_EXPIRY", "30.0"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "2.0"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "10.0"))
+HTTP_POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", "5.0"))
+
+# Cliente compartido: lo abre y lo cierra el lifespan de FastAPI (main.py)
+_shared_client: Optional[httpx.AsyncClient] = None
+_stats = {"requests": 0, "errors": 0}
+
+
+def _build_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=POOL_MAX_KEEPALIVE,
+        keepalive_expiry=POOL_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(
+        HTTP_READ_TIMEOUT,
+        connect=HTTP_CONNECT_TIMEOUT,
+        pool=HTTP_POOL_TIMEOUT,
+    )
+    headers = {"Authorization": f"Bearer {DJANGO_API_TOKEN}"} if DJANGO_API_TOKEN else None
+    return httpx.AsyncClient(
+        base_url=DJANGO_API_URL,
+        limits=limits,
+        timeout=timeout,
+        headers=headers,
+        event_hooks={"request": [_count_request], "response": [_observe_response]},
+    )
+
+
+async def _count_request(request: httpx.Request):
+    _stats["requests"] += 1
+    request.extensions["omnicare_start"] = time.perf_counter()
+
+
+# Los identificadores en la URL se agrupan para no disparar la cardinalidad de etiquetas
+_ID_SEGMENT = re.compile(r"/(patients|patient-context|historial-paciente|export-pdf)/[^/]+")
+
+
+def _route(path: str) -> str:
+    return _ID_SEGMENT.sub(lambda m: f"/{m.group(1)}/{{id}}", path)
+
+
+async def _observe_response(response: httpx.Response):
+    start = response.request.extensions.get("omnicare_start")
+    if start is not None:
+        DATA_LAYER_SECONDS.observe(
+            time.perf_counter() - start,
+            response.request.method, _route(response.request.url.path), response.status_code,
+        )
+
+
+async def open_client() -> httpx.AsyncClient:
+    """Crea el cliente compartido (se llama una sola vez en el arranque)."""
+    global _shared_client
+    if _shared_client is None or _shared_client.is_closed:
+        _shared_client = _build_client()
+    return _shared_client
+
+
+async def close_client():
+    """Cierra el pool y libera los sockets (apagado del servicio)."""
+    global _shared_client
+    if _shared_client is not None:
+        await _shared_client.aclose()
+        _shared_client = None
+
+
+def get_client() -> Optional[httpx.AsyncClient]:
+    return _shared_client
+
+
+@asynccontextmanager
+async def data_layer_client(config: Optional[dict] = None):
+    """
+    Devuelve el cliente inyectado en el config del grafo o, en su defecto, el compartido.
+    Si el grafo se ejecuta fuera de FastAPI (p.ej. Streamlit) se usa un cliente efímero.
+    """
+    client = (config or {}).get("configurable", {}).get("http_client") or _shared_client
+    if client is not None and not client.is_closed:
+        yield client
+        return
+    async with _build_client() as client:
+        yield client
+
+
+def record_error():
+    _stats["errors"] += 1
+
+
+def pool_stats() -> dict:
+    """Estado del pool de conexiones hacia la capa de datos Django."""
+    connections = []
+    if _shared_client is not None and not _shared_client.is_closed:
+        # httpx no expone el pool públicamente: leemos el ConnectionPool de httpcore
+        pool = getattr(getattr(_shared_client, "_transport", None), "_pool", None)
+        connections = list(getattr(pool, "connections", []))
+
+    return {
+        "open": _shared_client is not None and not _shared_client.is_closed,
+        "max_connections": POOL_MAX_CONNECTIONS,
+        "max_keepalive_connections": POOL_MAX_KEEPALIVE,
+        "connections": len(connections),
+        "idle_connections": sum(1 for c in connections if c.is_idle()),
+        "requests": _stats["requests"],
+        "errors": _stats["errors"],
+    }
@@ -1,19 +1,132 @@
 # main.py
 
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
 from pydantic import BaseModel, Field
-from typing import List, AsyncGenerator
+from typing import List, AsyncGenerator, Optional
+from contextlib import asynccontextmanager
+import asyncio
+import os
+import time
 import uvicorn
 import json
 from pydantic import ConfigDict
 from langchain_core.messages import HumanMessage
 
 # Importamos tu grafo y tu estado
-from ai_engine.graph_engine import medical_graph
-from ai_engine.state import AgentState
+from ai_engine.graph_engine import get_graph, get_llm
+from ai_engine.streaming import graph_frames, sse, STREAM_MODE
+from ai_engine import http_client
+from ai_engine.cache import patient_cache, analysis_cache, normalize_text
+from ai_engine.coalescing import single_flight, Subscription
+from ai_engine.scheduler import llm_scheduler, SchedulerOverloaded
+from ai_engine.resilience import llm_caller, LLMDeadlineExceeded
+from ai_engine.metrics import REGISTRY, CallbackMetric, RequestMetricsMiddleware
+from ai_engine.audit_queue import audit_writer
+from ai_engine.checkpoint import new_thread_id, run_kwargs
 
-app = FastAPI(title="OmniCare AI Engine")
+
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "1").lower() in ("1", "true", "yes")
+WARMUP_CONNECTIONS = int(os.getenv("WARMUP_CONNECTIONS", "2"))
+
+# Estado de arranque consultado por /ready
+readiness = {"ready": False, "warmup_seconds": None, "steps": {}}
+
+
+async def warm_up():
+    """
+    Deja la réplica lista para tráfico: compila el grafo, construye el LLM y abre
+    conexiones keep-alive hacia Django. Hasta que termina, /ready responde 503.
+    """
+    start = time.perf_counter()
+    steps = readiness["steps"]
+
+    t = time.perf_counter()
+    await asyncio.to_thread(get_graph)
+    steps["graph_compile"] = round(time.perf_counter() - t, 4)
+
+    t = time.perf_counter()
+    await asyncio.to_thread(get_llm)
+    steps["llm_client"] = round(time.perf_counter() - t, 4)
+
+    t = time.perf_counter()
+    client = http_client.get_client()
+    if client is not None:
+        # Peticiones concurrentes = varias conexiones abiertas en el pool
+        await asyncio.gather(*(client.get("/") for _ in range(WARMUP_CONNECTIONS)), return_exceptions=True)
+    steps["data_layer_connections"] = round(time.perf_counter() - t, 4)
+
+    readiness["warmup_seconds"] = round(time.perf_counter() - start, 4)
+    readiness["ready"] = True
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Pool HTTP compartido hacia Django: keep-alive entre peticiones
+    await http_client.open_client()
+    # Escritor de auditoría por lotes (se vacía antes de cerrar el pool)
+    await audit_writer.start()
+    # El warm-up va en segundo plano: /health responde ya y /ready al terminar
+    warmup_task = asyncio.create_task(warm_up()) if WARMUP_ON_STARTUP else None
+    if warmup_task is None:
+        readiness["ready"] = True
+    yield
+    if warmup_task is not None and not warmup_task.done():
+        warmup_task.cancel()
+    await audit_writer.stop()
+    await http_client.close_client()
+
+
+app = FastAPI(title="OmniCare AI Engine", lifespan=lifespan)
+app.add_middleware(RequestMetricsMiddleware)
+
+# Estado de los componentes del motor, leído en cada scrape de /metrics
+for _metric in (
+    CallbackMetric("omnicare_llm_in_flight", "Llamadas al LLM en curso", "gauge", lambda: llm_scheduler.in_flight),
+    CallbackMetric("omnicare_llm_queue_depth", "Llamadas al LLM en cola", "gauge", lambda: llm_scheduler.waiting),
+    CallbackMetric("omnicare_llm_shed_total", "Peticiones descartadas por saturación", "counter", lambda: llm_scheduler.shed),
+    CallbackMetric("omnicare_llm_queue_wait_seconds", "Espera en la cola del LLM", "histogram", lambda: llm_scheduler.wait_seconds),
+    CallbackMetric("omnicare_coalesced_requests_total", "Peticiones unidas a una ejecución en curso", "counter", lambda: single_flight.coalesced),
+    CallbackMetric("omnicare_streams_cancelled_total", "Streams cancelados al desconectarse todos sus clientes", "counter", lambda: single_flight.cancelled),
+    CallbackMetric("omnicare_cache_hits_total", "Aciertos de caché", "counter",
+                   lambda: {"patient_context": patient_cache.hits,
+                            **({"analysis": analysis_cache.memory.hits} if analysis_cache else {})}, ["cache"]),
+    CallbackMetric("omnicare_cache_misses_total", "Fallos de caché", "counter",
+                   lambda: {"patient_context": patient_cache.misses,
+                            **({"analysis": analysis_cache.memory.misses} if analysis_cache else {})}, ["cache"]),
+    CallbackMetric("omnicare_audit_records_total", "Registros de auditoría por resultado", "counter",
+                   lambda: {k: audit_writer.stats[k] for k in ("enqueued", "sent", "spilled", "replayed")}, ["outcome"]),
+    CallbackMetric("omnicare_data_layer_pool_connections", "Conexiones abiertas hacia Django", "gauge",
+                   lambda: http_client.pool_stats()["connections"]),
+):
+    REGISTRY.register(_metric)
+
+@app.exception_handler(SchedulerOverloaded)
+async def overloaded_handler(request, exc: SchedulerOverloaded):
+    # Carga descartada por el planificador del LLM: el cliente puede reintentar
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "5"})
+
+@app.exception_handler(LLMDeadlineExceeded)
+async def deadline_handler(request, exc: LLMDeadlineExceeded):
+    # El LLM no respondió dentro del plazo total (reintentos y coberturas incluidos)
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
+
+# Límites del endpoint de lotes (/analyze-batch)
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+BATCH_DEFAULT_CONCURRENCY = int(os.getenv("BATCH_DEFAULT_CONCURRENCY", "4"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "32"))
+
+# Cada cuánto se comprueba si el cliente de /analyze-stream sigue conectado
+DISCONNECT_POLL_SECONDS = float(os.getenv("DISCONNECT_POLL_SECONDS", "0.5"))
+
+
+def graph_config(query: "MedicalQuery" = None, thread_id: str = None) -> dict:
+    """Config de ejecución del grafo: hilo del checkpointer y cliente HTTP compartido para los nodos."""
+    return {"configurable": {
+        "thread_id": thread_id or (query and query.thread_id) or new_thread_id(),
+        "http_client": http_client.get_client(),
+        "bypass_cache": bool(query and query.bypass_cache),
+    }}
 
 # Modelos para la API (Pydantic)
 class MedicalQuery(BaseModel):
@@ -22,24 +135,34 @@ class MedicalQuery(BaseModel):
     symptoms: str
     urgency_level: int = Field(alias="urgencyLevel")
     consent_provided: bool = Field(alias="consentProvided")
+    bypass_cache: bool = Field(default=False, alias="bypassCache")
+    # Hilo de conversación (checkpointer): reutilizarlo continúa la conversación anterior
+    thread_id: Optional[str] = Field(default=None, alias="threadId")
 
 
 class AiResponse(BaseModel):
     analysis: str
     recommended_actions: List[str]
     agent_in_charge: str
+    thread_id: Optional[str] = None
 
-@app.post("/analyze", response_model=AiResponse)
-async def analyze_medical_case(query: MedicalQuery):
-    """Endpoint estándar (Síncrono para el cliente)"""
-    initial_state = {
+def build_initial_state(query: MedicalQuery) -> dict:
+    return {
         "messages": [HumanMessage(content=f"El paciente presenta: {query.symptoms}")],
-        "patient_data": {"patient_id": query.patient_id},
+        "patient_data": {"patient_id": query.patient_id, "urgency_level": query.urgency_level},
         "resource_focus": "Consulta General",
         "safety_check_passed": False
     }
 
-    final_state = await medical_graph.ainvoke(initial_state)
+def coalescing_key(query: MedicalQuery) -> tuple:
+    """
+    Peticiones con el mismo paciente, síntomas, urgencia e hilo comparten una única ejecución
+    del grafo. La urgencia fija la prioridad en el planificador del LLM: una petición urgente
+    no debe esperar dentro de una ejecución admitida con prioridad baja.
+    """
+    return (query.patient_id, normalize_text(query.symptoms), query.urgency_level, query.bypass_cache, query.thread_id)
+
+def build_response(final_state: dict, thread_id: str) -> AiResponse:
     final_answer = final_state["messages"][-1].content
     
     agent_name = "Ethics_Reviewer_Agent" if final_state.get("safety_check_passed") else "Medical_Analyst_Agent"
@@ -47,37 +170,187 @@ async def analyze_medical_case(query: MedicalQuery):
     return AiResponse(
         analysis=final_answer,
         recommended_actions=["Seguir indicaciones del reporte", "Agendar cita de seguimiento"],
-        agent_in_charge=agent_name
+        agent_in_charge=agent_name,
+        thread_id=thread_id,
     )
 
+async def run_analysis(query: MedicalQuery) -> AiResponse:
+    """Ejecuta el grafo completo para una consulta y construye la respuesta de la API."""
+    initial_state = build_initial_state(query)
+
+    async def execute():
+        graph, config = get_graph(), graph_config(query)
+        final_state = await graph.ainvoke(initial_state, config=config, **run_kwargs(graph))
+        return final_state, config["configurable"]["thread_id"]
+
+    # Reintentos o dobles envíos concurrentes se unen a la ejecución en curso
+    final_state, thread_id = await single_flight.do(("analyze",) + coalescing_key(query), execute)
+    return build_response(final_state, thread_id)
+
+@app.post("/analyze", response_model=AiResponse)
+async def analyze_medical_case(query: MedicalQuery):
+    """Endpoint estándar (Síncrono para el cliente)"""
+    llm_scheduler.check_admission(query.urgency_level)
+    return await run_analysis(query)
+
+@app.post("/analyze-batch")
+async def analyze_medical_batch(
+    queries: List[MedicalQuery],
+    concurrency: int = Query(default=BATCH_DEFAULT_CONCURRENCY, ge=1, le=BATCH_MAX_CONCURRENCY),
+):
+    """
+    Lote de casos (p.ej. revisión nocturna de triaje) con concurrencia acotada.
+    Devuelve NDJSON: una línea por caso en orden de finalización, con su 'index' original.
+    """
+    if len(queries) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Máximo {BATCH_MAX_ITEMS} casos por lote")
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_case(index: int, query: MedicalQuery) -> dict:
+        async with semaphore:
+            try:
+                result = await run_analysis(query)
+                return {"index": index, "patient_id": query.patient_id, **result.model_dump()}
+            except Exception as e:
+                return {"index": index, "patient_id": query.patient_id, "error": str(e)}
+
+    async def generate_lines() -> AsyncGenerator[str, None]:
+        tasks = [asyncio.create_task(run_case(i, q)) for i, q in enumerate(queries)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield json.dumps(await next_done, ensure_ascii=False) + "\n"
+        finally:
+            # Si el cliente corta la conexión no seguimos gastando cuota del LLM
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(generate_lines(), media_type="application/x-ndjson")
+
 @app.post("/analyze-stream")
-async def analyze_medical_case_stream(query: MedicalQuery):
+async def analyze_medical_case_stream(
+    query: MedicalQuery,
+    request: Request,
+    mode: Optional[str] = Query(default=None, pattern="^(fast|events)$"),
+):
     """Endpoint con Streaming (Tokens en tiempo real)"""
-    
-    initial_state = {
-        "messages": [HumanMessage(content=f"El paciente presenta: {query.symptoms}")],
-        "patient_data": {"patient_id": query.patient_id},
-        "resource_focus": "Consulta General",
-        "safety_check_passed": False
-    }
+    # Rechazamos antes de abrir el stream si la petición se descartaría
+    llm_scheduler.check_admission(query.urgency_level)
+    initial_state = build_initial_state(query)
+    mode = mode or STREAM_MODE
 
     async def generate_events() -> AsyncGenerator[str, None]:
-        # Usamos astream_events (v2) para capturar tokens del LLM mientras se generan
-        async for event in medical_graph.astream_events(initial_state, version="v2"):
-            kind = event["event"]
-            
-            # Detectamos cuando el modelo de chat genera un fragmento (chunk) de texto
-            if kind == "on_chat_model_stream":
-                content = event["data"]["chunk"].content
-                if content:
-                    # Formato Server-Sent Events (SSE)
-                    yield f"data: {json.dumps({'token': content})}\n\n"
-            
-            # Opcional: Notificar cuando un agente específico termina
-            elif kind == "on_chain_end" and event["name"] == "ethics_node":
-                yield f"data: {json.dumps({'status': 'completed'})}\n\n"
-
-    return StreamingResponse(generate_events(), media_type="text/event-stream")
+        config = graph_config(query)
+        # Primer frame: el hilo permite continuar la conversación o reanudar la revisión ética
+        yield sse({"status": "started", "thread_id": config["configurable"]["thread_id"]})
+        try:
+            # fast: solo tokens del LLM agrupados en frames; events: astream_events (v2)
+            async for frame in graph_frames(get_graph(), initial_state, config, mode):
+                yield frame
+        except SchedulerOverloaded as e:
+            # Las cabeceras ya se enviaron: notificamos el descarte dentro del stream
+            yield sse({"error": str(e), "status": 503})
+        except LLMDeadlineExceeded as e:
+            yield sse({"error": str(e), "status": 504})
+
+    # Un único stream del grafo, repartido a todos los suscriptores concurrentes
+    subscription = single_flight.stream(("stream", mode) + coalescing_key(query), generate_events)
+    return StreamingResponse(frames_until_disconnect(request, subscription), media_type="text/event-stream")
+
+
+async def watch_disconnect(request: Request, subscription: Subscription):
+    while not subscription.closed:
+        if await request.is_disconnected():
+            subscription.close()
+            return
+        await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+
+
+async def frames_until_disconnect(request: Request, subscription: Subscription) -> AsyncGenerator[str, None]:
+    """
+    Si el cliente cierra la conexión (p.ej. se cierra la pestaña) se da de baja su suscripción;
+    cuando no queda ningún suscriptor se cancela el grafo y con él la llamada en curso al LLM.
+    La auditoría solo se escribe en ethics_reviewer, así que una consulta abandonada no deja
+    registros a medias.
+    """
+    watcher = asyncio.create_task(watch_disconnect(request, subscription))
+    try:
+        async for frame in subscription:
+            yield frame
+    finally:
+        watcher.cancel()
+        subscription.close()
+
+@app.post("/threads/{thread_id}/review", response_model=AiResponse)
+async def review_thread(thread_id: str):
+    """Reanuda un hilo detenido antes de ethics_reviewer: revisión ética y auditoría."""
+    graph = get_graph()
+    if graph.checkpointer is None:
+        raise HTTPException(status_code=501, detail="Checkpointer desactivado (CHECKPOINTER=none)")
+    config = graph_config(thread_id=thread_id)
+    snapshot = await graph.aget_state(config)
+    if "ethics_reviewer" not in snapshot.next:
+        raise HTTPException(status_code=409, detail="El hilo no tiene una revisión ética pendiente")
+    final_state = await graph.ainvoke(None, config=config, **run_kwargs(graph))
+    return build_response(final_state, thread_id)
+
+@app.get("/health")
+async def health():
+    """Liveness: el proceso responde."""
+    return {"status": "ok"}
+
+@app.get("/ready")
+async def ready():
+    """Readiness: grafo compilado y conexiones precalentadas."""
+    return JSONResponse(status_code=200 if readiness["ready"] else 503, content=readiness)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Métricas en formato de texto de Prometheus."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/pool-stats")
+async def get_pool_stats():
+    """Estadísticas del pool de conexiones hacia la capa de datos."""
+    return http_client.pool_stats()
+
+@app.get("/audit-stats")
+async def get_audit_stats():
+    """Estado del escritor de auditoría en segundo plano."""
+    return {"running": audit_writer.running, **audit_writer.stats}
+
+@app.get("/coalescing-stats")
+async def get_coalescing_stats():
+    """Ejecuciones del grafo y peticiones que se han unido a una ya en curso."""
+    return single_flight.stats()
+
+@app.get("/scheduler-stats")
+async def get_scheduler_stats():
+    """Ocupación del LLM, profundidad de cola, descartes e histogramas de espera."""
+    return llm_scheduler.stats()
+
+@app.get("/llm-resilience-stats")
+async def get_llm_resilience_stats():
+    """Reintentos, coberturas (hedging) y plazos agotados de las llamadas al LLM."""
+    return {**llm_caller.stats, "hedge_delay_seconds": round(llm_caller.hedge_delay(), 4)}
+
+@app.delete("/cache/patients/{patient_id}")
+async def invalidate_patient_cache(patient_id: str):
+    """Hook de invalidación: Django lo llama al guardar o borrar un Patient."""
+    return {"patient_id": patient_id, "invalidated": patient_cache.invalidate(patient_id)}
+
+@app.get("/cache-stats")
+async def get_cache_stats():
+    return {
+        "patient_context": patient_cache.stats(),
+        "analysis": analysis_cache.stats() if analysis_cache is not None else {"enabled": False},
+    }
+
+def __getattr__(name):
+    # Compatibilidad: ai_engine.main.medical_graph sigue existiendo (se construye bajo demanda)
+    if name == "medical_graph":
+        return get_graph()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,254 @@
+# metrics.py
+
+import asyncio
+import bisect
+import functools
+import time
+from typing import Callable, Dict, Iterable, Sequence, Tuple
+
+from langchain_core.callbacks import AsyncCallbackHandler
+
+# Cubos por defecto (segundos): de milisegundos a decenas de segundos
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """Histograma acumulativo de cubos fijos (mismo modelo que Prometheus)."""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # El último es +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self) -> dict:
+        cumulative, running = {}, 0
+        for bound, n in zip(self.buckets + (float("inf"),), self.counts):
+            running += n
+            cumulative["+Inf" if bound == float("inf") else str(bound)] = running
+        return {"buckets": cumulative, "sum": round(self.sum, 6), "count": self.count}
+
+
+# --- REGISTRO Y EXPOSICIÓN EN FORMATO PROMETHEUS ---
+
+def _escape(value) -> str:
+    # Formato de exposición: en los valores de etiqueta se escapan la barra invertida, " y los saltos de línea
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt(value: float) -> str:
+    return "+Inf" if value == float("inf") else repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.values: Dict[Tuple, float] = {}
+
+    def inc(self, *labelvalues, amount: float = 1):
+        self.values[labelvalues] = self.values.get(labelvalues, 0) + amount
+
+    def get(self, *labelvalues) -> float:
+        return self.values.get(labelvalues, 0)
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for lv, v in self.values.items():
+            yield f"{self.name}{_labels(self.labelnames, lv)} {_fmt(v)}"
+
+
+class LabeledHistogram:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.labelnames, self.buckets = name, help, tuple(labelnames), buckets
+        self.children: Dict[Tuple, Histogram] = {}
+
+    def observe(self, value: float, *labelvalues):
+        child = self.children.get(labelvalues)
+        if child is None:
+            child = self.children[labelvalues] = Histogram(self.buckets)
+        child.observe(value)
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for lv, h in self.children.items():
+            yield from _render_histogram(self.name, self.labelnames, lv, h)
+
+
+def _render_histogram(name, labelnames, labelvalues, h: Histogram) -> Iterable[str]:
+    running = 0
+    for bound, n in zip(h.buckets + (float("inf"),), h.counts):
+        running += n
+        le = 'le="%s"' % _fmt(bound)
+        yield f"{name}_bucket{_labels(labelnames, labelvalues, le)} {running}"
+    yield f"{name}_sum{_labels(labelnames, labelvalues)} {_fmt(h.sum)}"
+    yield f"{name}_count{_labels(labelnames, labelvalues)} {h.count}"
+
+
+class CallbackMetric:
+    """Métrica leída en el momento del scrape (contadores que ya llevan otros módulos)."""
+
+    def __init__(self, name: str, help: str, type: str, fn: Callable[[], object], labelnames: Sequence[str] = ()):
+        self.name, self.help, self.type, self.fn, self.labelnames = name, help, type, fn, tuple(labelnames)
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.type}"
+        value = self.fn()
+        if isinstance(value, Histogram):
+            yield from _render_histogram(self.name, (), (), value)
+        elif isinstance(value, dict):
+            for lv, v in value.items():
+                yield f"{self.name}{_labels(self.labelnames, lv if isinstance(lv, tuple) else (lv,))} {_fmt(v)}"
+        else:
+            yield f"{self.name} {_fmt(value)}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# --- MÉTRICAS DEL MOTOR DE IA ---
+
+NODE_SECONDS = REGISTRY.register(LabeledHistogram(
+    "omnicare_graph_node_seconds", "Duración de cada nodo del grafo médico", ["node"]))
+LLM_SECONDS = REGISTRY.register(LabeledHistogram(
+    "omnicare_llm_call_seconds", "Duración total de las llamadas al LLM", ["model"]))
+LLM_TTFT_SECONDS = REGISTRY.register(LabeledHistogram(
+    "omnicare_llm_time_to_first_token_seconds", "Tiempo hasta el primer token (solo streaming)", ["model"]))
+LLM_TOKENS = REGISTRY.register(Counter(
+    "omnicare_llm_tokens_total", "Tokens consumidos por el LLM", ["model", "kind"]))
+LLM_ERRORS = REGISTRY.register(Counter(
+    "omnicare_llm_errors_total", "Llamadas al LLM terminadas en error", ["model"]))
+LLM_RETRIES = REGISTRY.register(Counter(
+    "omnicare_llm_retries_total", "Reintentos de llamadas al LLM fallidas antes del primer token"))
+LLM_HEDGES_ISSUED = REGISTRY.register(Counter(
+    "omnicare_llm_hedges_issued_total", "Peticiones de cobertura lanzadas por un primer token lento"))
+LLM_HEDGES_WON = REGISTRY.register(Counter(
+    "omnicare_llm_hedges_won_total", "Peticiones de cobertura que respondieron antes que la original"))
+LLM_DEADLINE_EXCEEDED = REGISTRY.register(Counter(
+    "omnicare_llm_deadline_exceeded_total", "Llamadas al LLM que agotaron su plazo total"))
+PROMPT_TOKENS = REGISTRY.register(LabeledHistogram(
+    "omnicare_analyst_prompt_tokens", "Tokens estimados del prompt del analista tras la compactación",
+    buckets=(250, 500, 1000, 2000, 3000, 5000, 10000, 20000)))
+PROMPT_TOKENS_SAVED = REGISTRY.register(Counter(
+    "omnicare_prompt_tokens_saved_total", "Tokens estimados eliminados del prompt por la compactación"))
+FAST_PATH_ANSWERS = REGISTRY.register(Counter(
+    "omnicare_fast_path_answers_total", "Consultas respondidas por plantilla sin llamar al LLM", ["category"]))
+DATA_LAYER_SECONDS = REGISTRY.register(LabeledHistogram(
+    "omnicare_data_layer_request_seconds", "Llamadas HTTP a Django (hasta cabeceras)", ["method", "route", "status"]))
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    "omnicare_http_requests_total", "Peticiones recibidas por endpoint", ["method", "route", "status"]))
+HTTP_SECONDS = REGISTRY.register(LabeledHistogram(
+    "omnicare_http_request_seconds", "Duración de las peticiones (streams incluidos)", ["method", "route"]))
+
+
+def instrument_node(name: str, fn):
+    """Envuelve un nodo del grafo para medir su duración (conserva la firma para LangGraph)."""
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            NODE_SECONDS.observe(time.perf_counter() - start, name)
+    return wrapper
+
+
+class LLMMetricsCallback(AsyncCallbackHandler):
+    """Callback de LangChain: duración, TTFT y tokens de cada llamada al LLM."""
+
+    def __init__(self):
+        self._runs: Dict[object, list] = {}  # run_id -> [inicio, primer_token, modelo, tokens_stream]
+
+    async def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        model = (kwargs.get("metadata") or {}).get("ls_model_name") or (serialized or {}).get("name", "llm")
+        self._runs[run_id] = [time.perf_counter(), None, model, 0]
+
+    async def on_llm_new_token(self, token, *, run_id, **kwargs):
+        run = self._runs.get(run_id)
+        if run is None:
+            return
+        if run[1] is None:
+            run[1] = time.perf_counter()
+            LLM_TTFT_SECONDS.observe(run[1] - run[0], run[2])
+        run[3] += 1
+
+    async def on_llm_end(self, response, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        start, _, model, streamed = run
+        LLM_SECONDS.observe(time.perf_counter() - start, model)
+        usage = None
+        try:
+            usage = response.generations[0][0].message.usage_metadata
+        except (IndexError, AttributeError):
+            pass
+        if usage:
+            LLM_TOKENS.inc(model, "prompt", amount=usage.get("input_tokens", 0))
+            LLM_TOKENS.inc(model, "completion", amount=usage.get("output_tokens", 0))
+        elif streamed:
+            # Sin datos de uso (p.ej. streaming sin stream_usage): contamos fragmentos
+            LLM_TOKENS.inc(model, "completion", amount=streamed)
+
+    async def on_llm_error(self, error, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        # Cancelar una llamada (cobertura perdedora, cliente desconectado) no es un error del LLM
+        if isinstance(error, (asyncio.CancelledError, GeneratorExit)):
+            return
+        LLM_ERRORS.inc(run[2] if run else "llm")
+
+
+llm_metrics_callback = LLMMetricsCallback()
+
+
+class RequestMetricsMiddleware:
+    """Middleware ASGI puro: cuenta peticiones por ruta sin envolver las respuestas en streaming."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUESTS.inc(scope["method"], route, status["code"])
+            HTTP_SECONDS.observe(time.perf_counter() - start, scope["method"], route)
@@ -0,0 +1,248 @@
+# resilience.py
+
+import asyncio
+import os
+import random
+import statistics
+import time
+from collections import deque
+from typing import List, Optional
+
+from langchain_core.callbacks import AsyncCallbackManager
+from langchain_core.messages import AIMessage, BaseMessage, message_chunk_to_message
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, LLMResult
+from langchain_core.runnables import ensure_config
+
+from ai_engine.metrics import LLM_DEADLINE_EXCEEDED, LLM_HEDGES_ISSUED, LLM_HEDGES_WON, LLM_RETRIES
+from ai_engine.scheduler import llm_scheduler
+
+LLM_CALL_TIMEOUT = float(os.getenv("LLM_CALL_TIMEOUT", "60"))            # Plazo total (reintentos incluidos)
+LLM_FIRST_TOKEN_TIMEOUT = float(os.getenv("LLM_FIRST_TOKEN_TIMEOUT", "20"))  # Plazo por intento
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "4"))
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "0") == "1"
+# quantiles(n=100) da los percentiles 1..99: fuera de ese rango se ajusta al extremo
+LLM_HEDGE_PERCENTILE = min(max(int(os.getenv("LLM_HEDGE_PERCENTILE", "95")), 1), 99)
+LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", "2.0"))  # Hasta tener muestras suficientes
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+
+
+class LLMDeadlineExceeded(TimeoutError):
+    """La llamada al LLM agotó su plazo total (se traduce a HTTP 504)."""
+
+
+class FirstTokenTimeout(Exception):
+    """Un intento no produjo el primer token a tiempo (se reintenta)."""
+
+
+class StreamInterrupted(Exception):
+    """Fallo después del primer token: no se reintenta para no duplicar texto ya emitido."""
+
+
+class _Attempt:
+    """
+    Una llamada en streaming; first se resuelve con el primer fragmento (o con su fallo).
+    Con isolated=True se ejecuta sin los callbacks del grafo y guarda sus fragmentos:
+    no llegan a /analyze-stream hasta que publish() lo declara ganador.
+    """
+
+    def __init__(self, llm, prompt: List[BaseMessage], isolated: bool = False):
+        self.started = time.monotonic()
+        self.ttft: Optional[float] = None
+        self.isolated = isolated
+        self.chunks = []
+        self._run_manager = None
+        self._sent = 0
+        self._lock = asyncio.Lock()
+        self.first = asyncio.get_running_loop().create_future()
+        # callbacks=[] sustituye a los del grafo; los propios del modelo (métricas) se mantienen
+        config = {"callbacks": []} if isolated else None
+        self.task = asyncio.create_task(self._run(llm, prompt, config))
+        self.task.add_done_callback(self._on_done)
+
+    async def _run(self, llm, prompt, config):
+        message = None
+        async for chunk in llm.astream(prompt, config=config):
+            if self.ttft is None:
+                self.ttft = time.monotonic() - self.started
+                if not self.first.done():
+                    self.first.set_result(self)
+            message = chunk if message is None else message + chunk
+            if self.isolated:
+                self.chunks.append(chunk)
+                if self._run_manager is not None:
+                    await self._forward()
+        return message
+
+    def _on_done(self, task: asyncio.Task):
+        if self.first.done():
+            return
+        if task.cancelled():
+            self.first.cancel()
+        elif task.exception() is not None:
+            self.first.set_exception(task.exception())
+        else:
+            self.first.set_result(self)  # Respuesta vacía
+
+    async def publish(self, llm, prompt: List[BaseMessage]):
+        """Abre una ejecución en los callbacks del grafo y reenvía lo acumulado y lo que llegue."""
+        if not self.isolated:
+            return
+        config = ensure_config()
+        manager = AsyncCallbackManager.configure(
+            config.get("callbacks"), inheritable_tags=config.get("tags"), inheritable_metadata=config.get("metadata")
+        )
+        run_managers = await manager.on_chat_model_start({}, [prompt], name=llm.get_name())
+        self._run_manager = run_managers[0]
+        await self._forward()
+
+    async def _forward(self):
+        async with self._lock:
+            while self._sent < len(self.chunks):
+                chunk = self.chunks[self._sent]
+                self._sent += 1
+                await self._run_manager.on_llm_new_token(chunk.text, chunk=ChatGenerationChunk(message=chunk))
+
+    async def close(self, message: Optional[BaseMessage] = None, error: Optional[BaseException] = None):
+        """Cierra la ejecución abierta por publish() (fin de respuesta o fallo)."""
+        if self._run_manager is None:
+            return
+        if error is not None:
+            await self._run_manager.on_llm_error(error)
+        else:
+            await self._forward()
+            generations = [[ChatGeneration(message=message)]] if message is not None else [[]]
+            await self._run_manager.on_llm_end(LLMResult(generations=generations))
+        self._run_manager = None
+
+    def cancel(self):
+        if not self.task.done():
+            self.task.cancel()
+
+
+class ResilientLLMCaller:
+    """
+    Llamada al LLM del analista con plazo total, reintentos con jitter y hedging opcional.
+    Solo se reintenta antes del primer token y la cobertura solo compite hasta el primer
+    token. Con hedging los intentos corren aislados de los callbacks del grafo y solo se
+    publica el ganador: el texto que llega al stream sale siempre de un único intento.
+    """
+
+    def __init__(
+        self,
+        timeout: float = LLM_CALL_TIMEOUT,
+        first_token_timeout: float = LLM_FIRST_TOKEN_TIMEOUT,
+        max_retries: int = LLM_MAX_RETRIES,
+        retry_base_delay: float = LLM_RETRY_BASE_DELAY,
+        retry_max_delay: float = LLM_RETRY_MAX_DELAY,
+        hedge: bool = LLM_HEDGE_ENABLED,
+        hedge_percentile: int = LLM_HEDGE_PERCENTILE,
+        hedge_delay: float = LLM_HEDGE_DELAY,
+        hedge_min_samples: int = LLM_HEDGE_MIN_SAMPLES,
+        scheduler=llm_scheduler,
+    ):
+        self.timeout = timeout
+        self.first_token_timeout = first_token_timeout
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.hedge = hedge
+        self.hedge_percentile = min(max(int(hedge_percentile), 1), 99)
+        self.default_hedge_delay = hedge_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.scheduler = scheduler
+        self.ttfts = deque(maxlen=500)
+        self.stats = {"calls": 0, "retries": 0, "hedges_issued": 0, "hedges_won": 0, "deadline_exceeded": 0}
+
+    def hedge_delay(self) -> float:
+        """Percentil del tiempo hasta el primer token observado (valor fijo hasta tener muestras)."""
+        if len(self.ttfts) < self.hedge_min_samples:
+            return self.default_hedge_delay
+        return statistics.quantiles(self.ttfts, n=100)[self.hedge_percentile - 1]
+
+    async def ainvoke(self, llm, prompt: List[BaseMessage]):
+        self.stats["calls"] += 1
+        try:
+            async with asyncio.timeout(self.timeout):
+                for attempt in range(self.max_retries + 1):
+                    try:
+                        return await self._race(llm, prompt)
+                    except (StreamInterrupted, asyncio.CancelledError):
+                        raise
+                    except Exception:
+                        if attempt == self.max_retries:
+                            raise
+                    self.stats["retries"] += 1
+                    LLM_RETRIES.inc()
+                    # Backoff exponencial con jitter completo
+                    await asyncio.sleep(random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2 ** attempt)))
+        except TimeoutError as e:
+            if isinstance(e, LLMDeadlineExceeded):
+                raise
+            self.stats["deadline_exceeded"] += 1
+            LLM_DEADLINE_EXCEEDED.inc()
+            raise LLMDeadlineExceeded(f"El LLM no respondió en {self.timeout:g}s") from None
+
+    async def _race(self, llm, prompt: List[BaseMessage]):
+        # Con hedging ambos intentos corren aislados: cualquiera de los dos puede perder
+        attempts = [_Attempt(llm, prompt, isolated=self.hedge)]
+        hedge_slot = False
+        try:
+            deadline = time.monotonic() + self.first_token_timeout
+            if self.hedge:
+                pending = await self._wait_first({attempts[0].first}, min(self.hedge_delay(), self.first_token_timeout))
+                # Cobertura solo con capacidad libre: bajo carga duplicaría el trabajo
+                if pending and self.scheduler.try_acquire():
+                    hedge_slot = True
+                    self.stats["hedges_issued"] += 1
+                    LLM_HEDGES_ISSUED.inc()
+                    attempts.append(_Attempt(llm, prompt, isolated=True))
+            while True:
+                done = [a for a in attempts if a.first.done() and not a.first.cancelled() and a.first.exception() is None]
+                if done:
+                    winner = done[0]
+                    break
+                errors = [a.first.exception() for a in attempts if a.first.done() and not a.first.cancelled()]
+                if len(errors) == len(attempts):
+                    raise errors[0]
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise FirstTokenTimeout(f"Sin primer token en {self.first_token_timeout:g}s")
+                await self._wait_first({a.first for a in attempts if not a.first.done()}, remaining)
+
+            for a in attempts:
+                if a is not winner:
+                    a.cancel()
+            if winner is not attempts[0]:
+                self.stats["hedges_won"] += 1
+                LLM_HEDGES_WON.inc()
+            if winner.ttft is not None:
+                self.ttfts.append(winner.ttft)
+            try:
+                await winner.publish(llm, prompt)
+                message = await winner.task
+            except asyncio.CancelledError as e:
+                await winner.close(error=e)
+                raise
+            except Exception as e:
+                await winner.close(error=e)
+                raise StreamInterrupted(str(e)) from e
+            response = message_chunk_to_message(message) if message is not None else AIMessage(content="")
+            await winner.close(response)
+            return response
+        finally:
+            for a in attempts:
+                a.cancel()
+            if hedge_slot:
+                self.scheduler.release()
+
+    @staticmethod
+    async def _wait_first(futures: set, timeout: float) -> set:
+        if not futures:
+            return futures
+        _, pending = await asyncio.wait(futures, timeout=max(timeout, 0), return_when=asyncio.FIRST_COMPLETED)
+        return pending
+
+
+llm_caller = ResilientLLMCaller()
@@ -0,0 +1,170 @@
+# retrieval.py
+
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from ai_engine.cache import normalize_text, content_version
+
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "4"))
+RETRIEVAL_TOKEN_BUDGET = int(os.getenv("RETRIEVAL_TOKEN_BUDGET", "600"))
+RETRIEVAL_CHUNK_WORDS = int(os.getenv("RETRIEVAL_CHUNK_WORDS", "60"))
+RETRIEVAL_INDEX_SIZE = int(os.getenv("RETRIEVAL_INDEX_SIZE", "512"))
+
+# Parámetros estándar de BM25
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Palabras vacías frecuentes en los historiales (ya normalizadas: sin tildes)
+_STOPWORDS = frozenset(
+    "a al ante con de del desde el en entre es la las le lo los para por que se sin su sus un una "
+    "uno y o e ha han hace muy mas pero como sobre tras".split()
+)
+_SENTENCE = re.compile(r"(?<=[.;!?])\s+|\n+")
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimación rápida (~4 caracteres por token) sin depender del tokenizador del modelo."""
+    return math.ceil(len(text) / 4)
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in normalize_text(text).split() if len(t) > 1 and t not in _STOPWORDS]
+
+
+def chunk_text(text: str, max_words: int = RETRIEVAL_CHUNK_WORDS) -> List[str]:
+    """Agrupa frases consecutivas en fragmentos de hasta max_words palabras."""
+    chunks, current, size = [], [], 0
+    for sentence in filter(None, (s.strip() for s in _SENTENCE.split(text))):
+        words = len(sentence.split())
+        if current and size + words > max_words:
+            chunks.append(" ".join(current))
+            current, size = [], 0
+        current.append(sentence)
+        size += words
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+class BM25Index:
+    """
+    Índice BM25 de los fragmentos del historial de un paciente.
+    Listas invertidas en arrays NumPy (filas y frecuencias por término): la memoria crece con
+    el texto y no con fragmentos x vocabulario. Al cambiar el historial solo se tokenizan
+    los fragmentos nuevos; los que siguen igual reutilizan sus términos.
+    """
+
+    def __init__(self):
+        self.version: Optional[str] = None
+        self.chunks: List[str] = []
+        self.terms: List[Counter] = []
+        self.postings: Dict[str, tuple] = {}
+        self.lengths = np.zeros(0, dtype=np.float32)
+        self.tokenized = 0  # Fragmentos tokenizados en total (mide la reutilización)
+
+    def update(self, text: str):
+        version = content_version(text)
+        if version == self.version:
+            return
+        previous = dict(zip(self.chunks, self.terms))
+        chunks = chunk_text(text)
+        terms = []
+        for chunk in chunks:
+            counts = previous.get(chunk)
+            if counts is None:
+                counts = Counter(tokenize(chunk))
+                self.tokenized += 1
+            terms.append(counts)
+
+        rows: Dict[str, list] = {}
+        freqs: Dict[str, list] = {}
+        for i, counts in enumerate(terms):
+            for term, n in counts.items():
+                rows.setdefault(term, []).append(i)
+                freqs.setdefault(term, []).append(n)
+        self.postings = {
+            term: (np.array(rows[term], dtype=np.int32), np.array(freqs[term], dtype=np.float32))
+            for term in rows
+        }
+        self.chunks, self.terms, self.version = chunks, terms, version
+        self.lengths = np.array([sum(c.values()) for c in terms], dtype=np.float32)
+
+    def scores(self, query: str) -> np.ndarray:
+        n = len(self.chunks)
+        scores = np.zeros(n, dtype=np.float32)
+        if not n:
+            return scores
+        avg = self.lengths.mean() or 1.0
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths / avg)
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            rows, tf = posting
+            idf = math.log(1 + (n - len(rows) + 0.5) / (len(rows) + 0.5))
+            scores[rows] += idf * tf * (BM25_K1 + 1) / (tf + norm[rows])
+        return scores
+
+    def top_chunks(self, query: str, k: int = RETRIEVAL_TOP_K, token_budget: int = RETRIEVAL_TOKEN_BUDGET) -> List[str]:
+        """
+        Fragmentos más relevantes para la consulta dentro del presupuesto de tokens,
+        devueltos en el orden original del historial. Sin coincidencias se usan los más recientes.
+        """
+        scores = self.scores(query)
+        if scores.any():
+            ranked = [i for i in np.argsort(-scores, kind="stable") if scores[i] > 0]
+        else:
+            ranked = list(range(len(self.chunks) - 1, -1, -1))
+
+        selected, used = [], 0
+        for i in ranked[:k]:
+            cost = estimate_tokens(self.chunks[i])
+            if used + cost > token_budget:
+                continue
+            selected.append(i)
+            used += cost
+        if not selected and ranked:
+            # Un único fragmento mayor que el presupuesto: se recorta
+            return [self.chunks[ranked[0]][:token_budget * 4]]
+        return [self.chunks[i] for i in sorted(selected)]
+
+
+class HistoryIndexStore:
+    """Índices por paciente (LRU) que se actualizan cuando cambia el historial."""
+
+    def __init__(self, maxsize: int = RETRIEVAL_INDEX_SIZE):
+        self.maxsize = maxsize
+        self._indexes: "OrderedDict[str, BM25Index]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, patient_id: str, history: str) -> BM25Index:
+        with self._lock:
+            index = self._indexes.get(patient_id)
+            if index is None:
+                index = self._indexes[patient_id] = BM25Index()
+            self._indexes.move_to_end(patient_id)
+            while len(self._indexes) > self.maxsize:
+                self._indexes.popitem(last=False)
+            index.update(history)
+        return index
+
+    def __len__(self):
+        return len(self._indexes)
+
+
+history_indexes = HistoryIndexStore()
+
+
+def relevant_history(patient_id: str, history: str, query: str,
+                     k: int = RETRIEVAL_TOP_K, token_budget: int = RETRIEVAL_TOKEN_BUDGET) -> str:
+    """Historial completo si cabe en el presupuesto; si no, solo los fragmentos relevantes."""
+    if estimate_tokens(history) <= token_budget:
+        return history
+    chunks = history_indexes.get(patient_id or "", history).top_chunks(query, k, token_budget)
+    return " [...] ".join(chunks)
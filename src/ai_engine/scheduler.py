@@ -0,0 +1,141 @@
+# scheduler.py
+
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from contextlib import asynccontextmanager
+
+from ai_engine.metrics import Histogram
+
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "8"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "100"))
+LLM_SHED_QUEUE_DEPTH = int(os.getenv("LLM_SHED_QUEUE_DEPTH", "50"))
+LLM_SHED_URGENCY_BELOW = int(os.getenv("LLM_SHED_URGENCY_BELOW", "5"))
+# Envejecimiento: cada LLM_AGING_SECONDS de espera suben un nivel de urgencia (0 = sin envejecimiento)
+LLM_AGING_SECONDS = float(os.getenv("LLM_AGING_SECONDS", "10"))
+
+
+class SchedulerOverloaded(Exception):
+    """No hay capacidad para admitir la petición (se traduce a HTTP 503)."""
+
+
+class LLMScheduler:
+    """
+    Control de admisión para las llamadas al LLM del analista.
+    Limita las llamadas simultáneas y encola el resto por urgencia (mayor primero)
+    y, a igual urgencia, por orden de llegada. La urgencia envejece con la espera
+    para que la baja urgencia no se quede sin servicio bajo carga urgente sostenida.
+    Con la cola saturada descarta primero el trabajo de baja urgencia para que los
+    casos urgentes sigan fluyendo.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = LLM_MAX_IN_FLIGHT,
+        max_queue: int = LLM_MAX_QUEUE,
+        shed_queue_depth: int = LLM_SHED_QUEUE_DEPTH,
+        shed_urgency_below: int = LLM_SHED_URGENCY_BELOW,
+        aging_seconds: float = LLM_AGING_SECONDS,
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.shed_queue_depth = shed_queue_depth
+        self.shed_urgency_below = shed_urgency_below
+        self.aging_seconds = aging_seconds
+        self.in_flight = 0
+        self.waiting = 0
+        self._heap = []
+        self._seq = itertools.count()
+        self.admitted = 0
+        self.shed = 0
+        self.wait_seconds = Histogram()
+        self.queue_depth_at_enqueue = Histogram(buckets=(0, 1, 2, 5, 10, 25, 50, 100, 250))
+
+    def check_admission(self, urgency: int):
+        """Rechazo temprano (antes de arrancar el grafo) si la petición se descartaría."""
+        if self.in_flight < self.max_in_flight and not self.waiting:
+            return
+        if self.waiting >= self.max_queue:
+            self.shed += 1
+            raise SchedulerOverloaded("Cola del LLM llena")
+        if self.waiting >= self.shed_queue_depth and urgency < self.shed_urgency_below:
+            self.shed += 1
+            raise SchedulerOverloaded("Sistema saturado: se prioriza la atención urgente")
+
+    async def acquire(self, urgency: int):
+        start = time.monotonic()
+        if self.in_flight < self.max_in_flight and not self.waiting:
+            self.in_flight += 1
+            self._admit(start)
+            return
+
+        self.check_admission(urgency)
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (self._priority(urgency, start), next(self._seq), future))
+        self.queue_depth_at_enqueue.observe(self.waiting)
+        self.waiting += 1
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # El hueco llegó justo antes de la cancelación: lo devolvemos
+                self.release()
+            else:
+                future.cancel()
+                self.waiting -= 1
+            raise
+        self._admit(start)
+
+    def _priority(self, urgency: int, enqueued_at: float) -> float:
+        # Prioridad efectiva = urgencia + espera / aging_seconds. Todas las entradas envejecen
+        # al mismo ritmo, así que el orden relativo no cambia con el tiempo y basta una clave
+        # fija por entrada (menor primero): llegada / aging_seconds - urgencia
+        if self.aging_seconds <= 0:
+            return -urgency
+        return enqueued_at / self.aging_seconds - urgency
+
+    def try_acquire(self) -> bool:
+        """Hueco solo si hay capacidad libre sin esperar (p.ej. peticiones de cobertura)."""
+        if self.in_flight < self.max_in_flight and not self.waiting:
+            self.in_flight += 1
+            return True
+        return False
+
+    def release(self):
+        # El hueco pasa directamente al siguiente en espera (in_flight no cambia)
+        while self._heap:
+            _, _, future = heapq.heappop(self._heap)
+            if not future.done():
+                self.waiting -= 1
+                future.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def _admit(self, start: float):
+        self.admitted += 1
+        self.wait_seconds.observe(time.monotonic() - start)
+
+    @asynccontextmanager
+    async def slot(self, urgency: int):
+        await self.acquire(urgency)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "queue_depth": self.waiting,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "wait_seconds": self.wait_seconds.snapshot(),
+            "queue_depth_at_enqueue": self.queue_depth_at_enqueue.snapshot(),
+        }
+
+
+llm_scheduler = LLMScheduler()
@@ -7,4 +7,6 @@ class AgentState(TypedDict):
     messages: Annotated[list, add_messages] 
     patient_data: dict
     resource_focus: str
-    safety_check_passed: bool
\ No newline at end of file
+    safety_check_passed: bool
+    # Resultado del triaje por reglas (solo con FAST_PATH_ENABLED=1)
+    triage: dict
@@ -0,0 +1,124 @@
+# streaming.py
+
+import json
+import os
+import time
+from typing import AsyncGenerator, Optional
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from ai_engine.graph_engine import CACHED_CHUNK_EVENT, FAST_PATH_CHUNK_EVENT
+from ai_engine.checkpoint import run_kwargs
+
+# fast = solo fragmentos del LLM + fin de nodo; events = astream_events v2 (modo anterior)
+STREAM_MODE = os.getenv("STREAM_MODE", "fast").lower()
+STREAM_COALESCE_CHARS = int(os.getenv("STREAM_COALESCE_CHARS", "64"))
+STREAM_COALESCE_MS = float(os.getenv("STREAM_COALESCE_MS", "20"))
+
+# Nodos cuyos mensajes se envían al cliente (triage: respuesta por plantilla)
+ANSWER_NODES = ("analyst", "triage")
+
+
+def sse(payload: dict) -> str:
+    """Formato Server-Sent Events (SSE)."""
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+class FrameCoalescer:
+    """
+    Agrupa tokens en frames por tamaño o por ventana de tiempo.
+    El primer token sale inmediatamente para no penalizar el tiempo hasta el primer token.
+    """
+
+    def __init__(self, max_chars: int = STREAM_COALESCE_CHARS, window_ms: float = STREAM_COALESCE_MS):
+        self.max_chars = max_chars
+        self.window = window_ms / 1000
+        self._parts = []
+        self._size = 0
+        self._last_flush = None
+
+    def add(self, token: str) -> Optional[str]:
+        self._parts.append(token)
+        self._size += len(token)
+        now = time.monotonic()
+        if self._last_flush is None or self._size >= self.max_chars or now - self._last_flush >= self.window:
+            self._last_flush = now
+            return self.flush()
+        return None
+
+    def flush(self) -> Optional[str]:
+        if not self._parts:
+            return None
+        text = "".join(self._parts)
+        self._parts.clear()
+        self._size = 0
+        return text
+
+
+async def fast_token_frames(graph, initial_state: dict, config: dict, chunk_size: int = 32) -> AsyncGenerator[str, None]:
+    """
+    Modo ligero: se suscribe solo a los mensajes del LLM y a las actualizaciones de
+    nodo (stream_mode messages/updates) en lugar de a todos los eventos del grafo.
+    """
+    coalescer = FrameCoalescer()
+    async for mode, item in graph.astream(initial_state, config=config, stream_mode=["messages", "updates"], **run_kwargs(graph)):
+        if mode == "messages":
+            message, metadata = item
+            if metadata.get("langgraph_node") not in ANSWER_NODES:
+                continue
+            if isinstance(message, AIMessageChunk):
+                if message.content:
+                    text = coalescer.add(message.content)
+                    if text:
+                        yield sse({"token": text})
+            elif isinstance(message, AIMessage) and message.content:
+                # Respuesta completa sin streaming (caché del analista o plantilla del triaje)
+                flags = {}
+                if message.response_metadata.get("cache_hit"):
+                    flags["cached"] = True
+                if message.response_metadata.get("fast_path"):
+                    flags["fast_path"] = True
+                for i in range(0, len(message.content), chunk_size):
+                    yield sse({"token": message.content[i:i + chunk_size], **flags})
+        else:
+            text = coalescer.flush()
+            if text:
+                yield sse({"token": text})
+            for node in item:
+                if not node.startswith("__"):
+                    yield sse({"status": "node_completed", "node": node})
+    text = coalescer.flush()
+    if text:
+        yield sse({"token": text})
+    yield sse({"status": "completed"})
+
+
+async def event_frames(graph, initial_state: dict, config: dict) -> AsyncGenerator[str, None]:
+    """Modo anterior: astream_events (v2), un frame por token."""
+    # Usamos astream_events (v2) para capturar tokens del LLM mientras se generan
+    async for event in graph.astream_events(initial_state, config=config, version="v2", **run_kwargs(graph)):
+        kind = event["event"]
+
+        # Detectamos cuando el modelo de chat genera un fragmento (chunk) de texto
+        if kind == "on_chat_model_stream":
+            content = event["data"]["chunk"].content
+            if content:
+                yield sse({"token": content})
+
+        # Respuesta servida desde la caché del analista: se reenvía por trozos
+        elif kind == "on_custom_event" and event["name"] == CACHED_CHUNK_EVENT:
+            yield sse({"token": event["data"]["token"], "cached": True})
+
+        # Respuesta por plantilla del triaje (sin LLM)
+        elif kind == "on_custom_event" and event["name"] == FAST_PATH_CHUNK_EVENT:
+            yield sse({"token": event["data"]["token"], "fast_path": True})
+
+        # Opcional: Notificar cuando un agente específico termina
+        elif kind == "on_chain_end" and event["name"] == "ethics_node":
+            yield sse({"status": "completed"})
+
+
+def graph_frames(graph, initial_state: dict, config: dict, mode: str = None) -> AsyncGenerator[str, None]:
+    if (mode or STREAM_MODE) == "events":
+        return event_frames(graph, initial_state, config)
+    return fast_token_frames(graph, initial_state, config)
@@ -0,0 +1,10 @@
+# ai_engine\tests\conftest.py
+
+import os
+
+# Los tests no llaman a OpenAI: modelo simulado offline (fake_llm.py), fijado antes de
+# importar ai_engine.main. load_dotenv() no sobrescribe variables ya definidas.
+os.environ["LLM_PROVIDER"] = "fake"
+# Hilos en memoria: los tests no dejan bases de checkpoints en disco (los que prueban
+# SQLite crean la suya en tmp_path)
+os.environ["CHECKPOINTER"] = "memory"
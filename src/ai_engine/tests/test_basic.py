@@ -1,5 +1,6 @@
 # ai_engine\tests\test_basic.py  
 
+import json
 import pytest
 from fastapi.testclient import TestClient
 from unittest.mock import AsyncMock, patch
@@ -52,4 +53,659 @@ def test_agent_state_logic():
         "resource_focus": "Triage",
         "safety_check_passed": False
     }
-    assert state["patient_data"]["id"] == "PAC-001"
\ No newline at end of file
+    assert state["patient_data"]["id"] == "PAC-001"
+
+def test_pool_stats_endpoint():
+    """El pool compartido se abre en el lifespan y expone sus estadísticas."""
+    with TestClient(app) as c:
+        data = c.get("/pool-stats").json()
+        assert data["open"] is True
+        assert data["connections"] == 0
+    from ai_engine import http_client
+    assert http_client.get_client() is None
+
+def test_patient_cache_lru_ttl_and_invalidation():
+    """La caché de contexto respeta el tamaño máximo, el TTL y la invalidación."""
+    from ai_engine.cache import TTLCache, patient_cache
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("A", 1); cache.set("B", 2)
+    assert cache.get("A") == 1
+    cache.set("C", 3)  # Expulsa a "B" (el menos usado)
+    assert cache.get("B") is None
+    cache.set("A", 1, ttl=-1)
+    assert cache.get("A") is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["evictions"] == 1
+
+    patient_cache.set("PAC-9", {"name": "Ana"})
+    assert client.delete("/cache/patients/PAC-9").json()["invalidated"] is True
+    assert patient_cache.get("PAC-9") is None
+
+async def test_audit_writer_batches_and_spills_to_journal(tmp_path):
+    """Los registros se envían por lotes y, si Django falla, acaban en el diario local."""
+    from ai_engine.audit_queue import AuditWriter
+    writer = AuditWriter(batch_size=3, flush_interval=0.05, max_retries=1, journal_path=tmp_path / "j.ndjson")
+    lotes = []
+
+    async def send_ok(client, batch):
+        lotes.append(list(batch))
+
+    with patch.object(writer, "_send_batch", side_effect=send_ok):
+        await writer.start()
+        for i in range(4):
+            await writer.record({"n": i})
+        await writer.stop()
+    assert [len(b) for b in lotes] == [3, 1]
+
+    with patch.object(writer, "_send_batch", side_effect=ConnectionError("Django caído")):
+        await writer.start()
+        await writer.record({"n": 99})
+        await writer.stop()
+    assert '"n": 99' in (tmp_path / "j.ndjson").read_text()
+
+    lotes.clear()
+    with patch.object(writer, "_send_batch", side_effect=send_ok):
+        await writer.start()  # Al arrancar reenvía el diario pendiente
+        await writer.stop()
+    assert lotes == [[{"n": 99}]]
+    assert not (tmp_path / "j.ndjson").exists()
+
+async def test_audit_journal_replay_never_loses_records(tmp_path):
+    """Un .replay de una caída anterior se fusiona, un fallo durante el reenvío no pierde nada
+    y los registros rechazados por Django acaban en el fichero de rechazados."""
+    import httpx
+    from ai_engine.audit_queue import AuditWriter
+    diario, rechazados = tmp_path / "j.ndjson", tmp_path / "rechazados.ndjson"
+    writer = AuditWriter(batch_size=2, flush_interval=0.05, max_retries=0, journal_path=diario,
+                         dead_letter_path=rechazados)
+    (tmp_path / "j.ndjson.replay").write_text('{"n": 1}\n{"n": 2}\n')  # Caída a mitad de un reenvío
+    diario.write_text('{"n": 3}\n')
+
+    enviados = []
+
+    async def falla_segundo_lote(client, batch):
+        if enviados:
+            raise ConnectionError("Django caído")
+        enviados.append(list(batch))
+
+    with patch.object(writer, "_send_batch", side_effect=falla_segundo_lote):
+        await writer.start()
+        await writer.stop()
+    assert enviados == [[{"n": 1}, {"n": 2}]]
+    assert diario.read_text() == '{"n": 3}\n' and not (tmp_path / "j.ndjson.replay").exists()
+
+    async def post(url, json):
+        return httpx.Response(207, json={"results": [{"index": 0, "id": 7},
+                                                     {"index": 1, "errors": {"mensaje_usuario": ["Requerido"]}}]},
+                              request=httpx.Request("POST", url))
+
+    cliente = AsyncMock(post=post)
+    await writer._send_batch(cliente, [{"n": 4}, {"n": 5}])
+    linea = json.loads(rechazados.read_text())
+    assert linea == {"record": {"n": 5}, "errors": {"mensaje_usuario": ["Requerido"]}}
+    assert writer.stats["rejected"] == 1
+
+    # 400 con cuerpo no conforme (lista de DRF o texto): el lote entero va a rechazados, sin excepción
+    for cuerpo in ({"json": ["Se esperaba una lista"]}, {"text": "Bad Request"}):
+        async def post(url, json, cuerpo=cuerpo):
+            return httpx.Response(400, **cuerpo, request=httpx.Request("POST", url))
+
+        await writer._send_batch(AsyncMock(post=post), [{"n": 6}, {"n": 7}])
+    lineas = [json.loads(l) for l in rechazados.read_text().splitlines()]
+    assert [l["record"]["n"] for l in lineas[1:]] == [6, 7, 6, 7]
+    assert lineas[1]["errors"] == ["Se esperaba una lista"] and lineas[3]["errors"] == "Bad Request"
+
+def test_analysis_cache_replays_through_stream(tmp_path):
+    """Una segunda consulta equivalente se sirve desde caché y se emite por SSE sin llamar al LLM."""
+    from ai_engine.cache import ResponseCache, SQLiteTTLStore, TTLCache, analysis_cache_key
+    from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+    from langchain_core.messages import AIMessage
+
+    assert analysis_cache_key("Dolor de CABEZA!", "Triaje", "v1") == analysis_cache_key("dolor de cabeza", "Triaje", "v1")
+
+    cache = ResponseCache(TTLCache(maxsize=8, ttl=60), SQLiteTTLStore(str(tmp_path / "c.db")))
+    # Solo hay dos respuestas: una tercera llamada al LLM haría fallar el test
+    respuestas = iter([AIMessage(content="Reposo e hidratación."), AIMessage(content="Reposo e hidratación.")])
+    fake_llm = GenericFakeChatModel(messages=respuestas)
+
+    payload = {"patientId": "PAC-1", "symptoms": "Dolor de cabeza", "urgencyLevel": 1, "consentProvided": True}
+    with patch("ai_engine.graph_engine.analysis_cache", cache), \
+            patch("ai_engine.graph_engine.fetch_patient_info", AsyncMock(return_value={"name": "Ana"})), \
+            patch("ai_engine.graph_engine.llm", fake_llm):
+        primera = client.post("/analyze-stream", json=payload).text
+        segunda = client.post("/analyze-stream", json={**payload, "symptoms": "dolor de cabeza."}).text
+        forzada = client.post("/analyze-stream", json={**payload, "bypassCache": True}).text
+
+    assert "Reposo" in primera and '"cached": true' not in primera
+    assert '"cached": true' in segunda and "hidrataci" in segunda
+    assert '"cached": true' not in forzada
+    assert next(respuestas, None) is None
+
+async def test_single_flight_coalesces_concurrent_calls_and_streams():
+    """Peticiones idénticas concurrentes comparten una ejecución y un mismo stream."""
+    import asyncio
+    from ai_engine.coalescing import SingleFlight
+    sf = SingleFlight()
+    ejecuciones = []
+
+    async def grafo():
+        ejecuciones.append(1)
+        await asyncio.sleep(0.01)
+        return {"ok": True}
+
+    resultados = await asyncio.gather(*(sf.do("k", grafo) for _ in range(3)))
+    assert resultados == [{"ok": True}] * 3 and len(ejecuciones) == 1
+
+    async def frames():
+        for i in range(3):
+            await asyncio.sleep(0.005)
+            yield f"data: {i}\n\n"
+
+    async def consumir(it):
+        return [f async for f in it]
+
+    streams = [sf.stream("s", frames) for _ in range(2)]
+    a, b = await asyncio.gather(*(consumir(s) for s in streams))
+    assert a == b == [f"data: {i}\n\n" for i in range(3)]
+    assert sf.stats() == {"executions": 2, "coalesced": 3, "cancelled": 0, "in_flight": 0}
+
+    # Una petición urgente no se une a la ejecución de otra menos urgente
+    from ai_engine.main import MedicalQuery, coalescing_key
+    baja = MedicalQuery(patientId="PAC-1", symptoms="Dolor de pecho", urgencyLevel=1, consentProvided=True)
+    alta = baja.model_copy(update={"urgency_level": 9})
+    assert coalescing_key(baja) == coalescing_key(baja.model_copy(update={"symptoms": "dolor de pecho."}))
+    assert coalescing_key(baja) != coalescing_key(alta)
+
+def test_analyze_batch_streams_ndjson_in_completion_order():
+    """El lote respeta la concurrencia máxima y emite cada caso al terminar."""
+    import asyncio
+    en_curso = {"ahora": 0, "max": 0}
+
+    async def fake_ainvoke(state, config=None, **kwargs):
+        en_curso["ahora"] += 1
+        en_curso["max"] = max(en_curso["max"], en_curso["ahora"])
+        sintomas = state["messages"][0].content
+        await asyncio.sleep(0.05 if "lento" in sintomas else 0.001)
+        en_curso["ahora"] -= 1
+        mensaje = AsyncMock()
+        mensaje.content = f"Respuesta a {sintomas}"
+        return {"messages": [mensaje], "safety_check_passed": True}
+
+    casos = [
+        {"patientId": f"PAC-{i}", "symptoms": "caso lento" if i == 0 else f"caso {i}",
+         "urgencyLevel": 1, "consentProvided": True}
+        for i in range(5)
+    ]
+    with patch("ai_engine.main.medical_graph.ainvoke", side_effect=fake_ainvoke):
+        response = client.post("/analyze-batch?concurrency=2", json=casos)
+
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lineas = [json.loads(l) for l in response.text.splitlines()]
+    assert sorted(l["index"] for l in lineas) == list(range(5))
+    assert lineas[-1]["index"] == 0  # El caso lento llega el último
+    assert en_curso["max"] == 2
+
+async def test_llm_scheduler_prioritizes_urgency_and_sheds_low_priority():
+    """Con el LLM saturado, los urgentes pasan primero y la baja urgencia se descarta."""
+    import asyncio
+    from ai_engine.scheduler import LLMScheduler, SchedulerOverloaded
+    sched = LLMScheduler(max_in_flight=1, max_queue=10, shed_queue_depth=2, shed_urgency_below=5)
+    orden = []
+
+    await sched.acquire(0)  # Ocupa el único hueco
+
+    async def llamada(urgencia, nombre):
+        async with sched.slot(urgencia):
+            orden.append(nombre)
+
+    tareas = [asyncio.create_task(llamada(1, "leve")), asyncio.create_task(llamada(9, "urgente"))]
+    await asyncio.sleep(0)
+    assert sched.stats()["queue_depth"] == 2
+    with pytest.raises(SchedulerOverloaded):
+        await sched.acquire(2)  # Cola por encima del umbral: se descarta lo leve
+    tareas.append(asyncio.create_task(llamada(8, "grave")))  # Lo urgente sí se admite
+    await asyncio.sleep(0)
+
+    sched.release()
+    await asyncio.gather(*tareas)
+    assert orden == ["urgente", "grave", "leve"]
+    assert sched.stats()["in_flight"] == 0 and sched.stats()["shed"] == 1
+
+
+async def test_llm_scheduler_ages_waiting_requests():
+    """Bajo carga urgente sostenida, la baja urgencia que lleva esperando acaba pasando."""
+    import asyncio
+    from ai_engine.scheduler import LLMScheduler
+    sched = LLMScheduler(max_in_flight=1, max_queue=10, shed_queue_depth=10, aging_seconds=0.02)
+    orden = []
+
+    await sched.acquire(0)
+
+    async def llamada(urgencia, nombre):
+        async with sched.slot(urgencia):
+            orden.append(nombre)
+
+    tareas = [asyncio.create_task(llamada(1, "leve"))]
+    await asyncio.sleep(0.2)  # Unos 10 niveles de envejecimiento
+    tareas += [asyncio.create_task(llamada(5, f"urgente {i}")) for i in range(2)]
+    await asyncio.sleep(0)
+
+    sched.release()
+    await asyncio.gather(*tareas)
+    assert orden == ["leve", "urgente 0", "urgente 1"]
+
+    # Sin envejecimiento, la baja urgencia espera detrás de toda la carga urgente
+    sin = LLMScheduler(max_in_flight=1, max_queue=10, shed_queue_depth=10, aging_seconds=0)
+    assert sin._priority(1, 0) > sin._priority(5, 1000)
+
+
+def test_analyze_returns_503_when_overloaded():
+    from ai_engine.scheduler import SchedulerOverloaded
+    payload = {"patientId": "PAC-1", "symptoms": "tos", "urgencyLevel": 1, "consentProvided": True}
+    with patch("ai_engine.main.llm_scheduler.check_admission", side_effect=SchedulerOverloaded("saturado")):
+        response = client.post("/analyze", json=payload)
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "5"
+
+async def test_fake_llm_is_deterministic_and_streams():
+    """El modelo simulado respeta la longitud configurada y emite token a token."""
+    from ai_engine.fake_llm import FakeStreamingChatModel
+    fake = FakeStreamingChatModel(ttft=0, token_delay=0, output_tokens=5)
+    chunks = [c.content async for c in fake.astream("hola") if c.content]
+    assert len(chunks) == 5
+    assert (await fake.ainvoke("hola")).content == "".join(chunks)
+    assert fake.invoke("hola").content == "".join(chunks)
+
+def test_metrics_endpoint_exposes_node_and_llm_metrics():
+    """Tras una consulta, /metrics expone duración por nodo, LLM y peticiones por endpoint."""
+    from ai_engine.fake_llm import FakeStreamingChatModel
+    from ai_engine.metrics import llm_metrics_callback
+    fake = FakeStreamingChatModel(ttft=0, token_delay=0, output_tokens=3).with_config(callbacks=[llm_metrics_callback])
+    payload = {"patientId": "PAC-M", "symptoms": "tos seca", "urgencyLevel": 1, "consentProvided": True}
+    with patch("ai_engine.graph_engine.llm", fake), \
+            patch("ai_engine.graph_engine.fetch_patient_info", AsyncMock(return_value={})):
+        assert client.post("/analyze-stream", json=payload).status_code == 200
+
+    body = client.get("/metrics").text
+    assert 'omnicare_graph_node_seconds_count{node="retriever"}' in body
+    assert 'omnicare_graph_node_seconds_count{node="analyst"}' in body
+    assert "omnicare_llm_time_to_first_token_seconds_bucket" in body
+    assert 'kind="completion"} ' in body
+    assert 'omnicare_http_requests_total{method="POST",route="/analyze-stream",status="200"}' in body
+    assert "# TYPE omnicare_llm_queue_wait_seconds histogram" in body
+
+    # Valores de etiqueta escapados (p.ej. una ruta con comillas o un salto de línea)
+    from ai_engine.metrics import Counter
+    c = Counter("omnicare_test_total", "Prueba", ["route"])
+    c.inc('/a"b\\c\nd')
+    assert list(c.render())[-1] == 'omnicare_test_total{route="/a\\"b\\\\c\\nd"} 1.0'
+
+def test_readiness_turns_green_after_warmup():
+    """/health responde siempre; /ready solo cuando el grafo está compilado y el pool precalentado."""
+    import time
+    with TestClient(app) as c:
+        assert c.get("/health").json() == {"status": "ok"}
+        for _ in range(100):
+            if c.get("/ready").status_code == 200:
+                break
+            time.sleep(0.05)
+        data = c.get("/ready").json()
+    assert data["ready"] is True
+    assert set(data["steps"]) == {"graph_compile", "llm_client", "data_layer_connections"}
+
+def test_fast_stream_mode_coalesces_tokens_into_frames():
+    """El modo ligero agrupa tokens en frames y notifica el fin de cada nodo."""
+    from ai_engine.fake_llm import FakeStreamingChatModel
+    fake = FakeStreamingChatModel(ttft=0, token_delay=0, output_tokens=40)
+    payload = {"patientId": "PAC-S", "symptoms": "mareo", "urgencyLevel": 1, "consentProvided": True}
+
+    def frames(mode):
+        with patch("ai_engine.graph_engine.llm", fake), \
+                patch("ai_engine.graph_engine.fetch_patient_info", AsyncMock(return_value={})):
+            body = client.post(f"/analyze-stream?mode={mode}", json=payload).text
+        return [json.loads(l[len("data: "):]) for l in body.split("\n\n") if l.startswith("data: ")]
+
+    fast, events = frames("fast"), frames("events")
+    tokens_fast = [f["token"] for f in fast if "token" in f]
+    tokens_events = [f["token"] for f in events if "token" in f]
+    assert "".join(tokens_fast) == "".join(tokens_events)
+    assert len(tokens_events) == 40 and len(tokens_fast) < 10
+    assert {"status": "node_completed", "node": "analyst"} in fast
+    assert fast[-1] == {"status": "completed"}
+
+@pytest.mark.asyncio
+async def test_stream_is_cancelled_when_client_disconnects():
+    """Al irse el último cliente se cancela el grafo y la llamada al LLM libera su hueco."""
+    import asyncio
+    from ai_engine.coalescing import SingleFlight
+    from ai_engine.fake_llm import FakeStreamingChatModel
+    from ai_engine.graph_engine import get_graph
+    from ai_engine.main import MedicalQuery, build_initial_state, frames_until_disconnect, graph_config
+    from ai_engine.scheduler import llm_scheduler
+    from ai_engine.streaming import fast_token_frames
+
+    sf = SingleFlight()
+    fake = FakeStreamingChatModel(ttft=0, token_delay=0.05, output_tokens=200)
+    state = build_initial_state(MedicalQuery(patientId="PAC-X", symptoms="tos", urgencyLevel=1, consentProvided=True))
+
+    class ClienteQueSeVa:
+        def __init__(self):
+            self.conectado = True
+
+        async def is_disconnected(self):
+            return not self.conectado
+
+    request = ClienteQueSeVa()
+    with patch("ai_engine.graph_engine.llm", fake), \
+            patch("ai_engine.graph_engine.fetch_patient_info", AsyncMock(return_value={})), \
+            patch("ai_engine.main.DISCONNECT_POLL_SECONDS", 0.01):
+        subscription = sf.stream("k", lambda: fast_token_frames(get_graph(), state, graph_config()))
+        frames = frames_until_disconnect(request, subscription)
+        while "token" not in await frames.__anext__():
+            pass
+        assert llm_scheduler.in_flight == 1
+
+        request.conectado = False
+        restantes = [f async for f in frames]
+
+    assert len(restantes) < 5
+    assert sf.stats()["cancelled"] == 1 and sf.stats()["in_flight"] == 0
+    assert llm_scheduler.in_flight == 0
+
+@pytest.mark.asyncio
+async def test_retrieval_uses_single_patient_context_call():
+    """La ficha, las últimas consultas y las métricas llegan en un único viaje a Django."""
+    import httpx
+    from ai_engine.cache import patient_cache
+    from ai_engine.graph_engine import retrieval_node
+
+    peticiones = []
+
+    def django(request: httpx.Request):
+        peticiones.append(request.url.path)
+        return httpx.Response(200, json={
+            "patient_id": "PAC-CTX", "name": "Ana", "clinical_history": "Asma",
+            "consultas": [{"mensaje_usuario": "Tos seca", "respuesta_ia": "ok", "dolor": 2,
+                           "urgencia": 3, "riesgo": 1, "fecha": "2025-01-01 10:00"}],
+            "metricas": {"total": 1, "dolor_medio": 2.0, "urgencia_media": 3.0, "urgencia_max": 3,
+                         "riesgo_medio": 1.0, "ultima_consulta": "2025-01-01 10:00"},
+        })
+
+    patient_cache.invalidate("PAC-CTX")
+    async with httpx.AsyncClient(base_url="http://django/api", transport=httpx.MockTransport(django)) as c:
+        out = await retrieval_node({"patient_data": {"patient_id": "PAC-CTX"}},
+                                   {"configurable": {"http_client": c}})
+
+    assert peticiones == ["/api/patient-context/PAC-CTX/"]
+    contexto = out["messages"][0].content
+    assert contexto.startswith("Datos del Paciente (Ana): Asma")
+    assert "Tos seca" in contexto and "1 consultas" in contexto
+
+def test_history_retrieval_bounds_prompt_and_updates_incrementally():
+    """Historial largo: solo entran los fragmentos relevantes y los cambios se indexan sin rehacer todo."""
+    from ai_engine.retrieval import BM25Index, estimate_tokens, relevant_history
+
+    relleno = [f"Revisión rutinaria número {i} sin hallazgos relevantes y analítica normal." for i in range(300)]
+    historial = " ".join(relleno[:150] + ["Asma bronquial con crisis nocturnas tratada con salbutamol."] + relleno[150:])
+
+    contexto = relevant_history("PAC-R", historial, "Crisis de asma por la noche", token_budget=200)
+    assert "salbutamol" in contexto
+    assert estimate_tokens(contexto) <= 210 < estimate_tokens(historial)
+
+    indice = BM25Index()
+    indice.update(historial)
+    tokenizados = indice.tokenized
+    indice.update(historial + " Fractura de muñeca derecha en 2024.")
+    assert indice.tokenized - tokenizados <= 2
+    assert "Fractura" in indice.top_chunks("dolor en la muñeca", k=1)[0]
+
+def test_prompt_compaction_keeps_context_and_latest_symptoms():
+    """Conversaciones largas: el prompt respeta el presupuesto y conserva contexto y síntomas actuales."""
+    from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+    from ai_engine.compaction import build_prompt, compact_messages, message_tokens
+    from ai_engine.metrics import PROMPT_TOKENS_SAVED
+
+    mensajes = []
+    for i in range(50):
+        mensajes += [HumanMessage(content=f"Consulta {i}: " + "tos " * 100),
+                     SystemMessage(content=f"Datos del Paciente (Ana): contexto {i}"),
+                     AIMessage(content=f"Respuesta {i}: " + "reposo " * 100)]
+    mensajes += [HumanMessage(content="El paciente presenta: fiebre alta"),
+                 SystemMessage(content="Datos del Paciente (Ana): contexto actual")]
+
+    ahorrados = PROMPT_TOKENS_SAVED.get()
+    prompt = build_prompt(SystemMessage(content="Eres un experto analista médico."), mensajes, budget=1500)
+    assert sum(message_tokens(m) for m in prompt) <= 1500
+    assert prompt[-2].content == "El paciente presenta: fiebre alta"
+    assert prompt[-1].content == "Datos del Paciente (Ana): contexto actual"
+    assert prompt[1].content.startswith("Resumen de consultas anteriores")
+    assert not any("contexto 3" in m.content for m in prompt)
+    assert PROMPT_TOKENS_SAVED.get() > ahorrados
+
+    corto = mensajes[-2:]
+    assert build_prompt(SystemMessage(content="s"), corto)[1:] == corto
+
+    # Dentro del presupuesto también se descartan los contextos sustituidos
+    hilo = [HumanMessage(content="tos"), SystemMessage(content="contexto 1"), AIMessage(content="reposo"),
+            HumanMessage(content="fiebre"), SystemMessage(content="contexto 2")]
+    compactado, ahorro = compact_messages(hilo)
+    assert [m.content for m in compactado] == ["tos", "reposo", "fiebre", "contexto 2"]
+    assert ahorro == message_tokens(hilo[1])
+
+def test_sqlite_checkpointer_resumes_threads_and_prunes(tmp_path):
+    """Hilos persistentes en SQLite: pausa antes de la revisión ética, reanudación y poda."""
+    import asyncio
+    import sqlite3
+    import time
+    from ai_engine.checkpoint import PrunedSqliteSaver
+    from ai_engine.fake_llm import FakeStreamingChatModel
+    from ai_engine.graph_engine import build_graph
+    from ai_engine.main import MedicalQuery, build_initial_state, graph_config
+
+    db = str(tmp_path / "checkpoints.sqlite")
+    saver = PrunedSqliteSaver.from_path(db, keep_per_thread=1, prune_every=0)
+    grafo = build_graph(checkpointer=saver)
+    fake = FakeStreamingChatModel(ttft=0, token_delay=0, output_tokens=300)
+    consulta = MedicalQuery(patientId="PAC-T", symptoms="tos", urgencyLevel=1, consentProvided=True)
+
+    with patch("ai_engine.graph_engine.llm", fake), \
+            patch("ai_engine.graph_engine.fetch_patient_info", AsyncMock(return_value={})), \
+            patch("ai_engine.main.get_graph", return_value=grafo), \
+            patch("ai_engine.graph_engine.audit_writer.record", AsyncMock()) as auditoria:
+        for _ in range(2):
+            asyncio.run(grafo.ainvoke(build_initial_state(consulta), config=graph_config(thread_id="hilo-1"),
+                                      durability="exit"))
+        snapshot = grafo.get_state({"configurable": {"thread_id": "hilo-1"}})
+        assert snapshot.next == ("ethics_reviewer",)
+        assert len(snapshot.values["messages"]) == 6  # La conversación continúa en el mismo hilo
+        auditoria.assert_not_called()
+
+        r = client.post("/threads/hilo-1/review")
+        assert r.status_code == 200 and r.json()["thread_id"] == "hilo-1"
+        assert r.json()["agent_in_charge"] == "Ethics_Reviewer_Agent"
+        auditoria.assert_called_once()
+        assert client.post("/threads/hilo-1/review").status_code == 409
+
+    tipos = {t for (t,) in sqlite3.connect(db).execute("SELECT type FROM checkpoints")}
+    assert any(t.endswith("+zlib") for t in tipos)
+    assert saver.prune_old()["checkpoints"] > 0 and saver.size()["checkpoints"] == 1
+    assert saver.prune_old(now=time.time() + saver.max_age + 1)["threads"] == 1
+    assert saver.size() == {"threads": 0, "checkpoints": 0, "checkpoint_bytes": 0}
+
+def test_reused_thread_audits_latest_turn_and_skips_cache(tmp_path):
+    """En un hilo reutilizado se audita el turno actual y el seguimiento no se sirve de la caché."""
+    import asyncio
+    from langgraph.checkpoint.memory import MemorySaver
+    from ai_engine.cache import ResponseCache, SQLiteTTLStore, TTLCache
+    from ai_engine.fake_llm import FakeStreamingChatModel
+    from ai_engine.graph_engine import build_graph
+    from ai_engine.main import MedicalQuery, build_initial_state, graph_config
+    from ai_engine.resilience import llm_caller
+
+    grafo = build_graph(checkpointer=MemorySaver())
+    cache = ResponseCache(TTLCache(maxsize=8, ttl=60), SQLiteTTLStore(str(tmp_path / "c.db")))
+    fake = FakeStreamingChatModel(ttft=0, token_delay=0, output_tokens=20)
+
+    async def turno(sintomas, hilo):
+        consulta = MedicalQuery(patientId="PAC-H", symptoms=sintomas, urgencyLevel=1, consentProvided=True)
+        config = graph_config(thread_id=hilo)
+        await grafo.ainvoke(build_initial_state(consulta), config=config)
+        return await grafo.ainvoke(None, config=config)
+
+    with patch("ai_engine.graph_engine.analysis_cache", cache), \
+            patch("ai_engine.graph_engine.llm", fake), \
+            patch("ai_engine.graph_engine.fetch_patient_info", AsyncMock(return_value={})), \
+            patch.object(llm_caller, "ainvoke", wraps=llm_caller.ainvoke) as llamada_llm, \
+            patch("ai_engine.graph_engine.audit_writer.record", AsyncMock()) as auditoria:
+        asyncio.run(turno("tos seca", "hilo-a"))
+        asyncio.run(turno("fiebre", "hilo-b"))
+        # Mismos síntomas que el hilo A, pero como seguimiento de otra conversación
+        seguimiento = asyncio.run(turno("tos seca", "hilo-b"))
+
+    assert llamada_llm.call_count == 3
+    assert not seguimiento["messages"][-1].response_metadata.get("cache_hit")
+    auditados = [c.args[0]["mensaje_usuario"] for c in auditoria.call_args_list]
+    assert [m.rsplit(": ", 1)[-1] for m in auditados] == ["tos seca", "fiebre", "tos seca"]
+
+async def test_llm_hedging_retries_and_deadline_with_fake_model():
+    """Cobertura ante un primer token lento, reintento tras un fallo y plazo total agotado."""
+    import asyncio
+    import time
+    from langchain_core.messages import HumanMessage
+    from ai_engine.fake_llm import FakeStreamingChatModel
+    from ai_engine.resilience import LLMDeadlineExceeded, ResilientLLMCaller
+    from ai_engine.scheduler import LLMScheduler
+
+    prompt = [HumanMessage(content="fiebre")]
+    esperado = "".join(FakeStreamingChatModel(output_tokens=10)._tokens())
+    sched = LLMScheduler(max_in_flight=4)
+
+    # La primera llamada tarda 5 s en dar el primer token: la cobertura gana y se cancela la original
+    lento = FakeStreamingChatModel(ttft=0.01, token_delay=0, output_tokens=10, slow_every=2, slow_ttft=5)
+    caller = ResilientLLMCaller(hedge=True, hedge_delay=0.05, scheduler=sched)
+    t = time.perf_counter()
+    respuesta = await caller.ainvoke(lento, prompt)
+    assert respuesta.content == esperado and time.perf_counter() - t < 1
+    assert caller.stats["hedges_issued"] == 1 and caller.stats["hedges_won"] == 1
+    assert sched.in_flight == 0  # El hueco de la cobertura se devuelve
+
+    # Fallo antes del primer token: se reintenta
+    falla = FakeStreamingChatModel(ttft=0, token_delay=0, output_tokens=10, fail_every=2)
+    caller = ResilientLLMCaller(retry_base_delay=0, scheduler=sched)
+    assert (await caller.ainvoke(falla, prompt)).content == esperado
+    assert caller.stats["retries"] == 1
+
+    # Sin respuesta dentro del plazo total
+    colgado = FakeStreamingChatModel(ttft=0, output_tokens=10, slow_every=1, slow_ttft=5)
+    caller = ResilientLLMCaller(timeout=0.1, scheduler=sched)
+    with pytest.raises(LLMDeadlineExceeded):
+        await caller.ainvoke(colgado, prompt)
+    assert caller.stats["deadline_exceeded"] == 1
+
+    # Percentil fuera de 1..99 (p.ej. LLM_HEDGE_PERCENTILE=100): se ajusta en lugar de romper cada llamada
+    caller = ResilientLLMCaller(hedge_percentile=100, hedge_min_samples=1, scheduler=sched)
+    caller.ttfts.extend([0.1, 0.2, 0.3])
+    assert caller.hedge_percentile == 99 and caller.hedge_delay() > 0
+
+def test_hedged_stream_emits_a_single_attempt():
+    """Con hedging, /analyze-stream solo emite el texto del intento ganador, en ambos modos."""
+    import asyncio
+    from collections import deque
+    from ai_engine.fake_llm import FakeStreamingChatModel
+    from ai_engine.resilience import llm_caller
+    from langchain_core.messages import AIMessageChunk
+    from langchain_core.outputs import ChatGenerationChunk
+    from pydantic import PrivateAttr
+
+    class Carrera(FakeStreamingChatModel):
+        """La original responde justo cuando la cobertura ya ha emitido su primer token."""
+
+        _turno: asyncio.Event = PrivateAttr(default_factory=asyncio.Event)
+
+        async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+            self._calls += 1
+            if self._calls % 2:
+                await self._turno.wait()
+                tokens = ["original ", "completa"]
+            else:
+                self._turno.set()
+                tokens = ["cobertura ", "tardía"]
+            for token in tokens:
+                yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+                await asyncio.sleep(0.2 if token == "cobertura " else 0)
+
+    payload = {"patientId": "PAC-H", "symptoms": "vértigo", "urgencyLevel": 1, "consentProvided": True}
+    lento = FakeStreamingChatModel(ttft=0.01, token_delay=0, output_tokens=10, slow_every=2, slow_ttft=5)
+    esperado = "".join(lento._tokens())
+
+    def texto(llm, mode):
+        with patch("ai_engine.graph_engine.llm", llm), \
+                patch("ai_engine.graph_engine.fetch_patient_info", AsyncMock(return_value={})), \
+                patch.object(llm_caller, "hedge", True), \
+                patch.object(llm_caller, "default_hedge_delay", 0.05), \
+                patch.object(llm_caller, "ttfts", deque(maxlen=500)):
+            body = client.post(f"/analyze-stream?mode={mode}", json=payload).text
+        frames = [json.loads(l[len("data: "):]) for l in body.split("\n\n") if l.startswith("data: ")]
+        return "".join(f["token"] for f in frames if "token" in f)
+
+    hedges_won = llm_caller.stats["hedges_won"]
+    for mode in ("fast", "events"):
+        # La original no responde en 5 s: gana la cobertura y su texto llega completo al stream
+        assert texto(lento, mode) == esperado
+        # La cobertura ya había emitido un token cuando gana la original: no debe colarse
+        # Ambos intentos tienen ya su primer token al elegir ganador: el perdedor no debe colarse
+        assert texto(Carrera(), mode) in ("original completa", "cobertura tardía")
+    assert llm_caller.stats["hedges_won"] == hedges_won + 2
+
+def test_fast_path_answers_mild_cases_without_llm():
+    """Triaje por reglas: consultas leves conocidas por plantilla; signos de alarma o urgencia al LLM."""
+    import asyncio
+    from langgraph.checkpoint.memory import MemorySaver
+    from ai_engine.fake_llm import FakeStreamingChatModel
+    from ai_engine.graph_engine import build_graph
+    from ai_engine.main import MedicalQuery, build_initial_state, graph_config
+    from ai_engine.metrics import FAST_PATH_ANSWERS
+    from ai_engine.resilience import llm_caller
+    from ai_engine.triage import triage_metrics, triage_scorer
+
+    grafo = build_graph(checkpointer=MemorySaver(), fast_path=True)
+    fake = FakeStreamingChatModel(ttft=0, token_delay=0, output_tokens=20)
+
+    async def ejecutar(sintomas, urgencia, hilo):
+        consulta = MedicalQuery(patientId="PAC-F", symptoms=sintomas, urgencyLevel=urgencia, consentProvided=True)
+        config = graph_config(thread_id=hilo)
+        await grafo.ainvoke(build_initial_state(consulta), config=config)
+        assert grafo.get_state(config).next == ("ethics_reviewer",)
+        return await grafo.ainvoke(None, config=config)  # La plantilla también pasa la revisión ética
+
+    antes = FAST_PATH_ANSWERS.get("resfriado_comun")
+    with patch("ai_engine.graph_engine.llm", fake), \
+            patch("ai_engine.graph_engine.fetch_patient_info", AsyncMock(return_value={})), \
+            patch.object(llm_caller, "ainvoke", wraps=llm_caller.ainvoke) as llamada_llm, \
+            patch("ai_engine.graph_engine.audit_writer.record", AsyncMock()) as auditoria:
+        leve = asyncio.run(ejecutar("Resfriado con mocos y estornudos", 1, "fp-leve"))
+        assert leve["triage"]["category"] == "resfriado_comun" and leve["safety_check_passed"]
+        assert leve["messages"][-1].response_metadata["fast_path"] == "resfriado_comun"
+        assert llamada_llm.call_count == 0 and auditoria.call_count == 1
+
+        alarma = asyncio.run(ejecutar("Resfriado con mocos y dolor en el pecho", 1, "fp-alarma"))
+        urgente = asyncio.run(ejecutar("Resfriado con mocos y estornudos", 8, "fp-urgente"))
+        assert not alarma["triage"]["fast_path"] and not urgente["triage"]["fast_path"]
+        assert llamada_llm.call_count == 2 and auditoria.call_count == 3
+
+    assert FAST_PATH_ANSWERS.get("resfriado_comun") == antes + 1
+    assert triage_metrics("Dolor fuerte, es urgente") == [8, 9, 2]
+    assert triage_scorer.score_batch(["Cuadro GRAVE", "", None, "Cuadro GRAVE"]) == [[4, 3, 7], [4, 3, 2], [4, 3, 2], [4, 3, 7]]
+
+
+def test_data_layer_triage_rules_match_engine():
+    """La copia de las reglas en la capa de datos (otro servicio) coincide con la del motor."""
+    import importlib.util
+    from pathlib import Path
+    from ai_engine.triage import METRIC_RULES
+
+    ruta = Path(__file__).resolve().parents[2] / "data-layer" / "medical_records" / "triaje.py"
+    spec = importlib.util.spec_from_file_location("triaje_data_layer", ruta)
+    triaje = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(triaje)
+    assert triaje.METRIC_RULES == METRIC_RULES
+    assert triaje.triage_scorer.score("Dolor fuerte, es urgente") == [8, 9, 2]
@@ -0,0 +1,166 @@
+# triage.py
+# Reglas locales de triaje. Sin dependencias pesadas (ni LangChain ni Django) para poder
+# usarse desde el grafo, el dashboard y la capa de datos.
+
+import os
+import re
+from typing import Dict, Iterable, List, Optional
+
+from ai_engine.cache import normalize_text
+
+# Palabras clave de las métricas de triaje (las de extraer_metricas del dashboard)
+DOLOR_KEYWORDS = ["fuerte", "intenso", "agudo", "10/10"]
+URGENCIA_KEYWORDS = ["urgente", "emergencia", "inmediata"]
+RIESGO_KEYWORDS = ["grave", "crítico", "complicado"]
+
+# Métrica -> (palabras clave, puntuación si aparece alguna, puntuación si no).
+# La capa de datos tiene su copia en medical_records/triaje.py (recalcular_triaje): se cambian juntas
+METRIC_RULES = {
+    "dolor": (DOLOR_KEYWORDS, 8, 4),
+    "urgencia": (URGENCIA_KEYWORDS, 9, 3),
+    "riesgo": (RIESGO_KEYWORDS, 7, 2),
+}
+
+# Signos de alarma: cualquiera de ellos descarta la respuesta por plantilla
+RED_FLAGS = DOLOR_KEYWORDS + URGENCIA_KEYWORDS + RIESGO_KEYWORDS + [
+    "pecho", "torácico", "dificultad para respirar", "falta de aire", "ahogo", "desmayo", "pérdida de conocimiento",
+    "convulsión", "sangre", "sangrado", "vómitos con sangre", "heces negras", "rigidez de nuca", "confusión",
+    "parálisis", "no puedo mover", "visión borrosa", "habla", "embarazada", "embarazo", "bebé", "recién nacido",
+    "fiebre alta", "40 grados", "39", "alergia grave", "hinchazón de la cara", "hinchazón de labios",
+    "suicid", "peor dolor", "días sin mejorar", "semanas",
+]
+
+FAST_PATH_ENABLED = os.getenv("FAST_PATH_ENABLED", "0") == "1"
+FAST_PATH_MAX_URGENCY = int(os.getenv("FAST_PATH_MAX_URGENCY", "3"))
+FAST_PATH_MIN_CONFIDENCE = float(os.getenv("FAST_PATH_MIN_CONFIDENCE", "0.6"))
+
+_CIERRE = (
+    "\n\nSi tiene alergias a medicamentos, enfermedades crónicas o toma otra medicación, consulte con su "
+    "médico o farmacéutico antes de tomar cualquier fármaco. Si los síntomas empeoran, aparecen signos de "
+    "alarma (fiebre alta, dificultad respiratoria, dolor en el pecho) o no mejoran en 3-5 días, solicite "
+    "valoración médica o acuda a urgencias."
+)
+
+# Motivos de consulta frecuentes y leves con su respuesta revisada por el equipo clínico
+COMPLAINTS: Dict[str, dict] = {
+    "resfriado_comun": {
+        "keywords": ["resfriado", "catarro", "mocos", "congestión nasal", "nariz tapada", "estornudos",
+                     "goteo nasal", "dolor de garganta", "carraspera", "tos leve"],
+        "template": (
+            "Los síntomas descritos son compatibles con un resfriado común, un proceso vírico leve que suele "
+            "resolverse en 7-10 días. Se recomienda reposo relativo, hidratación abundante, lavados nasales con "
+            "suero fisiológico y, si hay malestar o febrícula, paracetamol a las dosis indicadas en el prospecto. "
+            "Los antibióticos no son útiles frente a los resfriados."
+        ),
+    },
+    "cefalea_tensional": {
+        "keywords": ["dolor de cabeza", "cefalea", "cabeza cargada", "tensión en la nuca", "estrés",
+                     "pantalla", "cansancio"],
+        "template": (
+            "Los síntomas descritos son compatibles con una cefalea tensional, habitualmente relacionada con "
+            "estrés, cansancio, postura o uso prolongado de pantallas. Se recomienda descanso en un lugar "
+            "tranquilo, buena hidratación, pausas activas y, si lo necesita, un analgésico común (paracetamol "
+            "o ibuprofeno) a las dosis del prospecto, evitando su uso más de 2-3 días por semana."
+        ),
+    },
+    "dispepsia": {
+        "keywords": ["acidez", "ardor de estómago", "ardor", "indigestión", "digestión pesada", "gases",
+                     "hinchazón abdominal", "reflujo"],
+        "template": (
+            "Los síntomas descritos son compatibles con una dispepsia o acidez leve. Se recomienda realizar "
+            "comidas ligeras y frecuentes, evitar grasas, picantes, alcohol, café y tabaco, no acostarse justo "
+            "después de comer y elevar ligeramente el cabecero de la cama. Un antiácido de venta libre puede "
+            "aliviar los síntomas de forma puntual."
+        ),
+    },
+    "picadura_insecto": {
+        "keywords": ["picadura", "mosquito", "picor", "roncha", "habón", "insecto"],
+        "template": (
+            "Los síntomas descritos son compatibles con una reacción local leve a una picadura de insecto. "
+            "Se recomienda lavar la zona con agua y jabón, aplicar frío local y evitar rascarse. Un "
+            "antihistamínico oral o una crema calmante pueden aliviar el picor."
+        ),
+    },
+    "dolor_muscular": {
+        "keywords": ["agujetas", "contractura", "dolor muscular", "sobrecarga", "deporte", "ejercicio",
+                     "tirón"],
+        "template": (
+            "Los síntomas descritos son compatibles con un dolor muscular por sobrecarga o contractura leve. "
+            "Se recomienda reposo relativo de la zona, calor local, estiramientos suaves y, si lo necesita, "
+            "un analgésico común a las dosis del prospecto. Retome la actividad física de forma progresiva."
+        ),
+    },
+}
+
+
+def _pattern(keywords: List[str]) -> re.Pattern:
+    # Coincidencia sobre texto normalizado (minúsculas, sin tildes ni puntuación) y por inicio de palabra
+    terms = sorted({normalize_text(k) for k in keywords} - {""}, key=len, reverse=True)
+    return re.compile(r"\b(?:" + "|".join(re.escape(t) for t in terms) + r")")
+
+
+_RED_FLAGS = _pattern(RED_FLAGS)
+_COMPLAINTS = {name: _pattern(c["keywords"]) for name, c in COMPLAINTS.items()}
+
+
+class TriageScorer:
+    """
+    Métricas [dolor, urgencia, riesgo] por palabras clave, compiladas una sola vez.
+    Cada texto se pasa a minúsculas una vez y cada métrica se corta en la primera coincidencia.
+    Las búsquedas de subcadena de CPython son más rápidas que una expresión regular con
+    alternativas (combinada o por métrica) para estas listas, así que no se usa `re`.
+    """
+
+    def __init__(self, rules: Dict[str, tuple] = METRIC_RULES):
+        self.metrics = list(rules)
+        self._rules = [
+            (tuple(sorted({k.lower() for k in keywords}, key=len)), hit, miss)
+            for keywords, hit, miss in rules.values()
+        ]
+
+    def score(self, text: str) -> list:
+        texto = (text or "").lower()
+        return [hit if any(k in texto for k in keywords) else miss for keywords, hit, miss in self._rules]
+
+    def score_batch(self, texts: Iterable[str]) -> List[list]:
+        """Puntúa un lote; los textos repetidos (p.ej. respuestas por plantilla) se puntúan una vez."""
+        seen: Dict[str, list] = {}
+        return [seen[t] if t in seen else seen.setdefault(t, self.score(t)) for t in texts]
+
+
+triage_scorer = TriageScorer()
+
+
+def triage_metrics(text: str) -> list:
+    """Métricas [dolor, urgencia, riesgo] por palabras clave (las que registra el dashboard)."""
+    return triage_scorer.score(text)
+
+
+def classify_complaint(text: str) -> dict:
+    """
+    Clasifica la consulta en un motivo frecuente. La confianza crece con las coincidencias
+    distintas del motivo ganador y baja con las de otros motivos; un signo de alarma la anula.
+    """
+    normalized = normalize_text(text)
+    red_flags = sorted(set(_RED_FLAGS.findall(normalized)))
+    hits = {name: set(p.findall(normalized)) for name, p in _COMPLAINTS.items()}
+    best = max(hits, key=lambda name: len(hits[name]))
+    top = len(hits[best])
+    others = sum(len(h) for name, h in hits.items() if name != best)
+    confidence = 0.0 if red_flags or not top else round(top / (top + others + 1), 3)
+    return {
+        "category": best if top else None,
+        "confidence": confidence,
+        "matches": sorted(hits[best]),
+        "red_flags": red_flags,
+    }
+
+
+def fast_path_answer(text: str, urgency_level: int,
+                     max_urgency: int = FAST_PATH_MAX_URGENCY,
+                     min_confidence: float = FAST_PATH_MIN_CONFIDENCE) -> Optional[dict]:
+    """Respuesta por plantilla si la consulta es leve, conocida y la clasificación es fiable."""
+    result = classify_complaint(text)
+    if urgency_level > max_urgency or result["category"] is None or result["confidence"] < min_confidence:
+        return None
+    return {**result, "answer": COMPLAINTS[result["category"]]["template"] + _CIERRE}
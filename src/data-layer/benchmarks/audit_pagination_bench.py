@@ -0,0 +1,132 @@
+# audit_pagination_bench.py
+"""
+Latencia de /api/audit-logs/ según crece la tabla ConsultaIA, sobre una base SQLite
+temporal sembrada con N filas (no toca db.sqlite3):
+
+  - cursor:         paginación por cursor (la de la API) a distintas profundidades
+  - cursor+filtros: por paciente y con umbral de riesgo
+  - offset:         LIMIT/OFFSET equivalente, como referencia de lo que se evita
+
+    cd src/data-layer && python -m benchmarks.audit_pagination_bench --sizes 100000,1000000,3000000
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "omnicare_db.settings")
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+PACIENTES = 1000
+PAGE_SIZE = 100
+INICIO = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+
+def setup_database(path: str):
+    settings.DATABASES["default"]["NAME"] = path
+    django.setup()
+    from django.core.management import call_command
+    from django.test.utils import setup_test_environment
+    setup_test_environment()  # ALLOWED_HOSTS para el cliente de pruebas
+    call_command("migrate", verbosity=0)
+
+
+def seed(desde: int, hasta: int, batch: int = 50000):
+    """Inserta las filas [desde, hasta) con SQL directo (bulk_create es demasiado lento aquí)."""
+    from django.contrib.auth.models import User
+    from django.db import connection, transaction
+    from medical_records.models import ConsultaIA
+
+    if not User.objects.exists():
+        User.objects.bulk_create([User(username=f"PAC-{i}", password="!") for i in range(PACIENTES)])
+    ids = list(User.objects.order_by("id").values_list("id", flat=True))
+    tabla = ConsultaIA._meta.db_table
+    sql = (f"INSERT INTO {tabla} (paciente_id, fecha, mensaje_usuario, respuesta_ia, dolor, urgencia, riesgo) "
+           "VALUES (%s, %s, %s, %s, %s, %s, %s)")
+    rng = random.Random(desde)
+    for start in range(desde, hasta, batch):
+        filas = [
+            (ids[n % PACIENTES], connection.ops.adapt_datetimefield_value(INICIO + timedelta(seconds=n)),
+             f"Consulta {n}", "Reposo e hidratación.", rng.randint(0, 10), rng.randint(0, 10), rng.randint(0, 10))
+            for n in range(start, min(start + batch, hasta))
+        ]
+        with transaction.atomic(), connection.cursor() as cur:
+            cur.executemany(sql, filas)
+
+
+def timed(fn, repeat: int = 20) -> float:
+    fn()  # calentamiento
+    muestras = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        muestras.append(time.perf_counter() - t0)
+    return round(statistics.median(muestras) * 1000, 3)
+
+
+def measure(filas: int) -> dict:
+    from django.contrib.auth.models import User
+    from rest_framework.pagination import Cursor
+    from rest_framework.test import APIClient
+    from medical_records.models import ConsultaIA
+    from medical_records.pagination import AuditLogCursorPagination
+    from medical_records.serializers import AiAuditLogSerializer
+
+    client = APIClient()
+    client.force_authenticate(User.objects.first())
+    url = "/api/audit-logs/"
+    paginador = AuditLogCursorPagination()
+    paginador.base_url = f"http://testserver{url}"
+
+    def cursor_a(profundidad: float) -> str:
+        # Cursor equivalente a haber seguido los enlaces 'next' hasta esa fracción de la tabla
+        fecha = INICIO + timedelta(seconds=int(filas * (1 - profundidad)))
+        return paginador.encode_cursor(Cursor(offset=0, reverse=False, position=str(fecha)))
+
+    def get(url_completa):
+        r = client.get(url_completa)
+        assert r.status_code == 200 and r.data["results"], r.status_code
+
+    def offset_page(profundidad: float):
+        inicio = int(filas * profundidad)
+        qs = ConsultaIA.objects.select_related("paciente").order_by("-fecha", "-id")[inicio:inicio + PAGE_SIZE]
+        AiAuditLogSerializer(qs, many=True).data
+
+    resultado = {"rows": filas}
+    for profundidad in (0, 0.5, 0.9):
+        resultado[f"cursor_ms@{profundidad:.0%}"] = timed(lambda: get(cursor_a(profundidad) if profundidad else url))
+        resultado[f"offset_ms@{profundidad:.0%}"] = timed(lambda: offset_page(profundidad))
+    resultado["cursor_ms_paciente"] = timed(lambda: get(f"{url}?paciente=PAC-7"))
+    resultado["cursor_ms_riesgo_min_8"] = timed(lambda: get(f"{url}?riesgo_min=8"))
+    return resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="100000,1000000", help="tamaños de tabla (filas), crecientes")
+    args = parser.parse_args()
+    sizes = sorted(int(s) for s in args.sizes.split(","))
+
+    resultados = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        setup_database(os.path.join(tmpdir, "audit_bench.sqlite3"))
+        sembradas = 0
+        for size in sizes:
+            seed(sembradas, size)
+            sembradas = size
+            resultados.append(measure(size))
+            print(json.dumps(resultados[-1]), file=sys.stderr)
+    print(json.dumps(resultados, indent=2))
+
+
+if __name__ == "__main__":
+    main()
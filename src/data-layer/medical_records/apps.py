@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class MedicalRecordsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'medical_records'
+
+    def ready(self):
+        # Registra los receptores que invalidan la caché del motor de IA
+        from . import signals  # noqa: F401
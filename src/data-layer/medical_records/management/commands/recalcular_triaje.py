@@ -0,0 +1,61 @@
+import time
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from medical_records.models import ConsultaIA
+from medical_records.triaje import triage_scorer
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalcula las métricas de triaje (dolor, urgencia, riesgo) de todas las ConsultaIA "
+        "con las reglas actuales de medical_records.triaje, por lotes y actualizando solo las que cambian."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Filas leídas y actualizadas por lote')
+        parser.add_argument('--dry-run', action='store_true', help='Cuenta los cambios sin escribirlos')
+
+    def handle(self, *args, chunk_size, dry_run, **options):
+        inicio = time.monotonic()
+        revisadas = cambiadas = 0
+        ultimo_id = 0
+
+        while True:
+            # Paginación por clave (id > último): cada lote cuesta lo mismo aunque la tabla crezca,
+            # y solo se leen las columnas necesarias, sin instanciar modelos completos
+            filas = list(
+                ConsultaIA.objects.filter(id__gt=ultimo_id).order_by('id')
+                .values_list('id', 'respuesta_ia', 'dolor', 'urgencia', 'riesgo')[:chunk_size]
+            )
+            if not filas:
+                break
+            ultimo_id = filas[-1][0]
+
+            # Las métricas se calculan sobre la respuesta de la IA, igual que en el dashboard
+            puntuaciones = triage_scorer.score_batch(f[1] for f in filas)
+            # Pocas combinaciones posibles de métricas: un UPDATE ... WHERE id IN (...) por combinación
+            cambios = defaultdict(list)
+            for f, p in zip(filas, puntuaciones):
+                if list(f[2:]) != p:
+                    cambios[tuple(p)].append(f[0])
+            if cambios and not dry_run:
+                # update() no toca auto_now: 'actualizado' invalida los PDF cacheados de esos pacientes
+                ahora = timezone.now()
+                with transaction.atomic():
+                    for (dolor, urgencia, riesgo), ids in cambios.items():
+                        ConsultaIA.objects.filter(id__in=ids).update(
+                            dolor=dolor, urgencia=urgencia, riesgo=riesgo, actualizado=ahora
+                        )
+
+            revisadas += len(filas)
+            cambiadas += sum(len(ids) for ids in cambios.values())
+            self.stdout.write(f"{revisadas} revisadas, {cambiadas} con cambios")
+
+        accion = "se actualizarían" if dry_run else "actualizadas"
+        self.stdout.write(self.style.SUCCESS(
+            f"Triaje recalculado: {revisadas} consultas, {cambiadas} {accion} en {time.monotonic() - inicio:.1f}s"
+        ))
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:10
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical_records', '0006_remove_consultationlog_patient_alter_patient_doctor_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='consultaia',
+            index=models.Index(fields=['-fecha', '-id'], name='consulta_fecha_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='consultaia',
+            index=models.Index(fields=['paciente', '-fecha', '-id'], name='consulta_paciente_fecha_idx'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:38
+
+import unicodedata
+
+import django.db.models.functions.text
+from django.conf import settings
+from django.db import migrations, models
+
+
+def normalizar_busqueda(texto):
+    # Copia de medical_records.models.normalizar_busqueda en el momento de esta migración:
+    # los cambios posteriores de la función no alteran lo que hace la migración
+    descompuesto = unicodedata.normalize('NFKD', texto or '')
+    return ''.join(c for c in descompuesto if not unicodedata.combining(c)).casefold()
+
+
+def rellenar_nombre_busqueda(apps, schema_editor):
+    Patient = apps.get_model('medical_records', 'Patient')
+    pacientes = list(Patient.objects.only('id', 'name'))
+    for p in pacientes:
+        p.nombre_busqueda = normalizar_busqueda(p.name)
+    Patient.objects.bulk_update(pacientes, ['nombre_busqueda'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical_records', '0008_consultaia_paciente_sin_indice_simple'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patient',
+            name='nombre_busqueda',
+            field=models.CharField(default='', editable=False, max_length=200),
+        ),
+        migrations.RunPython(rellenar_nombre_busqueda, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['doctor', 'nombre_busqueda', 'id'], name='patient_doctor_nombre_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['nombre_busqueda', 'id'], name='patient_nombre_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(django.db.models.functions.text.Upper('patient_id'), name='patient_id_upper_idx'),
+        ),
+    ]
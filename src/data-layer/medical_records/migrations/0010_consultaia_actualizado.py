@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:41
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def actualizado_desde_fecha(apps, schema_editor):
+    # Las consultas existentes toman su fecha de alta como último cambio
+    ConsultaIA = apps.get_model('medical_records', 'ConsultaIA')
+    ConsultaIA.objects.update(actualizado=models.F('fecha'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical_records', '0009_patient_nombre_busqueda'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='consultaia',
+            name='actualizado',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(actualizado_desde_fecha, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='consultaia',
+            index=models.Index(fields=['paciente', 'actualizado'], name='consulta_paciente_act_idx'),
+        ),
+    ]
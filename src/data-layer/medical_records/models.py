@@ -1,6 +1,16 @@
+import unicodedata
+
 from django.db import models
+from django.db.models.functions import Upper
 from django.contrib.auth.models import User
 
+
+def normalizar_busqueda(texto):
+    """Clave de búsqueda y orden: sin tildes ni diéresis (ñ -> n) y en minúsculas Unicode."""
+    descompuesto = unicodedata.normalize('NFKD', texto or '')
+    return ''.join(c for c in descompuesto if not unicodedata.combining(c)).casefold()
+
+
 class Patient(models.Model):
     # Relación con el médico (User)
     doctor = models.ForeignKey(
@@ -13,16 +23,47 @@ class Patient(models.Model):
     
     patient_id = models.CharField(max_length=20, unique=True)
     name = models.CharField(max_length=100)
+    # Derivado de name en save(). UPPER() de SQLite solo convierte ASCII ('Muñoz' -> 'MUñOZ'),
+    # así que la búsqueda y el orden usan una columna normalizada en Python
+    nombre_busqueda = models.CharField(max_length=200, editable=False, default='')
     clinical_history = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Listado y búsqueda por nombre de /api/manage-patients/ (por médico y global)
+            models.Index(fields=['doctor', 'nombre_busqueda', 'id'], name='patient_doctor_nombre_idx'),
+            models.Index(fields=['nombre_busqueda', 'id'], name='patient_nombre_idx'),
+            # Búsqueda por DNI sin distinguir mayúsculas (los DNI son ASCII)
+            models.Index(Upper('patient_id'), name='patient_id_upper_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.nombre_busqueda = normalizar_busqueda(self.name)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'name' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'nombre_busqueda'}
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # DNI con el que se cargó la ficha: si se edita, signals.py invalida también
+        # la caché del anterior en el motor de IA (None si el campo se difirió)
+        instance._patient_id_cargado = instance.__dict__.get('patient_id')
+        return instance
+
     def __str__(self):
         return f"{self.name} - Dr. {self.doctor.username if self.doctor else 'S/D'}"
     
 class ConsultaIA(models.Model):
     # Relacionamos la consulta con el usuario (Paciente)
-    paciente = models.ForeignKey(User, on_delete=models.CASCADE, related_name='consultas')
+    # Sin índice propio: lo cubre el índice compuesto (paciente, -fecha, -id)
+    paciente = models.ForeignKey(User, on_delete=models.CASCADE, related_name='consultas', db_index=False)
     fecha = models.DateTimeField(auto_now_add=True)
+    # Marca de cambio para la versión del PDF cacheado. auto_now no se aplica en
+    # QuerySet.update(): quien actualice en bloque debe fijarla (ver recalcular_triaje)
+    actualizado = models.DateTimeField(auto_now=True)
     
     # Textos de la conversación
     mensaje_usuario = models.TextField()
@@ -33,5 +74,14 @@ class ConsultaIA(models.Model):
     urgencia = models.IntegerField(default=0)
     riesgo = models.IntegerField(default=0)
 
+    class Meta:
+        indexes = [
+            # Paginación por cursor de la auditoría (-fecha, -id), global y por paciente
+            models.Index(fields=['-fecha', '-id'], name='consulta_fecha_id_idx'),
+            models.Index(fields=['paciente', '-fecha', '-id'], name='consulta_paciente_fecha_idx'),
+            # Versión del informe PDF (recuento, último id y último cambio) sin leer las filas
+            models.Index(fields=['paciente', 'actualizado'], name='consulta_paciente_act_idx'),
+        ]
+
     def __str__(self):
         return f"Consulta de {self.paciente.username} - {self.fecha.strftime('%d/%m/%Y')}"
\ No newline at end of file
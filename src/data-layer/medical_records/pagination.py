@@ -0,0 +1,21 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class AuditLogCursorPagination(CursorPagination):
+    """
+    Paginación por cursor (keyset) de la auditoría: cada página es un
+    WHERE fecha < cursor ORDER BY fecha DESC, id DESC LIMIT n resuelto con el índice
+    (fecha, id), sin OFFSET ni COUNT(*), así que su coste no crece con la tabla.
+    """
+    ordering = ('-fecha', '-id')
+    page_size = getattr(settings, 'AUDIT_PAGE_SIZE', 100)
+    page_size_query_param = 'page_size'
+    max_page_size = getattr(settings, 'AUDIT_MAX_PAGE_SIZE', 1000)
+
+
+class PatientPagination(PageNumberPagination):
+    """Listado de pacientes del médico por páginas (?page=, ?page_size=)."""
+    page_size = getattr(settings, 'PATIENT_LIST_PAGE_SIZE', 50)
+    page_size_query_param = 'page_size'
+    max_page_size = getattr(settings, 'PATIENT_LIST_MAX_PAGE_SIZE', 500)
@@ -0,0 +1,21 @@
+import json
+
+from rest_framework.renderers import BaseRenderer
+
+
+class NDJSONRenderer(BaseRenderer):
+    """Un objeto JSON por línea (application/x-ndjson); ?format=ndjson."""
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    @staticmethod
+    def line(item) -> str:
+        return json.dumps(item, ensure_ascii=False, default=str) + '\n'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Respuestas no streaming (p.ej. errores): lista -> una línea por elemento
+        if data is None:
+            return b''
+        items = data if isinstance(data, list) else [data]
+        return ''.join(self.line(item) for item in items).encode(self.charset)
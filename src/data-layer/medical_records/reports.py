@@ -0,0 +1,218 @@
+import hashlib
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+from reportlab.lib import colors
+from reportlab.lib.colors import HexColor  # Importación específica para colores Hex
+from reportlab.lib.pagesizes import letter
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+
+# Cambiar si cambia el diseño del informe: invalida los PDF ya cacheados
+REPORT_VERSION = 1
+
+# --- ESTILOS (se construyen una vez al importar, no en cada petición) ---
+PRIMARY_COLOR = HexColor("#1C83E1")
+STYLES = getSampleStyleSheet()
+TITLE_STYLE = ParagraphStyle('TitleStyle', parent=STYLES['Heading1'], textColor=PRIMARY_COLOR, spaceAfter=12)
+HEADER_STYLE = ParagraphStyle('HeaderStyle', parent=STYLES['Normal'], fontSize=10, textColor=colors.grey)
+BODY_STYLE = ParagraphStyle('BodyStyle', parent=STYLES['Normal'], fontSize=9, leading=12)
+TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), PRIMARY_COLOR),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+    ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 9),
+    ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+    ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.whitesmoke]),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
+    ('TOPPADDING', (0, 0), (-1, -1), 8),
+])
+NOTA_LEGAL = """
+<i fontSize="8">Este documento ha sido generado automáticamente por el sistema de IA OmniCare.
+Los datos de triaje son orientativos y deben ser validados por un facultativo colegiado.
+Cumple con la normativa RGPD de protección de datos de salud.</i>
+"""
+
+CAMPOS_INFORME = ('fecha', 'dolor', 'urgencia', 'riesgo', 'mensaje_usuario')
+
+
+def consultas_informe(usuario_id):
+    """Filas del informe, de la más reciente, por el índice (paciente, -fecha, -id)."""
+    from .models import ConsultaIA
+    return list(
+        ConsultaIA.objects.filter(paciente_id=usuario_id).order_by('-fecha', '-id').values(*CAMPOS_INFORME)
+    )
+
+
+def render_pdf(patient_id, paciente, consultas) -> bytes:
+    """Informe clínico en PDF. 'paciente' y 'consultas' son dicts de values() (consultas de la más reciente)."""
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter)
+    elements = []
+
+    nombre_completo = f"{paciente['first_name']} {paciente['last_name']}"
+
+    # --- ENCABEZADO PROFESIONAL ---
+    elements.append(Paragraph("🏥 OMNICARE AI - INFORME CLÍNICO DIGITAL", TITLE_STYLE))
+    elements.append(Paragraph(f"<b>Paciente:</b> {nombre_completo}", STYLES['Normal']))
+    elements.append(Paragraph(f"<b>credential/ID:</b> {patient_id} | <b>Email:</b> {paciente['email']}", HEADER_STYLE))
+    elements.append(Paragraph(f"<b>Fecha de Generación:</b> {datetime.now().strftime('%d/%m/%Y %H:%M')}", HEADER_STYLE))
+    elements.append(Spacer(1, 20))
+
+    # --- TABLA DE CONSULTAS ---
+    data = [["FECHA", "MÉTRICAS TRIAJE", "RESUMEN DE CONSULTA"]]
+
+    for c in consultas:
+        # Formateamos las métricas de forma más visual
+        metrics = f"Dolor: {c['dolor']}/10\nUrgencia: {c['urgencia']}\nRiesgo: {c['riesgo']}"
+        # Resumen limpio del mensaje
+        mensaje = c['mensaje_usuario']
+        msg_summary = (mensaje[:150] + '...') if len(mensaje) > 150 else mensaje
+
+        data.append([
+            c['fecha'].strftime('%d/%m/%Y\n%H:%M'),
+            metrics,
+            Paragraph(msg_summary, BODY_STYLE)
+        ])
+
+    # Ajuste de anchos: Fecha(80), Métricas(140), Resumen(300)
+    t = Table(data, colWidths=[80, 140, 300])
+    t.setStyle(TABLE_STYLE)
+    elements.append(t)
+
+    # --- PIE DE PÁGINA / NOTA LEGAL ---
+    elements.append(Spacer(1, 30))
+    elements.append(Paragraph(NOTA_LEGAL, HEADER_STYLE))
+
+    doc.build(elements)
+    return buffer.getvalue()
+
+
+# --- CACHÉ EN DISCO ---
+
+def report_key(patient_id, paciente, total, ultimo_id, actualizado) -> str:
+    """
+    Versión del informe: cambia con una consulta nueva (último id), con cualquier edición
+    (último 'actualizado'), con bajas (total) y con los datos de cabecera del paciente.
+    Se usa como ETag.
+    """
+    raw = "\x1f".join(str(v) for v in (
+        REPORT_VERSION, patient_id, paciente['first_name'], paciente['last_name'], paciente['email'],
+        total, ultimo_id, actualizado.isoformat() if actualizado else '',
+    ))
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+class PdfCache:
+    """
+    Un PDF por paciente en disco (el de la versión vigente); las versiones anteriores se borran.
+    Junto a cada versión, marcas de trabajo en curso (.pending) y fallido (.failed) visibles
+    para todos los workers que comparten el directorio.
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+
+    def _prefix(self, patient_id) -> str:
+        # El DNI no se usa tal cual en el nombre del fichero
+        return hashlib.sha1(str(patient_id).encode('utf-8')).hexdigest()[:16]
+
+    def path(self, patient_id, key, suffix='.pdf') -> Path:
+        return self.directory / f"{self._prefix(patient_id)}-{key}{suffix}"
+
+    def get(self, patient_id, key):
+        path = self.path(patient_id, key)
+        return path if path.exists() else None
+
+    def set(self, patient_id, key, content: bytes) -> Path:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.path(patient_id, key)
+        # Escritura atómica: nunca se sirve un PDF a medio escribir
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(content)
+        os.replace(tmp, path)
+        for suffix in ('.pdf', '.failed'):
+            for old in self.directory.glob(f"{self._prefix(patient_id)}-*{suffix}"):
+                if old != path:
+                    old.unlink(missing_ok=True)
+        return path
+
+
+# --- GENERACIÓN EN SEGUNDO PLANO ---
+
+class PdfJobs:
+    """
+    Informes grandes generados fuera de la petición. Un trabajo por versión de informe
+    (clave), reclamado con una marca .pending creada en exclusiva en el directorio de la
+    caché: las peticiones repetidas, atienda el worker que atienda, no lanzan otro. Al
+    terminar bien se sirve el PDF de la caché; si falla, una marca .failed guarda el error
+    hasta que un sondeo lo recoge. Una marca .pending más antigua que `timeout` (worker
+    caído a mitad) se da por abandonada.
+    """
+
+    def __init__(self, cache: PdfCache, max_workers: int = 2, timeout: float = 600):
+        self.cache = cache
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='pdf-job')
+
+    def _claim(self, marker: Path) -> bool:
+        try:
+            os.close(os.open(marker, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            return False
+
+    def pending(self, patient_id, key) -> bool:
+        marker = self.cache.path(patient_id, key, '.pending')
+        try:
+            return time.time() - marker.stat().st_mtime < self.timeout
+        except FileNotFoundError:
+            return False
+
+    def submit(self, patient_id, key, paciente) -> bool:
+        """Lanza el trabajo si nadie lo tiene ya; solo se pasa la cabecera, las filas las lee el trabajo."""
+        self.cache.directory.mkdir(parents=True, exist_ok=True)
+        marker = self.cache.path(patient_id, key, '.pending')
+        if not self._claim(marker):
+            if self.pending(patient_id, key):
+                return False
+            marker.unlink(missing_ok=True)  # Abandonada: se vuelve a reclamar
+            if not self._claim(marker):
+                return False
+        self._executor.submit(self._run, patient_id, key, paciente)
+        return True
+
+    def pop_failed(self, patient_id, key):
+        """Error del trabajo terminado en fallo (y lo olvida para poder reintentar), o None."""
+        marker = self.cache.path(patient_id, key, '.failed')
+        try:
+            error = marker.read_text(encoding='utf-8')
+        except FileNotFoundError:
+            return None
+        marker.unlink(missing_ok=True)
+        return error
+
+    def _run(self, patient_id, key, paciente):
+        try:
+            consultas = consultas_informe(paciente['id'])
+            self.cache.set(patient_id, key, render_pdf(patient_id, paciente, consultas))
+        except Exception as e:
+            self.cache.path(patient_id, key, '.failed').write_text(str(e) or type(e).__name__, encoding='utf-8')
+        finally:
+            self.cache.path(patient_id, key, '.pending').unlink(missing_ok=True)
+            # Conexiones de este hilo del pool: no quedan abiertas entre trabajos
+            connections.close_all()
+
+
+pdf_cache = PdfCache(getattr(settings, 'PDF_CACHE_DIR', settings.BASE_DIR / 'pdf_cache'))
+pdf_jobs = PdfJobs(pdf_cache, max_workers=getattr(settings, 'PDF_JOB_WORKERS', 2),
+                   timeout=getattr(settings, 'PDF_JOB_TIMEOUT', 600))
@@ -7,6 +7,25 @@ class PatientSerializer(serializers.ModelSerializer):
         model = Patient
         fields = ['patient_id', 'name', 'clinical_history']
 
+# Columnas que puede pedir ?fields= en /api/manage-patients/; por defecto sin el historial clínico
+PATIENT_LIST_FIELDS = ('id', 'patient_id', 'name', 'clinical_history', 'created_at')
+PATIENT_LIST_DEFAULT_FIELDS = ('id', 'patient_id', 'name', 'created_at')
+
+class PatientListParamsSerializer(serializers.Serializer):
+    """Proyección (?fields=id,name) y búsqueda por prefijo de nombre o DNI (?q=) del listado."""
+    fields = serializers.CharField(required=False)
+    q = serializers.CharField(required=False, max_length=100)
+
+    def validate_fields(self, value):
+        campos = tuple(dict.fromkeys(c.strip() for c in value.split(',') if c.strip()))
+        no_permitidos = sorted(set(campos) - set(PATIENT_LIST_FIELDS))
+        if not campos or no_permitidos:
+            raise serializers.ValidationError(
+                f"Campos no permitidos: {', '.join(no_permitidos) or '(vacío)'}. "
+                f"Disponibles: {', '.join(PATIENT_LIST_FIELDS)}"
+            )
+        return campos
+
 # --- NUEVO SERIALIZADOR PARA AUDITORÍA ---
 class AiAuditLogSerializer(serializers.ModelSerializer):
     """
@@ -27,4 +46,37 @@ class AiAuditLogSerializer(serializers.ModelSerializer):
             'urgencia', 
             'riesgo', 
             'dolor'
-        ]
\ No newline at end of file
+        ]
+
+class AuditLogFilterSerializer(serializers.Serializer):
+    """
+    Filtros de /api/audit-logs/: DNI del paciente, rango de fechas [desde, hasta)
+    en ISO 8601 (fecha o fecha y hora) y umbrales mínimos de riesgo y urgencia.
+    """
+    paciente = serializers.CharField(required=False)
+    desde = serializers.DateTimeField(required=False, input_formats=['iso-8601', '%Y-%m-%d'])
+    hasta = serializers.DateTimeField(required=False, input_formats=['iso-8601', '%Y-%m-%d'])
+    riesgo_min = serializers.IntegerField(required=False, min_value=0)
+    urgencia_min = serializers.IntegerField(required=False, min_value=0)
+
+class HistorialParamsSerializer(serializers.Serializer):
+    """Parámetros del historial: consultas posteriores a 'since' (ISO 8601) y como mucho 'limit'."""
+    since = serializers.DateTimeField(required=False, input_formats=['iso-8601', '%Y-%m-%d'])
+    limit = serializers.IntegerField(required=False, min_value=1)
+
+class PatientContextParamsSerializer(serializers.Serializer):
+    """Parámetros del contexto para el motor de IA: número de consultas recientes (?consultas=N)."""
+    consultas = serializers.IntegerField(required=False, min_value=0)
+
+# --- INGESTA MASIVA DE AUDITORÍA ---
+class ConsultaIABulkItemSerializer(serializers.Serializer):
+    """
+    Valida un registro de la ingesta masiva. 'patient_id' es el DNI (username)
+    del paciente; si se omite, la consulta se asigna al usuario autenticado.
+    """
+    patient_id = serializers.CharField(required=False)
+    mensaje_usuario = serializers.CharField()
+    respuesta_ia = serializers.CharField(allow_blank=True)
+    dolor = serializers.IntegerField(required=False, default=0)
+    urgencia = serializers.IntegerField(required=False, default=0)
+    riesgo = serializers.IntegerField(required=False, default=0)
@@ -0,0 +1,101 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connections, transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Patient, ConsultaIA
+
+logger = logging.getLogger(__name__)
+
+
+# Un único hilo: los avisos salen en orden y el guardado no espera al motor de IA
+avisos_cache = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ai-cache-invalidation')
+
+
+def _enviar_invalidacion(url, patient_id):
+    try:
+        httpx.delete(f"{url}/cache/patients/{patient_id}", timeout=settings.AI_ENGINE_TIMEOUT)
+    except Exception as e:
+        logger.warning("No se pudo invalidar la caché del paciente %s: %s", patient_id, e)
+
+
+def invalidar_cache_paciente(patient_id):
+    """
+    Avisa al motor de IA de que la ficha del paciente ha cambiado para que
+    descarte su copia en caché. El aviso se envía en segundo plano y un fallo
+    nunca rompe el guardado: en el peor caso la entrada caduca por TTL.
+    """
+    url = getattr(settings, 'AI_ENGINE_URL', None)
+    if not url:
+        return None
+    return avisos_cache.submit(_enviar_invalidacion, url, patient_id)
+
+
+# Pacientes (id de User) pendientes de aviso cuyo DNI se resuelve en el hilo de avisos
+_ids_pendientes = set()
+_ids_lock = threading.Lock()
+
+
+def _enviar_invalidacion_por_id(url):
+    with _ids_lock:
+        ids = set(_ids_pendientes)
+        _ids_pendientes.clear()
+    try:
+        # Una consulta por lote de avisos acumulados, fuera del hilo de la petición
+        for dni in User.objects.filter(pk__in=ids).values_list('username', flat=True):
+            _enviar_invalidacion(url, dni)
+    except Exception as e:
+        logger.warning("No se pudo resolver los pacientes %s para invalidar su caché: %s", sorted(ids), e)
+    finally:
+        connections.close_all()
+
+
+def invalidar_cache_paciente_id(paciente_id):
+    """Como invalidar_cache_paciente, pero a partir del id del User del paciente."""
+    url = getattr(settings, 'AI_ENGINE_URL', None)
+    if not url:
+        return None
+    with _ids_lock:
+        lote_nuevo = not _ids_pendientes
+        _ids_pendientes.add(paciente_id)
+    # Si ya hay un lote esperando, el id viaja en él
+    return avisos_cache.submit(_enviar_invalidacion_por_id, url) if lote_nuevo else None
+
+
+@receiver(post_save, sender=Patient)
+@receiver(post_delete, sender=Patient)
+def patient_changed(sender, instance, **kwargs):
+    # Si se ha cambiado el DNI, la caché del motor de IA guarda la ficha bajo el anterior
+    patient_ids = [instance.patient_id]
+    anterior = getattr(instance, '_patient_id_cargado', None)
+    if anterior and anterior != instance.patient_id:
+        patient_ids.append(anterior)
+    instance._patient_id_cargado = instance.patient_id
+
+    def avisar():
+        for patient_id in patient_ids:
+            invalidar_cache_paciente(patient_id)
+
+    # Solo notificamos cuando el cambio está confirmado en la base de datos
+    transaction.on_commit(avisar)
+
+
+@receiver(post_save, sender=ConsultaIA)
+def consulta_created(sender, instance, created, **kwargs):
+    # El contexto del paciente en el motor de IA incluye sus últimas consultas.
+    # Sin consultas extra: el DNI del User ya cargado o, si solo hay paciente_id,
+    # resuelto en el hilo de avisos
+    if not created:
+        return
+    if ConsultaIA.paciente.is_cached(instance):
+        dni = instance.paciente.username
+        transaction.on_commit(lambda: invalidar_cache_paciente(dni))
+    else:
+        paciente_id = instance.paciente_id
+        transaction.on_commit(lambda: invalidar_cache_paciente_id(paciente_id))
@@ -1,3 +1,436 @@
-from django.test import TestCase
+import json
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest.mock import patch
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from .models import Patient, ConsultaIA
+from .reports import pdf_cache, pdf_jobs
+from .signals import avisos_cache
+
+
+@override_settings(AI_ENGINE_URL='http://ai-engine')
+class PatientCacheInvalidationTests(TestCase):
+    def setUp(self):
+        self.medico = User.objects.create_user(username='MED-1', password='x', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.medico)
+
+    def test_manage_patients_post_invalida_cache(self):
+        with patch('medical_records.signals.httpx.delete') as mock_delete:
+            with self.captureOnCommitCallbacks(execute=True):
+                r = self.client.post('/api/manage-patients/', {
+                    'patient_id': 'PAC-1', 'name': 'Ana', 'clinical_history': 'Asma'
+                }, format='json')
+            # El aviso sale en segundo plano: la respuesta no lo espera
+            avisos_cache.submit(lambda: None).result()
+        self.assertEqual(r.status_code, 201)
+        mock_delete.assert_called_once()
+        self.assertEqual(mock_delete.call_args.args[0], 'http://ai-engine/cache/patients/PAC-1')
+
+    def test_patient_viewset_update_invalida_cache(self):
+        Patient.objects.create(doctor=self.medico, patient_id='PAC-2', name='Luis', clinical_history='')
+        with patch('medical_records.signals.httpx.delete') as mock_delete:
+            with self.captureOnCommitCallbacks(execute=True):
+                r = self.client.patch('/api/patients/PAC-2/', {'clinical_history': 'HTA'}, format='json')
+            avisos_cache.submit(lambda: None).result()
+        self.assertEqual(r.status_code, 200)
+        mock_delete.assert_called_once()
+
+    def test_cambio_de_dni_invalida_el_anterior(self):
+        Patient.objects.create(doctor=self.medico, patient_id='PAC-3', name='Eva', clinical_history='')
+        paciente = Patient.objects.get(patient_id='PAC-3')
+        with patch('medical_records.signals.httpx.delete') as mock_delete:
+            with self.captureOnCommitCallbacks(execute=True):
+                paciente.patient_id = 'PAC-4'
+                paciente.save()
+            avisos_cache.submit(lambda: None).result()
+        urls = [c.args[0] for c in mock_delete.call_args_list]
+        self.assertEqual(urls, ['http://ai-engine/cache/patients/PAC-4', 'http://ai-engine/cache/patients/PAC-3'])
+
+
+
+# Transaccional: el hilo de avisos resuelve el DNI con su propia conexión
+@override_settings(AI_ENGINE_URL='http://ai-engine')
+class ConsultaCacheInvalidationTests(TransactionTestCase):
+    def test_alta_de_consulta_sin_consultas_extra(self):
+        paciente = User.objects.create_user(username='PAC-1', password='x')
+        with patch('medical_records.signals.httpx.delete') as mock_delete:
+            # Con el User cargado, solo el INSERT
+            with self.assertNumQueries(1):
+                ConsultaIA.objects.create(paciente=paciente, mensaje_usuario='a', respuesta_ia='b')
+            # Solo con paciente_id: el DNI se resuelve fuera de la petición, una vez por lote
+            with self.assertNumQueries(2):
+                ConsultaIA.objects.create(paciente_id=paciente.id, mensaje_usuario='c', respuesta_ia='d')
+                ConsultaIA.objects.create(paciente_id=paciente.id, mensaje_usuario='e', respuesta_ia='f')
+            avisos_cache.submit(lambda: None).result()
+        urls = [c.args[0] for c in mock_delete.call_args_list]
+        # Una o dos para las de paciente_id, según si el segundo aviso alcanzó el lote del primero
+        self.assertIn(len(urls), (2, 3))
+        self.assertEqual(set(urls), {'http://ai-engine/cache/patients/PAC-1'})
+
+
+@override_settings(AI_ENGINE_URL='')
+class AuditBulkIngestTests(TestCase):
+    def setUp(self):
+        self.servicio = User.objects.create_user(username='SVC', password='x', is_staff=True)
+        self.paciente = User.objects.create_user(username='12345678X', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.servicio)
+
+    def test_bulk_json_con_errores_por_elemento(self):
+        payload = [
+            {'patient_id': '12345678X', 'mensaje_usuario': 'Dolor de cabeza', 'respuesta_ia': 'Reposo', 'urgencia': 3},
+            {'patient_id': 'NO-EXISTE', 'mensaje_usuario': 'Fiebre', 'respuesta_ia': 'Paracetamol'},
+            {'patient_id': '12345678X', 'respuesta_ia': 'Sin mensaje'},
+        ]
+        # Una consulta para resolver pacientes y un único INSERT (más savepoint/release)
+        with self.assertNumQueries(4):
+            r = self.client.post('/api/audit-logs/bulk/', payload, format='json')
+        self.assertEqual(r.status_code, 207)
+        self.assertEqual(r.data['created'], 1)
+        self.assertIn('id', r.data['results'][0])
+        self.assertIn('patient_id', r.data['results'][1]['errors'])
+        self.assertIn('mensaje_usuario', r.data['results'][2]['errors'])
+        self.assertEqual(ConsultaIA.objects.get().paciente, self.paciente)
+
+    def test_bulk_ndjson(self):
+        body = (
+            '{"patient_id": "12345678X", "mensaje_usuario": "a", "respuesta_ia": "b"}\n'
+            '{"mensaje_usuario": "c", "respuesta_ia": "d"}\n'
+        )
+        r = self.client.post('/api/audit-logs/bulk/', body, content_type='application/x-ndjson')
+        self.assertEqual(r.status_code, 201)
+        self.assertEqual(ConsultaIA.objects.filter(paciente=self.servicio).count(), 1)
+        self.assertEqual(ConsultaIA.objects.count(), 2)
+
+    def test_bulk_prohibido_a_pacientes(self):
+        self.client.force_authenticate(self.paciente)
+        payload = [{'patient_id': 'OTRO', 'mensaje_usuario': 'a', 'respuesta_ia': 'b'}]
+        r = self.client.post('/api/audit-logs/bulk/', payload, format='json')
+        self.assertEqual(r.status_code, 403)
+        self.assertFalse(ConsultaIA.objects.exists())
+
+
+@override_settings(AI_ENGINE_URL='')
+class PatientContextTests(TestCase):
+    def setUp(self):
+        self.medico = User.objects.create_user(username='MED-1', password='x', is_staff=True)
+        paciente = User.objects.create_user(username='PAC-1', password='x')
+        Patient.objects.create(doctor=self.medico, patient_id='PAC-1', name='Ana', clinical_history='Asma')
+        for i in range(8):
+            ConsultaIA.objects.create(paciente=paciente, mensaje_usuario=f'consulta {i}', respuesta_ia='ok',
+                                      dolor=i, urgencia=i, riesgo=1)
+        self.client = APIClient()
+        self.client.force_authenticate(self.medico)
+
+    def test_contexto_en_una_respuesta_con_consultas_fijas(self):
+        # Ficha (con el id del paciente), últimas consultas y agregados: tres consultas SQL
+        with self.assertNumQueries(3), CaptureQueriesContext(connection) as ctx:
+            r = self.client.get('/api/patient-context/PAC-1/?consultas=3')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.data['clinical_history'], 'Asma')
+        self.assertEqual([c['mensaje_usuario'] for c in r.data['consultas']], ['consulta 7', 'consulta 6', 'consulta 5'])
+        self.assertEqual(r.data['metricas']['total'], 8)
+        self.assertEqual(r.data['metricas']['urgencia_max'], 7)
+        self.assertEqual(r.data['metricas']['dolor_medio'], 3.5)
+
+        if connection.vendor == 'sqlite':
+            # Consultas recientes y métricas por paciente_id: índice por paciente, sin JOIN a auth_user
+            planes = planes_consultaia(ctx.captured_queries)
+            self.assertEqual(len(planes), 2)
+            for plan in planes:
+                self.assertRegex(plan, r'consulta_paciente_(fecha|act)_idx \(paciente_id=\?\)')
+                self.assertNotIn('auth_user', plan)
+                self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_parametro_consultas_invalido(self):
+        for valor in ('abc', '-1'):
+            r = self.client.get('/api/patient-context/PAC-1/', {'consultas': valor})
+            self.assertEqual(r.status_code, 400)
+            self.assertIn('consultas', r.data)
+
+    def test_paciente_inexistente_y_no_medico(self):
+        self.assertEqual(self.client.get('/api/patient-context/NO-EXISTE/').status_code, 404)
+        self.client.force_authenticate(User.objects.get(username='PAC-1'))
+        self.assertEqual(self.client.get('/api/patient-context/PAC-1/').status_code, 403)
+
+
+
+@override_settings(AI_ENGINE_URL='')
+class AuditLogPaginationTests(TestCase):
+    def setUp(self):
+        self.medico = User.objects.create_user(username='MED-1', password='x', is_staff=True)
+        pacientes = [User.objects.create_user(username=f'PAC-{i}', password='x') for i in range(2)]
+        for i in range(7):
+            ConsultaIA.objects.create(paciente=pacientes[i % 2], mensaje_usuario=f'consulta {i}',
+                                      respuesta_ia='ok', riesgo=i, urgencia=i)
+        self.client = APIClient()
+        self.client.force_authenticate(self.medico)
+
+    def test_recorre_por_cursor_sin_repetir_con_consulta_fija(self):
+        vistos, url = [], '/api/audit-logs/?page_size=3'
+        while url:
+            # Una consulta por página: sin COUNT(*) y con el paciente en el mismo JOIN
+            with self.assertNumQueries(1):
+                r = self.client.get(url)
+            self.assertEqual(r.status_code, 200)
+            vistos += [c['mensaje_usuario'] for c in r.data['results']]
+            url = r.data['next']
+        self.assertEqual(vistos, [f'consulta {i}' for i in range(6, -1, -1)])
+
+    def test_filtros_por_paciente_umbrales_y_fechas(self):
+        r = self.client.get('/api/audit-logs/', {'paciente': 'PAC-0', 'riesgo_min': 3, 'urgencia_min': 4})
+        self.assertEqual([c['mensaje_usuario'] for c in r.data['results']], ['consulta 6', 'consulta 4'])
+        r = self.client.get('/api/audit-logs/', {'hasta': '2000-01-01'})
+        self.assertEqual(r.data['results'], [])
+        r = self.client.get('/api/audit-logs/', {'riesgo_min': 'alto', 'desde': 'ayer'})
+        self.assertEqual(r.status_code, 400)
+        self.assertEqual(set(r.data), {'riesgo_min', 'desde'})
+
+
+
+def planes_consultaia(queries):
+    """EXPLAIN QUERY PLAN (SQLite) de las consultas capturadas que leen ConsultaIA."""
+    planes = []
+    with connection.cursor() as cur:
+        for q in queries:
+            if q['sql'].startswith('SELECT') and ConsultaIA._meta.db_table in q['sql']:
+                cur.execute('EXPLAIN QUERY PLAN ' + q['sql'])
+                planes.append(' | '.join(fila[-1] for fila in cur.fetchall()))
+    return planes
+
+
+def usar_cache_temporal(test):
+    """Los PDF cacheados van a un directorio temporal durante el test."""
+    tmp = tempfile.TemporaryDirectory()
+    test.addCleanup(tmp.cleanup)
+    parche = patch.object(pdf_cache, 'directory', Path(tmp.name))
+    parche.start()
+    test.addCleanup(parche.stop)
+    return Path(tmp.name)
+
+
+@override_settings(AI_ENGINE_URL='')
+class HistorialQueryPlanTests(TestCase):
+    def setUp(self):
+        self.medico = User.objects.create_user(username='MED-1', password='x', is_staff=True)
+        self.paciente = User.objects.create_user(username='PAC-1', password='x', first_name='Ana')
+        for i in range(3):
+            ConsultaIA.objects.create(paciente=self.paciente, mensaje_usuario=f'consulta {i}', respuesta_ia='ok')
+        self.client = APIClient()
+        self.client.force_authenticate(self.medico)
+        usar_cache_temporal(self)
+
+    def test_historial_y_pdf_usan_el_indice_por_paciente_sin_join(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('EXPLAIN QUERY PLAN es de SQLite')
+        # DNI -> id una vez y lecturas de consultas (el PDF: versión del informe y filas)
+        for url, n_queries in (('/api/historial-paciente/PAC-1/', 2), ('/api/export-pdf/PAC-1/', 3)):
+            with CaptureQueriesContext(connection) as ctx:
+                r = self.client.get(url)
+            self.assertEqual(r.status_code, 200)
+            self.assertEqual(len(ctx.captured_queries), n_queries)
+            for plan in planes_consultaia(ctx.captured_queries):
+                # Filas por (paciente, -fecha, -id); la versión del PDF, solo del índice (paciente, actualizado)
+                self.assertRegex(plan, r'USING (COVERING INDEX consulta_paciente_act_idx|(COVERING )?INDEX '
+                                       r'consulta_paciente_fecha_idx) \(paciente_id=\?\)')
+                self.assertNotIn('auth_user', plan)
+                self.assertNotIn('TEMP B-TREE', plan)  # Orden servido por el índice
+
+        r = self.client.get('/api/historial-paciente/PAC-1/')
+        self.assertEqual([c['mensaje_usuario'] for c in r.data], ['consulta 2', 'consulta 1', 'consulta 0'])
+        self.assertEqual(self.client.get('/api/historial-paciente/NO-EXISTE/').data, [])
+        self.assertEqual(self.client.get('/api/export-pdf/NO-EXISTE/').status_code, 404)
+
+    def test_historial_ndjson_en_streaming_con_since_y_limit(self):
+        primera = ConsultaIA.objects.order_by('fecha').first()
+        r = self.client.get('/api/historial-paciente/PAC-1/', {'format': 'ndjson'})
+        self.assertTrue(r.streaming)
+        self.assertEqual(r['Content-Type'], 'application/x-ndjson')
+        lineas = [json.loads(l) for l in b''.join(r.streaming_content).decode().splitlines()]
+        self.assertEqual([c['mensaje_usuario'] for c in lineas], ['consulta 2', 'consulta 1', 'consulta 0'])
+        self.assertEqual(set(lineas[0]), {'mensaje_usuario', 'respuesta_ia', 'dolor', 'urgencia', 'riesgo', 'fecha'})
+
+        since = (primera.fecha + timedelta(microseconds=1)).isoformat()
+        r = self.client.get('/api/historial-paciente/PAC-1/', {'format': 'ndjson', 'since': since, 'limit': 1})
+        self.assertEqual([json.loads(l)['mensaje_usuario'] for l in b''.join(r.streaming_content).splitlines()],
+                         ['consulta 2'])
+        r = self.client.get('/api/historial-paciente/PAC-1/', {'since': since})
+        self.assertEqual(len(r.data), 2)
+        self.assertEqual(self.client.get('/api/historial-paciente/PAC-1/', {'limit': 0}).status_code, 400)
+
+
+
+@override_settings(AI_ENGINE_URL='')
+class ManagePatientsListTests(TestCase):
+    def setUp(self):
+        self.medico = User.objects.create_user(username='MED-1', password='x', is_staff=True)
+        otro = User.objects.create_user(username='MED-2', password='x', is_staff=True)
+        for i, nombre in enumerate(['ana García', 'Andrés Pol', 'Berta Ruiz', 'Carlos Sanz']):
+            Patient.objects.create(doctor=self.medico, patient_id=f'PAC-{i}', name=nombre, clinical_history='x' * 5000)
+        Patient.objects.create(doctor=otro, patient_id='PAC-9', name='Ana Otra', clinical_history='')
+        self.client = APIClient()
+        self.client.force_authenticate(self.medico)
+
+    def test_lista_paginada_sin_historial_por_defecto(self):
+        r = self.client.get('/api/manage-patients/', {'page_size': 3})
+        self.assertEqual(r.data['count'], 4)
+        self.assertEqual([p['name'] for p in r.data['results']], ['ana García', 'Andrés Pol', 'Berta Ruiz'])
+        self.assertEqual(set(r.data['results'][0]), {'id', 'patient_id', 'name', 'created_at'})
+        self.assertEqual(len(self.client.get(r.data['next']).data['results']), 1)
+
+        r = self.client.get('/api/manage-patients/', {'fields': 'patient_id,clinical_history'})
+        self.assertEqual(set(r.data['results'][0]), {'patient_id', 'clinical_history'})
+        r = self.client.get('/api/manage-patients/', {'fields': 'name,doctor__password'})
+        self.assertEqual(r.status_code, 400)
+
+    def test_busqueda_por_prefijo_de_nombre_o_dni_con_indice(self):
+        r = self.client.get('/api/manage-patients/', {'q': 'an'})
+        self.assertEqual([p['patient_id'] for p in r.data['results']], ['PAC-0', 'PAC-1'])
+        r = self.client.get('/api/manage-patients/', {'q': 'pac-3'})
+        self.assertEqual([p['name'] for p in r.data['results']], ['Carlos Sanz'])
+
+        if connection.vendor == 'sqlite':
+            with CaptureQueriesContext(connection) as ctx:
+                self.client.get('/api/manage-patients/', {'q': 'an'})
+            select = next(q['sql'] for q in ctx.captured_queries if 'ORDER BY' in q['sql'])
+            with connection.cursor() as cur:
+                cur.execute('EXPLAIN QUERY PLAN ' + select)
+                plan = ' | '.join(fila[-1] for fila in cur.fetchall())
+            self.assertIn('USING INDEX patient_doctor_nombre_idx', plan)
+            self.assertNotIn('SCAN medical_records_patient', plan)
+
+    def test_busqueda_y_orden_con_tildes_y_dni_en_minusculas(self):
+        for dni, nombre in (('pac-7', 'Muñoz Pérez'), ('PAC-8', 'Álvaro Núñez'), ('PAC-10', 'Zoe Ortiz')):
+            Patient.objects.create(doctor=self.medico, patient_id=dni, name=nombre, clinical_history='')
+        for q in ('muñoz', 'Muñoz', 'MUÑOZ', 'munoz', 'pac-7', 'PAC-7'):
+            r = self.client.get('/api/manage-patients/', {'q': q})
+            self.assertEqual([p['name'] for p in r.data['results']], ['Muñoz Pérez'], q)
+        r = self.client.get('/api/manage-patients/', {'q': 'ál', 'fields': 'name'})
+        self.assertEqual([p['name'] for p in r.data['results']], ['Álvaro Núñez'])
+
+        # 'Álvaro' se ordena con la A, no detrás de la Z como con UPPER() de SQLite
+        r = self.client.get('/api/manage-patients/', {'fields': 'name'})
+        self.assertEqual([p['name'] for p in r.data['results']],
+                         ['Álvaro Núñez', 'ana García', 'Andrés Pol', 'Berta Ruiz', 'Carlos Sanz',
+                          'Muñoz Pérez', 'Zoe Ortiz'])
+
+
+
+@override_settings(AI_ENGINE_URL='')
+class PdfExportTests(TestCase):
+    def setUp(self):
+        self.medico = User.objects.create_user(username='MED-1', password='x', is_staff=True)
+        self.paciente = User.objects.create_user(username='PAC-1', password='x', first_name='Ana')
+        for i in range(3):
+            ConsultaIA.objects.create(paciente=self.paciente, mensaje_usuario=f'consulta {i}', respuesta_ia='ok')
+        self.client = APIClient()
+        self.client.force_authenticate(self.medico)
+        self.cache_dir = usar_cache_temporal(self)
+
+    def test_cache_en_disco_etag_y_nueva_version(self):
+        r = self.client.get('/api/export-pdf/PAC-1/')
+        self.assertEqual(r.status_code, 200)
+        self.assertTrue(r.content.startswith(b'%PDF'))
+        etag = r['ETag']
+
+        # Segunda descarga desde disco, sin generar; con el ETag vigente, 304 sin cuerpo
+        with patch('medical_records.views.render_pdf') as render:
+            r = self.client.get('/api/export-pdf/PAC-1/')
+            self.assertEqual(b''.join(r.streaming_content)[:4], b'%PDF')
+            render.assert_not_called()
+        self.assertEqual(r['ETag'], etag)
+        r = self.client.get('/api/export-pdf/PAC-1/', HTTP_IF_NONE_MATCH=f'W/{etag}')
+        self.assertEqual(r.status_code, 304)
+
+        # Una consulta nueva cambia la versión: se regenera y la anterior se borra del disco
+        ConsultaIA.objects.create(paciente=self.paciente, mensaje_usuario='consulta 3', respuesta_ia='ok')
+        r = self.client.get('/api/export-pdf/PAC-1/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r.status_code, 200)
+        self.assertNotEqual(r['ETag'], etag)
+        self.assertEqual(len(list(self.cache_dir.glob('*.pdf'))), 1)
+
+    def test_recalcular_triaje_cambia_la_version(self):
+        etag = self.client.get('/api/export-pdf/PAC-1/')['ETag']
+        ConsultaIA.objects.filter(mensaje_usuario='consulta 0').update(respuesta_ia='Cuadro grave')
+        call_command('recalcular_triaje', stdout=StringIO())
+        r = self.client.get('/api/export-pdf/PAC-1/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r.status_code, 200)
+        self.assertNotEqual(r['ETag'], etag)
+
+
+# Transaccional: el trabajo en segundo plano lee las consultas desde su propio hilo y conexión
+@override_settings(AI_ENGINE_URL='')
+class PdfExportAsyncTests(TransactionTestCase):
+    def setUp(self):
+        self.medico = User.objects.create_user(username='MED-1', password='x', is_staff=True)
+        self.paciente = User.objects.create_user(username='PAC-1', password='x', first_name='Ana')
+        for i in range(3):
+            ConsultaIA.objects.create(paciente=self.paciente, mensaje_usuario=f'consulta {i}', respuesta_ia='ok')
+        self.client = APIClient()
+        self.client.force_authenticate(self.medico)
+        self.cache_dir = usar_cache_temporal(self)
+
+    def test_modo_asincrono_202_y_sondeo(self):
+        with CaptureQueriesContext(connection) as ctx:
+            r = self.client.get('/api/export-pdf/PAC-1/', {'modo': 'async'})
+        self.assertEqual(r.status_code, 202)
+        self.assertEqual(r['Location'], 'http://testserver/api/export-pdf/PAC-1/')
+        self.assertEqual(len(ctx.captured_queries), 2)  # Paciente y versión: las filas las lee el trabajo
+        for _ in range(100):
+            r = self.client.get(r.data['poll'] if r.status_code == 202 else '/api/export-pdf/PAC-1/')
+            if r.status_code != 202:
+                break
+            time.sleep(0.05)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(b''.join(r.streaming_content)[:4], b'%PDF')
+        self.assertEqual([p.suffix for p in self.cache_dir.iterdir()], ['.pdf'])
+
+    def test_marcas_compartidas_entre_workers(self):
+        # Otro worker ya está generando esta versión: se sondea sin lanzar un segundo trabajo
+        with patch.object(pdf_jobs._executor, 'submit') as submit:
+            self.assertEqual(self.client.get('/api/export-pdf/PAC-1/', {'modo': 'async'}).status_code, 202)
+            self.assertEqual(self.client.get('/api/export-pdf/PAC-1/', {'modo': 'async'}).status_code, 202)
+            submit.assert_called_once()
+        [marca] = self.cache_dir.glob('*.pending')
+
+        # Un fallo en otro worker se ve aquí una vez; después se puede reintentar
+        marca.rename(marca.with_suffix('.failed'))
+        marca.with_suffix('.failed').write_text('sin memoria')
+        r = self.client.get('/api/export-pdf/PAC-1/')
+        self.assertEqual(r.status_code, 500)
+        self.assertIn('sin memoria', r.data['error'])
+        self.assertEqual(self.client.get('/api/export-pdf/PAC-1/').status_code, 200)
+
+
+class RecalcularTriajeTests(TestCase):
+    def test_recalcula_por_lotes_solo_las_que_cambian(self):
+        paciente = User.objects.create_user(username='PAC-1', password='x')
+        respuestas = ['Dolor intenso, acuda de forma urgente', 'Cuadro leve', 'Situación grave'] * 3
+        for texto in respuestas:
+            ConsultaIA.objects.create(paciente=paciente, mensaje_usuario='m', respuesta_ia=texto,
+                                      dolor=0, urgencia=0, riesgo=0)
+        ConsultaIA.objects.filter(respuesta_ia='Cuadro leve').update(dolor=4, urgencia=3, riesgo=2)
+
+        salida = StringIO()
+        call_command('recalcular_triaje', '--dry-run', chunk_size=4, stdout=salida)
+        self.assertIn('6 se actualizarían', salida.getvalue())
+        self.assertFalse(ConsultaIA.objects.filter(dolor=8).exists())
+
+        call_command('recalcular_triaje', chunk_size=4, stdout=StringIO())
+        metricas = set(ConsultaIA.objects.values_list('respuesta_ia', 'dolor', 'urgencia', 'riesgo'))
+        self.assertEqual(metricas, {
+            ('Dolor intenso, acuda de forma urgente', 8, 9, 2),
+            ('Cuadro leve', 4, 3, 2),
+            ('Situación grave', 4, 3, 7),
+        })
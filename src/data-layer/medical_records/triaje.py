@@ -0,0 +1,43 @@
+# Reglas de métricas de triaje por palabras clave, las mismas que ai_engine/triage.py
+# (METRIC_RULES y TriageScorer). Copia propia: la capa de datos no importa código del
+# motor de IA, que vive en otro servicio. Los tests del motor de IA comprueban que ambas
+# copias coinciden; si cambian las reglas, se actualizan las dos.
+
+from typing import Dict, Iterable, List
+
+DOLOR_KEYWORDS = ["fuerte", "intenso", "agudo", "10/10"]
+URGENCIA_KEYWORDS = ["urgente", "emergencia", "inmediata"]
+RIESGO_KEYWORDS = ["grave", "crítico", "complicado"]
+
+# Métrica -> (palabras clave, puntuación si aparece alguna, puntuación si no)
+METRIC_RULES = {
+    "dolor": (DOLOR_KEYWORDS, 8, 4),
+    "urgencia": (URGENCIA_KEYWORDS, 9, 3),
+    "riesgo": (RIESGO_KEYWORDS, 7, 2),
+}
+
+
+class TriageScorer:
+    """
+    Métricas [dolor, urgencia, riesgo] por palabras clave. Cada texto se pasa a minúsculas
+    una vez y cada métrica se corta en la primera coincidencia (búsqueda de subcadena).
+    """
+
+    def __init__(self, rules: Dict[str, tuple] = METRIC_RULES):
+        self.metrics = list(rules)
+        self._rules = [
+            (tuple(sorted({k.lower() for k in keywords}, key=len)), hit, miss)
+            for keywords, hit, miss in rules.values()
+        ]
+
+    def score(self, text: str) -> list:
+        texto = (text or "").lower()
+        return [hit if any(k in texto for k in keywords) else miss for keywords, hit, miss in self._rules]
+
+    def score_batch(self, texts: Iterable[str]) -> List[list]:
+        """Puntúa un lote; los textos repetidos (p.ej. respuestas por plantilla) se puntúan una vez."""
+        seen: Dict[str, list] = {}
+        return [seen[t] if t in seen else seen.setdefault(t, self.score(t)) for t in texts]
+
+
+triage_scorer = TriageScorer()
@@ -12,7 +12,8 @@ from .views import (
     export_paciente_pdf,
     # Añadimos las nuevas funciones de persistencia
     guardar_consulta,
-    historial_paciente
+    historial_paciente,
+    contexto_paciente
 )
 
 # El router se encarga de las rutas automáticas de los ViewSets
@@ -49,4 +50,7 @@ urlpatterns = [
     
     # 4. Exportación PDF
     path('export-pdf/<str:patient_id>/', export_paciente_pdf, name='export-pdf'),
+
+    # 5. Contexto clínico para el motor de IA (ficha + últimas consultas + métricas)
+    path('patient-context/<str:patient_id>/', contexto_paciente, name='patient-context'),
 ]
\ No newline at end of file
@@ -1,23 +1,34 @@
 from rest_framework import viewsets, status
 from rest_framework.response import Response
-from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.decorators import api_view, permission_classes, renderer_classes, action
+from rest_framework.parsers import JSONParser
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
+from rest_framework.settings import api_settings
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate
 from django.contrib.auth.hashers import make_password
 from rest_framework_simplejwt.tokens import RefreshToken
-from django.http import HttpResponse
-from django.db.models import Count
-from reportlab.pdfgen import canvas
-from reportlab.lib import colors
-from reportlab.lib.colors import HexColor  # Importación específica para colores Hex
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from datetime import datetime
-
-from .models import Patient, ConsultaIA
-from .serializers import PatientSerializer, AiAuditLogSerializer
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.http import parse_etags, quote_etag
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Avg, Count, Max, OuterRef, Q, Subquery
+from django.db.models.functions import Upper
+from functools import partial
+from itertools import islice
+
+from .models import Patient, ConsultaIA, normalizar_busqueda
+from .serializers import (
+    PatientSerializer, AiAuditLogSerializer, AuditLogFilterSerializer, ConsultaIABulkItemSerializer,
+    HistorialParamsSerializer, PatientContextParamsSerializer, PatientListParamsSerializer,
+    PATIENT_LIST_DEFAULT_FIELDS,
+)
+from .pagination import AuditLogCursorPagination, PatientPagination
+from .parsers import NDJSONParser
+from .renderers import NDJSONRenderer
+from .signals import invalidar_cache_paciente
+from .reports import consultas_informe, pdf_cache, pdf_jobs, render_pdf, report_key
 
 # --- VISTAS EXISTENTES (MODEL VIEWSETS) ---
 
@@ -28,10 +39,94 @@ class PatientViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
 
 class AiAuditLogViewSet(viewsets.ModelViewSet):
-    # Cambia '-created_at' por '-fecha'
-    queryset = ConsultaIA.objects.all().order_by('-fecha') 
+    # El orden (-fecha, -id) lo fija la paginación por cursor; select_related evita
+    # una consulta por fila al serializar el DNI del paciente
+    queryset = ConsultaIA.objects.select_related('paciente')
     serializer_class = AiAuditLogSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = AuditLogCursorPagination
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action != 'list':
+            return queryset
+        filtros = AuditLogFilterSerializer(data=self.request.query_params)
+        filtros.is_valid(raise_exception=True)
+        f = filtros.validated_data
+        if 'paciente' in f:
+            queryset = queryset.filter(paciente__username=f['paciente'])
+        if 'desde' in f:
+            queryset = queryset.filter(fecha__gte=f['desde'])
+        if 'hasta' in f:
+            queryset = queryset.filter(fecha__lt=f['hasta'])
+        if 'riesgo_min' in f:
+            queryset = queryset.filter(riesgo__gte=f['riesgo_min'])
+        if 'urgencia_min' in f:
+            queryset = queryset.filter(urgencia__gte=f['urgencia_min'])
+        return queryset
+
+    @action(detail=False, methods=['post'], url_path='bulk', parser_classes=[JSONParser, NDJSONParser],
+            permission_classes=[IsAdminUser])
+    def bulk(self, request):
+        """
+        Ingesta masiva: array JSON o NDJSON de consultas, insertadas con un único
+        bulk_create dentro de una transacción. Devuelve id o errores por elemento.
+        Solo personal o la cuenta de servicio del motor de IA: registra consultas a
+        nombre de cualquier paciente.
+        """
+        items = request.data
+        if not isinstance(items, list):
+            return Response({"error": "Se esperaba una lista de registros"}, status=400)
+        max_items = getattr(settings, 'AUDIT_BULK_MAX_ITEMS', 1000)
+        if len(items) > max_items:
+            return Response({"error": f"Máximo {max_items} registros por petición"}, status=413)
+
+        results = [None] * len(items)
+        validos = []
+        for i, item in enumerate(items):
+            serializer = ConsultaIABulkItemSerializer(data=item)
+            if serializer.is_valid():
+                validos.append((i, serializer.validated_data))
+            else:
+                results[i] = {"index": i, "errors": serializer.errors}
+
+        # Resolvemos todos los pacientes en una sola consulta
+        dnis = {d['patient_id'] for _, d in validos if d.get('patient_id')}
+        usuarios = User.objects.in_bulk(dnis, field_name='username') if dnis else {}
+
+        filas = []
+        for i, d in validos:
+            dni = d.get('patient_id')
+            paciente = usuarios.get(dni) if dni else request.user
+            if paciente is None:
+                results[i] = {"index": i, "errors": {"patient_id": [f"Paciente '{dni}' no encontrado"]}}
+                continue
+            filas.append((i, ConsultaIA(
+                paciente=paciente,
+                mensaje_usuario=d['mensaje_usuario'],
+                respuesta_ia=d['respuesta_ia'],
+                dolor=d['dolor'],
+                urgencia=d['urgencia'],
+                riesgo=d['riesgo'],
+            )))
+
+        with transaction.atomic():
+            creadas = ConsultaIA.objects.bulk_create([c for _, c in filas])
+            # bulk_create no emite post_save: el contexto cacheado en el motor de IA incluye
+            # las últimas consultas, así que se invalida por paciente afectado
+            for dni in {c.paciente.username for c in creadas}:
+                transaction.on_commit(partial(invalidar_cache_paciente, dni))
+        for (i, _), consulta in zip(filas, creadas):
+            results[i] = {"index": i, "id": consulta.id}
+
+        n_errores = len(items) - len(creadas)
+        if not n_errores:
+            codigo = status.HTTP_201_CREATED
+        elif creadas:
+            codigo = status.HTTP_207_MULTI_STATUS
+        else:
+            codigo = status.HTTP_400_BAD_REQUEST
+        return Response({"created": len(creadas), "errors": n_errores, "results": results}, status=codigo)
 
 # --- AUTENTICACIÓN ---
 
@@ -125,9 +220,29 @@ def manage_patients(request):
             pacientes = Patient.objects.all()
         else:
             pacientes = Patient.objects.filter(doctor=request.user)
-        
-        data = pacientes.values('id', 'patient_id', 'name', 'clinical_history', 'created_at')
-        return Response(list(data))
+
+        params = PatientListParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        campos = params.validated_data.get('fields', PATIENT_LIST_DEFAULT_FIELDS)
+
+        # Búsqueda por prefijo como rango (>= q, < q + U+FFFF): a diferencia de LIKE/istartswith,
+        # el rango sí usa los índices. El nombre se compara normalizado (sin tildes, casefold)
+        # y el DNI con UPPER(), que en SQLite coincide con str.upper() solo para ASCII
+        q = params.validated_data.get('q')
+        if q:
+            prefijo = normalizar_busqueda(q)
+            filtro = Q(nombre_busqueda__gte=prefijo, nombre_busqueda__lt=prefijo + '\uffff')
+            if q.isascii():
+                dni = q.upper()
+                pacientes = pacientes.alias(dni=Upper('patient_id'))
+                filtro |= Q(dni__gte=dni, dni__lt=dni + '\uffff')
+            pacientes = pacientes.filter(filtro)
+
+        # Orden alfabético servido por el índice (doctor, nombre_busqueda, id)
+        pacientes = pacientes.order_by('nombre_busqueda', 'id').values(*campos)
+        paginador = PatientPagination()
+        pagina = paginador.paginate_queryset(pacientes, request)
+        return paginador.get_paginated_response(pagina)
 
     elif request.method == 'POST':
         data = request.data
@@ -170,30 +285,112 @@ def guardar_consulta(request):
     except Exception as e:
         return Response({"error": f"Error al procesar el guardado: {str(e)}"}, status=400)
 
+def _id_usuario(username):
+    """Id del User (paciente) a partir de su DNI, o None si no existe."""
+    return User.objects.filter(username=username).values_list('id', flat=True).first()
+
+CAMPOS_HISTORIAL = ('mensaje_usuario', 'respuesta_ia', 'dolor', 'urgencia', 'riesgo', 'fecha')
+
+def _lineas_historial(filas, lote=100):
+    """NDJSON por lotes de líneas: memoria acotada por el tamaño de lote, no por el historial."""
+    while True:
+        bloque = list(islice(filas, lote))
+        if not bloque:
+            return
+        yield ''.join(
+            NDJSONRenderer.line(dict(zip(CAMPOS_HISTORIAL[:-1], fila[:-1]), fecha=fila[-1].strftime('%Y-%m-%d %H:%M')))
+            for fila in bloque
+        )
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@renderer_classes(api_settings.DEFAULT_RENDERER_CLASSES + [NDJSONRenderer])
 def historial_paciente(request, patient_id=None):
-    """Retorna el historial de consultas. Soporta vista de paciente y vista de médico."""
+    """
+    Retorna el historial de consultas. Soporta vista de paciente y vista de médico.
+    ?since= (ISO 8601) y ?limit= acotan el resultado; ?format=ndjson lo envía en streaming.
+    """
     if patient_id:
         # Lógica para médico: ver historial de un paciente específico
         if not request.user.is_staff:
             return Response({"error": "No autorizado"}, status=403)
-        consultas = ConsultaIA.objects.filter(paciente__username=patient_id).order_by('-fecha')
+        paciente_id = _id_usuario(patient_id)
+        if paciente_id is None:
+            return Response([])
     else:
         # Lógica para paciente: ver su propio historial
-        consultas = ConsultaIA.objects.filter(paciente=request.user).order_by('-fecha')
-
-    data = [{
-        "mensaje_usuario": c.mensaje_usuario,
-        "respuesta_ia": c.respuesta_ia,
-        "dolor": c.dolor,
-        "urgencia": c.urgencia,
-        "riesgo": c.riesgo,
-        "fecha": c.fecha.strftime('%Y-%m-%d %H:%M')
-    } for c in consultas]
+        paciente_id = request.user.id
+
+    params = HistorialParamsSerializer(data=request.query_params)
+    params.is_valid(raise_exception=True)
+
+    # Filtro directo por paciente_id (sin JOIN con auth_user): lo resuelve el índice
+    # (paciente, -fecha, -id) ya ordenado, y solo se leen las columnas del historial
+    consultas = ConsultaIA.objects.filter(paciente_id=paciente_id).order_by('-fecha', '-id')
+    if 'since' in params.validated_data:
+        consultas = consultas.filter(fecha__gt=params.validated_data['since'])
+    if 'limit' in params.validated_data:
+        consultas = consultas[:params.validated_data['limit']]
+
+    if request.accepted_renderer.format == NDJSONRenderer.format:
+        # Streaming: filas como tuplas leídas por bloques (cursor de servidor donde la BD lo permite)
+        filas = consultas.values_list(*CAMPOS_HISTORIAL).iterator(
+            chunk_size=getattr(settings, 'HISTORIAL_CHUNK_SIZE', 500)
+        )
+        return StreamingHttpResponse(_lineas_historial(filas), content_type=NDJSONRenderer.media_type)
+
+    data = [{**c, "fecha": c['fecha'].strftime('%Y-%m-%d %H:%M')} for c in consultas.values(*CAMPOS_HISTORIAL)]
     
     return Response(data)
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def contexto_paciente(request, patient_id):
+    """
+    Contexto clínico para el motor de IA en una sola respuesta: ficha del paciente,
+    últimas N consultas (?consultas=N) y métricas de triaje agregadas.
+    Tres consultas SQL fijas, sin importar cuántas consultas tenga el paciente.
+    """
+    if not request.user.is_staff:
+        return Response({"error": "No autorizado"}, status=403)
+
+    # El id del User del paciente (ConsultaIA.paciente, username = DNI) sale en la misma consulta
+    # que la ficha: las lecturas de consultas filtran por paciente_id con el índice (paciente, -fecha, -id)
+    ficha = Patient.objects.filter(patient_id=patient_id).annotate(
+        usuario_id=Subquery(User.objects.filter(username=OuterRef('patient_id')).values('id')[:1])
+    ).values('patient_id', 'name', 'clinical_history', 'usuario_id').first()
+    if ficha is None:
+        return Response({"error": "Paciente no encontrado"}, status=404)
+
+    params = PatientContextParamsSerializer(data=request.query_params)
+    params.is_valid(raise_exception=True)
+    n = min(params.validated_data.get('consultas', getattr(settings, 'PATIENT_CONTEXT_CONSULTAS', 5)),
+            getattr(settings, 'PATIENT_CONTEXT_MAX_CONSULTAS', 50))
+
+    consultas = ConsultaIA.objects.filter(paciente_id=ficha.pop('usuario_id'))
+    recientes = consultas.order_by('-fecha', '-id').values(
+        'mensaje_usuario', 'respuesta_ia', 'dolor', 'urgencia', 'riesgo', 'fecha'
+    )[:n] if n else []
+    metricas = consultas.aggregate(
+        total=Count('id'),
+        dolor_medio=Avg('dolor'),
+        urgencia_media=Avg('urgencia'),
+        urgencia_max=Max('urgencia'),
+        riesgo_medio=Avg('riesgo'),
+        ultima_consulta=Max('fecha'),
+    )
+    for campo in ('dolor_medio', 'urgencia_media', 'riesgo_medio'):
+        if metricas[campo] is not None:
+            metricas[campo] = round(metricas[campo], 2)
+    if metricas['ultima_consulta'] is not None:
+        metricas['ultima_consulta'] = metricas['ultima_consulta'].strftime('%Y-%m-%d %H:%M')
+
+    return Response({
+        **ficha,
+        "consultas": [{**c, "fecha": c['fecha'].strftime('%Y-%m-%d %H:%M')} for c in recientes],
+        "metricas": metricas,
+    })
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def change_password(request):
@@ -205,86 +402,69 @@ def change_password(request):
     user.save()
     return Response({"message": "Contraseña actualizada"}, status=200)
 
+def _etag_coincide(if_none_match, etag):
+    # Comparación débil (RFC 9110): W/"x" coincide con "x"
+    etags = parse_etags(if_none_match or '')
+    return '*' in etags or etag in [e.removeprefix('W/') for e in etags]
+
+def _con_etag(response, etag):
+    response['ETag'] = etag
+    # Datos clínicos: solo caché del navegador y siempre revalidando con el ETag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def export_paciente_pdf(request, patient_id):
-    # CAMBIO: paciente__username en lugar de paciente__credential
-    consultas = ConsultaIA.objects.filter(paciente__username=patient_id).order_by('-fecha')
+    """
+    Informe PDF del historial, cacheado en disco por versión (recuento, último id y último
+    cambio de sus consultas, y cabecera del paciente) y con ETag: If-None-Match con la versión vigente
+    responde 304. Historiales desde PDF_ASYNC_MIN_CONSULTAS consultas (o ?modo=async) se
+    generan en segundo plano: 202 con la URL a sondear, que es esta misma.
+    """
+    # El paciente se resuelve una vez; la versión sale del índice (paciente, actualizado)
+    paciente = User.objects.filter(username=patient_id).values('id', 'first_name', 'last_name', 'email').first()
+    resumen = ConsultaIA.objects.filter(paciente_id=paciente['id']).aggregate(
+        total=Count('id'), ultimo_id=Max('id'), actualizado=Max('actualizado')
+    ) if paciente else {'total': 0}
     
-    if not consultas.exists():
+    if not resumen['total']:
         return HttpResponse("No hay consultas para este paciente", status=404)
-    
-    try:
-        # CAMBIO: username=patient_id en lugar de credential=patient_id
-        paciente_obj = User.objects.get(username=patient_id)
-        nombre_completo = f"{paciente_obj.first_name} {paciente_obj.last_name}"
-        email_paciente = paciente_obj.email
-    except User.DoesNotExist:
-        nombre_completo = "No registrado"
-        email_paciente = "N/A"
 
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename="Historial_Clinico_{patient_id}.pdf"'
+    key = report_key(patient_id, paciente, resumen['total'], resumen['ultimo_id'], resumen['actualizado'])
+    etag = quote_etag(key)
+    if _etag_coincide(request.headers.get('If-None-Match'), etag):
+        return _con_etag(HttpResponseNotModified(), etag)
 
-    doc = SimpleDocTemplate(response, pagesize=letter)
-    elements = []
-    styles = getSampleStyleSheet()
-    
-    primary_color = HexColor("#1C83E1")
-    
-    # Estilos personalizados
-    title_style = ParagraphStyle('TitleStyle', parent=styles['Heading1'], textColor=primary_color, spaceAfter=12)
-    header_style = ParagraphStyle('HeaderStyle', parent=styles['Normal'], fontSize=10, textColor=colors.grey)
-    body_style = ParagraphStyle('BodyStyle', parent=styles['Normal'], fontSize=9, leading=12)
-
-    # --- ENCABEZADO PROFESIONAL ---
-    elements.append(Paragraph("🏥 OMNICARE AI - INFORME CLÍNICO DIGITAL", title_style))
-    elements.append(Paragraph(f"<b>Paciente:</b> {nombre_completo}", styles['Normal']))
-    elements.append(Paragraph(f"<b>credential/ID:</b> {patient_id} | <b>Email:</b> {email_paciente}", header_style))
-    elements.append(Paragraph(f"<b>Fecha de Generación:</b> {datetime.now().strftime('%d/%m/%Y %H:%M')}", header_style))
-    elements.append(Spacer(1, 20))
-
-    # --- TABLA DE CONSULTAS ---
-    data = [["FECHA", "MÉTRICAS TRIAJE", "RESUMEN DE CONSULTA"]]
-    
-    for c in consultas:
-        # Formateamos las métricas de forma más visual
-        metrics = f"Dolor: {c.dolor}/10\nUrgencia: {c.urgencia}\nRiesgo: {c.riesgo}"
-        # Resumen limpio del mensaje
-        msg_summary = (c.mensaje_usuario[:150] + '...') if len(c.mensaje_usuario) > 150 else c.mensaje_usuario
-        
-        data.append([
-            c.fecha.strftime('%d/%m/%Y\n%H:%M'), 
-            metrics, 
-            Paragraph(msg_summary, body_style)
-        ])
-
-    # Ajuste de anchos: Fecha(80), Métricas(140), Resumen(300)
-    t = Table(data, colWidths=[80, 140, 300])
-    t.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), primary_color),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 9),
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.whitesmoke]),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-        ('TOPPADDING', (0, 0), (-1, -1), 8),
-    ]))
-    
-    elements.append(t)
-    
-    # --- PIE DE PÁGINA / NOTA LEGAL ---
-    elements.append(Spacer(1, 30))
-    nota_legal = """
-    <i fontSize="8">Este documento ha sido generado automáticamente por el sistema de IA OmniCare. 
-    Los datos de triaje son orientativos y deben ser validados por un facultativo colegiado. 
-    Cumple con la normativa RGPD de protección de datos de salud.</i>
-    """
-    elements.append(Paragraph(nota_legal, header_style))
+    nombre_fichero = f"Historial_Clinico_{patient_id}.pdf"
+    cacheado = pdf_cache.get(patient_id, key)
+    if cacheado is not None:
+        try:
+            return _con_etag(FileResponse(open(cacheado, 'rb'), as_attachment=True, filename=nombre_fichero,
+                                          content_type='application/pdf'), etag)
+        except FileNotFoundError:
+            pass  # Sustituido por una versión más nueva entre la comprobación y la apertura
 
-    doc.build(elements)
-    return response
+    error = pdf_jobs.pop_failed(patient_id, key)
+    if error is not None:
+        return Response({"error": f"Error generando el informe: {error}"}, status=500)
+
+    poll = request.build_absolute_uri(reverse('export-pdf', args=[patient_id]))
+    en_proceso = Response({"status": "pending", "poll": poll}, status=202,
+                          headers={'Location': poll, 'Retry-After': '2'})
+    if pdf_jobs.pending(patient_id, key):
+        return en_proceso
+
+    if (request.query_params.get('modo') == 'async'
+            or resumen['total'] >= getattr(settings, 'PDF_ASYNC_MIN_CONSULTAS', 1000)):
+        # El trabajo lee sus propias filas: la petición no carga el historial
+        pdf_jobs.submit(patient_id, key, paciente)
+        return en_proceso
+
+    consultas = consultas_informe(paciente['id'])
+    contenido = render_pdf(patient_id, paciente, consultas)
+    pdf_cache.set(patient_id, key, contenido)
+    response = HttpResponse(contenido, content_type='application/pdf')
+    response['Content-Disposition'] = f'attachment; filename="{nombre_fichero}"'
+    return _con_etag(response, etag)
 
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -148,4 +149,35 @@ SIMPLE_JWT = {
 AUTHENTICATION_BACKENDS = [
     'medical_records.auth_backends.EmailOrUsernameModelBackend', # Tu lógica personalizada
     'django.contrib.auth.backends.ModelBackend',                # Backend por defecto de Django
-]
\ No newline at end of file
+]
+
+# --- MOTOR DE IA (FastAPI) ---
+# Se usa para invalidar la caché de contexto clínico al modificar un Patient.
+# Vacío (por defecto) = sin notificaciones, p.ej. en tests o sin motor de IA desplegado.
+AI_ENGINE_URL = os.getenv('AI_ENGINE_URL', '')
+AI_ENGINE_TIMEOUT = float(os.getenv('AI_ENGINE_TIMEOUT', '0.5'))
+
+# Máximo de registros aceptados por /api/audit-logs/bulk/
+AUDIT_BULK_MAX_ITEMS = int(os.getenv('AUDIT_BULK_MAX_ITEMS', '1000'))
+
+# Página de /api/audit-logs/ (paginación por cursor; ?page_size= hasta el máximo)
+AUDIT_PAGE_SIZE = int(os.getenv('AUDIT_PAGE_SIZE', '100'))
+AUDIT_MAX_PAGE_SIZE = int(os.getenv('AUDIT_MAX_PAGE_SIZE', '1000'))
+
+# Página de /api/manage-patients/ (?page_size= hasta el máximo)
+PATIENT_LIST_PAGE_SIZE = int(os.getenv('PATIENT_LIST_PAGE_SIZE', '50'))
+PATIENT_LIST_MAX_PAGE_SIZE = int(os.getenv('PATIENT_LIST_MAX_PAGE_SIZE', '500'))
+
+# Informes PDF: caché en disco y generación en segundo plano para historiales grandes
+PDF_CACHE_DIR = os.getenv('PDF_CACHE_DIR', str(BASE_DIR / 'pdf_cache'))
+PDF_ASYNC_MIN_CONSULTAS = int(os.getenv('PDF_ASYNC_MIN_CONSULTAS', '1000'))
+PDF_JOB_WORKERS = int(os.getenv('PDF_JOB_WORKERS', '2'))
+# Segundos tras los que una generación en curso se da por abandonada (worker caído)
+PDF_JOB_TIMEOUT = float(os.getenv('PDF_JOB_TIMEOUT', '600'))
+
+# Filas leídas por bloque en /api/historial-paciente/?format=ndjson
+HISTORIAL_CHUNK_SIZE = int(os.getenv('HISTORIAL_CHUNK_SIZE', '500'))
+
+# Consultas recientes incluidas en /api/patient-context/<id>/ (por defecto y máximo)
+PATIENT_CONTEXT_CONSULTAS = int(os.getenv('PATIENT_CONTEXT_CONSULTAS', '5'))
+PATIENT_CONTEXT_MAX_CONSULTAS = int(os.getenv('PATIENT_CONTEXT_MAX_CONSULTAS', '50'))